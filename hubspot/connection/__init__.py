@@ -13,13 +13,14 @@
 # INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
 #
 ##############################################################################
-from builtins import str as text
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
 from json import dumps as json_serialize
+from time import time
 
-from pkg_resources import get_distribution
 from pyrecord import Record
-from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
+from requests.packages.urllib3.util.retry import Retry
 from requests.sessions import Session
 from six.moves.http_client import ACCEPTED as HTTP_STATUS_ACCEPTED
 from six.moves.http_client import NO_CONTENT as HTTP_STATUS_NO_CONTENT
@@ -29,33 +30,49 @@ from six.moves.urllib.parse import parse_qs
 from six.moves.urllib.parse import urlencode
 from six.moves.urllib.parse import urlsplit
 from six.moves.urllib.parse import urlunsplit
-from voluptuous import Schema
 
-from hubspot.connection._validators import Constant
 from hubspot.connection.exc import HubspotAuthenticationError
 from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotException
 from hubspot.connection.exc import HubspotInvalidResponseError
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotRequestRejectedError
 from hubspot.connection.exc import HubspotServerError
 from hubspot.connection.exc import HubspotUnsupportedResponseError
+from hubspot.connection.pooling import _PoolingHTTPAdapter
 
 
 _DISTRIBUTION_NAME = 'hubspot-connection'
-_DISTRIBUTION_VERSION = get_distribution(_DISTRIBUTION_NAME).version
-_USER_AGENT = 'HubSpot Python Client/' + _DISTRIBUTION_VERSION
 
+_USER_AGENT_PREFIX = 'HubSpot Python Client/'
 
-_HUBSPOT_ERROR_RESPONSE_SCHEMA = Schema(
-    {
-        'status': Constant('error'),
-        'message': text,
-        'requestId': text,
-        },
-    required=True,
-    extra=True,
-    )
+_USER_AGENT = None
 
 
-_HTTP_CONNECTION_MAX_RETRIES = 3
+_HUBSPOT_ERROR_RESPONSE_SCHEMA = None
+
+
+# Responses are never retried, so that rate limit errors reach the caller
+# instead of being retried after the delay in their Retry-After header
+_HTTP_CONNECTION_RETRY = Retry(3, respect_retry_after_header=False)
+
+
+_HTTP_STATUS_TOO_MANY_REQUESTS = 429
+
+
+_REQUEST_ID_HEADER_NAME = 'x-hubspot-correlation-id'
+
+_RATE_LIMIT_HEADER_NAME_PREFIX = 'x-hubspot-ratelimit-'
+
+_RETRY_AFTER_HEADER_NAME = 'retry-after'
+
+
+_DEFAULT_POOL_SIZE = 10
+
+
+# Response bodies at least this large are deserialized between yields to
+# other greenlets in cooperative mode, so that they don't get starved
+_LARGE_RESPONSE_BODY_SIZE = 64 * 1024
 
 
 _HTTP_STATUS_CODES_WITH_EMPTY_BODIES = \
@@ -70,42 +87,169 @@ class PortalConnection(object):
             :class:`OAuthKey` instance
     :param basestring change_source: The string passed to HubSpot as \
             ``auditId`` in the query string
+    :param basestring api_url: The URL to the HubSpot API, which defaults to \
+            ``https://api.hubapi.com``
+    :param concurrency_limiter: An optional \
+            :class:`~hubspot.connection.concurrency.AdaptiveConcurrencyLimiter`
+    :param request_scheduler: An optional \
+            :class:`~hubspot.connection.concurrency.RequestScheduler`
+    :param metrics_registry: An optional \
+            :class:`~hubspot.connection.metrics.MetricsRegistry`
+    :param daily_quota: An optional \
+            :class:`~hubspot.connection.quota.DailyQuota`
+    :param dns_cache: An optional \
+            :class:`~hubspot.connection.pooling.DNSCache`
+    :param flight_recorder: An optional \
+            :class:`~hubspot.connection.flight_recorder.FlightRecorder`
+    :param float max_idle_age: The number of seconds after which idle \
+            keep-alive connections are closed instead of being reused, if \
+            any, which should be shorter than the time after which \
+            HubSpot's load balancers close them. They're also closed in the \
+            background once that old.
+    :param int pool_size: The number of keep-alive connections to keep open
+    :param bool cooperative: Whether the connection is used from greenlets \
+            in a process monkey-patched by gevent, in which case requests \
+            wait for a free connection in the pool without blocking other \
+            greenlets, and large responses are deserialized between yields \
+            to them
     """
     _API_URL = 'https://api.hubapi.com'
 
-    def __init__(self, authentication_key, change_source):
+    def __init__(
+        self,
+        authentication_key,
+        change_source,
+        api_url=None,
+        concurrency_limiter=None,
+        request_scheduler=None,
+        metrics_registry=None,
+        daily_quota=None,
+        dns_cache=None,
+        pool_size=_DEFAULT_POOL_SIZE,
+        cooperative=False,
+        flight_recorder=None,
+        max_idle_age=None,
+        ):
         super(PortalConnection, self).__init__()
 
         self._authentication_handler = \
             _QueryStringAuthenticationHandler(authentication_key)
         self._change_source = change_source
+        self._api_url = api_url or self._API_URL
+        self._concurrency_limiter = concurrency_limiter
+        self._request_scheduler = request_scheduler
+        self._metrics_registry = metrics_registry
+        self._daily_quota = daily_quota
+        self._flight_recorder = flight_recorder
+
+        self._rate_limit_headers = {}
 
         self._session = Session()
-        self._session.headers['User-Agent'] = _USER_AGENT
+        self._session.headers['User-Agent'] = _get_user_agent()
+
+        if cooperative:
+            from hubspot.connection.cooperative import \
+                _COOPERATIVE_POOL_CLASSES_BY_SCHEME
+            from hubspot.connection.cooperative import \
+                yield_to_other_greenlets
+
+            pool_classes_by_scheme = _COOPERATIVE_POOL_CLASSES_BY_SCHEME
+            self._yield_to_other_greenlets = yield_to_other_greenlets
+        else:
+            pool_classes_by_scheme = None
+            self._yield_to_other_greenlets = None
+
+        self._http_adapter = _PoolingHTTPAdapter(
+            dns_cache,
+            pool_classes_by_scheme,
+            max_idle_age,
+            pool_maxsize=pool_size,
+            pool_block=cooperative,
+            max_retries=_HTTP_CONNECTION_RETRY,
+            )
+        self._session.mount('http://', self._http_adapter)
+        self._session.mount('https://', self._http_adapter)
+
+    def warm_up(self, connection_count):
+        """
+        Open keep-alive connections to HubSpot in parallel, so that the next
+        requests don't wait for the DNS lookup, TCP handshake and TLS
+        handshake.
 
-        http_adapter = HTTPAdapter(max_retries=_HTTP_CONNECTION_MAX_RETRIES)
-        self._session.mount('', http_adapter)
+        :param int connection_count: The number of connections to open, up \
+                to the size of the pool
+        :return: The number of connections open
+        :rtype: int
 
-    def send_get_request(self, url_path, query_string_args=None):
+        """
+        connection_count = self._http_adapter.open_connections(
+            self._session,
+            self._api_url,
+            connection_count,
+            )
+        return connection_count
+
+    def close_idle_connections(self):
+        """
+        Close the keep-alive connections which have been idle for longer than
+        ``max_idle_age``, without waiting for them to be closed in the
+        background.
+
+        """
+        self._http_adapter.close_idle_connections()
+
+    def get_pool_statistics(self):
+        """
+        Return how many times a connection was taken from the pool in each
+        state, and how many idle connections were closed in the background.
+
+        :rtype: :class:`~hubspot.connection.pooling.PoolStatistics`
+
+        """
+        return self._http_adapter.get_statistics()
+
+    def get_rate_limit_headers(self):
+        """
+        Return the ``X-HubSpot-RateLimit-*`` headers of the last response
+        which had any, by lowercase name.
+
+        :rtype: :class:`dict`
+
+        """
+        return dict(self._rate_limit_headers)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
         """
         Send a GET request to HubSpot
 
         :param basestring url_path: The URL path to the endpoint
         :param dict query_string_args: The query string arguments
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` \
+                of the request, if any
 
         :return: Decoded version of the ``JSON`` that HubSpot put in \
                 the body of the response.
 
         """
-        return self._send_request('GET', url_path, query_string_args)
+        return self._send_request(
+            'GET',
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
 
-    def send_post_request(self, url_path, body_deserialization):
+    def send_post_request(self, url_path, body_deserialization, priority=None):
         """
         Send a POST request to HubSpot
 
         :param basestring url_path: The URL path to the endpoint
         :param dict body_deserialization: The request's body message \
-            deserialized
+            deserialized, or already serialized as described in \
+            :meth:`send_put_request`
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` \
+                of the request, if any
 
         :return: Decoded version of the ``JSON`` that HubSpot put in \
                 the body of the response.
@@ -114,14 +258,21 @@ class PortalConnection(object):
             'POST',
             url_path,
             body_deserialization=body_deserialization,
+            priority=priority,
             )
 
-    def send_put_request(self, url_path, body_deserialization):
+    def send_put_request(self, url_path, body_deserialization, priority=None):
         """
         Send a PUT request to HubSpot
 
         :param basestring url_path: The URL path to the endpoint
-        :param body_deserialization: The request's body message deserialized
+        :param body_deserialization: The request's body message \
+            deserialized, or its JSON serialization as :class:`bytes`, a \
+            :class:`bytearray` or a :class:`memoryview`, or an iterator of \
+            byte strings which is sent with chunked transfer encoding
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` \
+                of the request, if any
 
         :return: Decoded version of the ``JSON`` that HubSpot put in \
                 the body of the response.
@@ -130,18 +281,22 @@ class PortalConnection(object):
             'PUT',
             url_path,
             body_deserialization=body_deserialization,
+            priority=priority,
             )
 
-    def send_delete_request(self, url_path):
+    def send_delete_request(self, url_path, priority=None):
         """
         Send a DELETE request to HubSpot
 
         :param basestring url_path: The URL path to the endpoint
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` \
+                of the request, if any
 
         :return: Decoded version of the ``JSON`` that HubSpot put in \
                 the body of the response.
         """
-        return self._send_request('DELETE', url_path)
+        return self._send_request('DELETE', url_path, priority=priority)
 
     def _send_request(
         self,
@@ -149,33 +304,168 @@ class PortalConnection(object):
         url_path,
         query_string_args=None,
         body_deserialization=None,
+        priority=None,
         ):
-        url = self._API_URL + url_path
+        url = self._api_url + url_path
 
         query_string_args = query_string_args or {}
         query_string_args = dict(query_string_args, auditId=self._change_source)
 
-        request_headers = \
-            {'content-type': 'application/json'} if body_deserialization else {}
-
-        if body_deserialization:
-            request_body_serialization = json_serialize(body_deserialization)
+        if body_deserialization is None:
+            request_headers = {}
         else:
-            request_body_serialization = None
+            request_headers = {'content-type': 'application/json'}
+        request_body_serialization = \
+            _serialize_request_body(body_deserialization)
+
+        wait_start_time = time()
+        request_start_time = None
+        request_latency = None
+        response = None
+        try:
+            if self._daily_quota:
+                self._daily_quota.acquire(priority)
+            if self._request_scheduler:
+                try:
+                    self._request_scheduler.acquire(priority)
+                except HubspotRequestRejectedError:
+                    if self._daily_quota:
+                        self._daily_quota.refund(priority)
+                    raise
+            request_start_time = time()
+            try:
+                response = self._send_http_request(
+                    method,
+                    url,
+                    query_string_args,
+                    request_body_serialization,
+                    request_headers,
+                    )
+            finally:
+                request_latency = time() - request_start_time
+                if self._request_scheduler:
+                    self._request_scheduler.release(priority)
+
+            if self._daily_quota:
+                self._daily_quota.update(response.headers)
+
+            rate_limit_headers = _get_rate_limit_headers(response.headers)
+            if rate_limit_headers:
+                self._rate_limit_headers = rate_limit_headers
 
-        response = self._session.request(
+            response_body_deserialization = \
+                self._deserialize_response_body_cooperatively(response)
+        except Exception as exception:
+            if isinstance(exception, HubspotException):
+                _add_response_metadata_to_exception(
+                    exception,
+                    response,
+                    request_latency,
+                    )
+            self._record_request(
+                method,
+                url_path,
+                request_body_serialization,
+                wait_start_time,
+                request_start_time,
+                request_latency,
+                response,
+                exception,
+                )
+            raise
+
+        self._record_request(
             method,
-            url,
-            params=query_string_args,
-            auth=self._authentication_handler,
-            data=request_body_serialization,
-            headers=request_headers,
+            url_path,
+            request_body_serialization,
+            wait_start_time,
+            request_start_time,
+            request_latency,
+            response,
             )
+        return response_body_deserialization
+
+    def _deserialize_response_body_cooperatively(self, response):
+        is_response_large = self._yield_to_other_greenlets and \
+            _LARGE_RESPONSE_BODY_SIZE <= len(response.content)
+        if is_response_large:
+            self._yield_to_other_greenlets()
 
         response_body_deserialization = \
             self._deserialize_response_body(response)
+
+        if is_response_large:
+            self._yield_to_other_greenlets()
+
         return response_body_deserialization
 
+    def _record_request(
+        self,
+        method,
+        url_path,
+        request_body_serialization,
+        wait_start_time,
+        request_start_time,
+        request_latency,
+        response,
+        exception=None,
+        ):
+        status_code = response.status_code if response is not None else None
+
+        if self._metrics_registry:
+            self._metrics_registry.record_request(
+                method,
+                url_path,
+                request_latency,
+                status_code,
+                exception,
+                _get_request_body_size(request_body_serialization),
+                len(response.content) if response is not None else 0,
+                )
+
+        if self._flight_recorder:
+            wait_end_time = request_start_time or time()
+            self._flight_recorder.record_request(
+                method,
+                url_path,
+                wait_start_time,
+                wait_end_time - wait_start_time,
+                request_latency,
+                status_code,
+                _get_retry_count(response),
+                exception,
+                )
+
+    def _send_http_request(
+        self,
+        method,
+        url,
+        query_string_args,
+        request_body_serialization,
+        request_headers,
+        ):
+        if self._concurrency_limiter:
+            self._concurrency_limiter.acquire()
+        request_start_time = time()
+        is_hubspot_overloaded = True
+        try:
+            response = self._session.request(
+                method,
+                url,
+                params=query_string_args,
+                auth=self._authentication_handler,
+                data=request_body_serialization,
+                headers=request_headers,
+                )
+            is_hubspot_overloaded = _is_response_overloaded(response)
+        finally:
+            if self._concurrency_limiter:
+                self._concurrency_limiter.release(
+                    time() - request_start_time,
+                    is_hubspot_overloaded,
+                    )
+        return response
+
     @classmethod
     def _deserialize_response_body(cls, response):
         cls._require_successful_response(response)
@@ -195,10 +485,13 @@ class PortalConnection(object):
 
     @classmethod
     def _require_successful_response(cls, response):
-        if 400 <= response.status_code < 500:
+        if response.status_code == _HTTP_STATUS_TOO_MANY_REQUESTS:
+            cls._raise_rate_limit_error(response)
+        elif 400 <= response.status_code < 500:
             cls._require_json_response(response)
             response_data = cls._deserialize_json_response(response)
-            error_data = _HUBSPOT_ERROR_RESPONSE_SCHEMA(response_data)
+            error_response_schema = _get_hubspot_error_response_schema()
+            error_data = error_response_schema(response_data)
 
             if response.status_code == HTTP_STATUS_UNAUTHORIZED:
                 exception_class = HubspotAuthenticationError
@@ -211,6 +504,23 @@ class PortalConnection(object):
         elif 500 <= response.status_code < 600:
             raise HubspotServerError(response.reason, response.status_code)
 
+    @staticmethod
+    def _raise_rate_limit_error(response):
+        # HubSpot's rate limiter doesn't always respond with the usual error
+        # message, so the body is only used if it happens to have one
+        try:
+            response_data = response.json()
+        except ValueError:
+            response_data = None
+        if not isinstance(response_data, dict):
+            response_data = {}
+
+        raise HubspotRateLimitError(
+            response_data.get('message') or response.reason,
+            response_data.get('requestId'),
+            _get_retry_after(response.headers),
+            )
+
     @staticmethod
     def _require_json_response(response):
         content_type_header_value = response.headers.get('Content-Type')
@@ -239,6 +549,146 @@ class PortalConnection(object):
         self._session.close()
 
 
+def _serialize_request_body(body_deserialization):
+    if body_deserialization is None:
+        request_body_serialization = None
+    elif isinstance(body_deserialization, memoryview):
+        request_body_serialization = body_deserialization
+        if request_body_serialization.format != 'B':
+            request_body_serialization = request_body_serialization.cast('B')
+    elif isinstance(body_deserialization, (bytes, bytearray)) or \
+            _is_iterator(body_deserialization):
+        request_body_serialization = body_deserialization
+    else:
+        request_body_serialization = json_serialize(body_deserialization)
+    return request_body_serialization
+
+
+def _is_iterator(object_):
+    try:
+        is_iterator = iter(object_) is object_
+    except TypeError:
+        is_iterator = False
+    return is_iterator
+
+
+def _get_request_body_size(request_body_serialization):
+    if request_body_serialization is None or \
+            _is_iterator(request_body_serialization):
+        # The size of streamed bodies is unknown
+        request_body_size = 0
+    else:
+        request_body_size = len(request_body_serialization)
+    return request_body_size
+
+
+def _get_retry_count(response):
+    if response is None:
+        return None
+
+    retry = getattr(response.raw, 'retries', None)
+    retry_count = len(retry.history) if retry else 0
+    return retry_count
+
+
+def _add_response_metadata_to_exception(exception, response, elapsed_time):
+    exception.elapsed_time = elapsed_time
+
+    if response is None:
+        return
+
+    exception.http_status_code = response.status_code
+    exception.response_headers = {
+        header_name.lower(): header_value
+        for header_name, header_value in response.headers.items()
+        if _is_exception_response_header_name(header_name.lower())
+        }
+    if exception.request_id is None:
+        exception.request_id = \
+            exception.response_headers.get(_REQUEST_ID_HEADER_NAME)
+
+
+def _get_rate_limit_headers(response_headers):
+    rate_limit_headers = {
+        header_name.lower(): header_value
+        for header_name, header_value in response_headers.items()
+        if header_name.lower().startswith(_RATE_LIMIT_HEADER_NAME_PREFIX)
+        }
+    return rate_limit_headers
+
+
+def _is_exception_response_header_name(header_name):
+    return header_name in (_REQUEST_ID_HEADER_NAME, _RETRY_AFTER_HEADER_NAME) \
+        or header_name.startswith(_RATE_LIMIT_HEADER_NAME_PREFIX)
+
+
+def _get_retry_after(response_headers):
+    header_value = response_headers.get(_RETRY_AFTER_HEADER_NAME)
+    if header_value is None:
+        return None
+
+    try:
+        retry_after = float(header_value)
+    except ValueError:
+        retry_date = parsedate_tz(header_value)
+        if retry_date is None:
+            return None
+        retry_after = mktime_tz(retry_date) - time()
+    return max(retry_after, 0.0)
+
+
+def _is_response_overloaded(response):
+    return response.status_code == _HTTP_STATUS_TOO_MANY_REQUESTS or \
+        500 <= response.status_code < 600
+
+
+def _get_user_agent():
+    global _USER_AGENT
+    if _USER_AGENT is None:
+        _USER_AGENT = _USER_AGENT_PREFIX + _get_distribution_version()
+    return _USER_AGENT
+
+
+def _get_distribution_version():
+    try:
+        from importlib.metadata import version as get_version
+    except ImportError:
+        # Python < 3.8
+        from pkg_resources import get_distribution
+        distribution_version = get_distribution(_DISTRIBUTION_NAME).version
+    else:
+        distribution_version = get_version(_DISTRIBUTION_NAME)
+    return distribution_version
+
+
+def _get_hubspot_error_response_schema():
+    """
+    Return the schema for HubSpot's error responses.
+
+    The schema is built on first use because importing voluptuous is only
+    worth it once a 4XX response is actually received.
+
+    """
+    global _HUBSPOT_ERROR_RESPONSE_SCHEMA
+    if _HUBSPOT_ERROR_RESPONSE_SCHEMA is None:
+        from builtins import str as text
+
+        from voluptuous import Schema
+
+        from hubspot.connection._validators import Constant
+
+        _HUBSPOT_ERROR_RESPONSE_SCHEMA = Schema(
+            {
+                'status': Constant('error'),
+                'message': text,
+                'requestId': text,
+                },
+            required=True,
+            extra=True,
+            )
+    return _HUBSPOT_ERROR_RESPONSE_SCHEMA
+
+
 _AuthenticationKey = Record.create_type('_AuthenticationKey', 'key_value')
 
 OAuthKey = _AuthenticationKey.extend_type('OAuthKey')
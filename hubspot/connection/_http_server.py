@@ -0,0 +1,247 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from abc import abstractmethod
+from abc import ABCMeta
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from math import ceil
+
+from pyrecord import Record
+from six import with_metaclass
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.BaseHTTPServer import HTTPServer
+from six.moves.http_client import NO_CONTENT as HTTP_STATUS_NO_CONTENT
+from six.moves.http_client import OK as HTTP_STATUS_OK
+from six.moves.http_client import UNAUTHORIZED as HTTP_STATUS_UNAUTHORIZED
+from six.moves.http_client import responses as HTTP_STATUS_REASONS
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlsplit
+
+from hubspot.connection.exc import HubspotAuthenticationError
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotInvalidResponseError
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotServerError
+
+
+_HTTP_STATUS_BAD_REQUEST = 400
+
+_HTTP_STATUS_TOO_MANY_REQUESTS = 429
+
+_HTTP_STATUS_INTERNAL_SERVER_ERROR = 500
+
+# Arguments set by PortalConnection itself, rather than by its callers
+_CONNECTION_QUERY_STRING_ARG_NAMES = \
+    frozenset(('access_token', 'auditId', 'hapikey'))
+
+
+APIResponse = Record.create_type(
+    'APIResponse',
+    'status_code',
+    'reason',
+    'headers',
+    'body',
+    headers=(),
+    body=b'',
+    )
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    allow_reuse_address = True
+
+
+class APIRequestHandler(with_metaclass(ABCMeta, BaseHTTPRequestHandler)):
+    """
+    Request handler which decodes each request the way
+    :class:`~hubspot.connection.PortalConnection` encodes it.
+
+    Subclasses must implement :meth:`handle_api_request`.
+
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle_http_request('GET')
+
+    def do_POST(self):
+        self._handle_http_request('POST')
+
+    def do_PUT(self):
+        self._handle_http_request('PUT')
+
+    def do_DELETE(self):
+        self._handle_http_request('DELETE')
+
+    @abstractmethod
+    def handle_api_request(
+        self,
+        http_method,
+        url_path,
+        query_string_args,
+        request_body_deserialization,
+        ):
+        """
+        Return the :class:`APIResponse` to the request, or ``None`` to drop
+        the connection without responding.
+
+        """
+        pass
+
+    def write_response_body(self, response_body):
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle_http_request(self, http_method):
+        url_parts = urlsplit(self.path)
+
+        query_string_args = \
+            parse_qs(url_parts.query, keep_blank_values=True)
+        for query_string_arg_name in _CONNECTION_QUERY_STRING_ARG_NAMES:
+            query_string_args.pop(query_string_arg_name, None)
+
+        request_body_deserialization = self._read_request_body()
+
+        api_response = self.handle_api_request(
+            http_method,
+            url_parts.path,
+            query_string_args,
+            request_body_deserialization,
+            )
+        if api_response is None:
+            self.close_connection = True
+        else:
+            self._write_api_response(api_response)
+
+    def _read_request_body(self):
+        transfer_encoding = self.headers.get('Transfer-Encoding', '')
+        if transfer_encoding.lower() == 'chunked':
+            request_body = self._read_chunked_request_body()
+        else:
+            request_body_length = int(self.headers.get('Content-Length') or 0)
+            request_body = self.rfile.read(request_body_length)
+
+        if request_body:
+            request_body_deserialization = \
+                json_deserialize(request_body.decode('UTF-8'))
+        else:
+            request_body_deserialization = None
+        return request_body_deserialization
+
+    def _read_chunked_request_body(self):
+        chunks = []
+        while True:
+            chunk_size_line = self.rfile.readline()
+            chunk_size = int(chunk_size_line.split(b';')[0], 16)
+            if not chunk_size:
+                break
+            chunks.append(self.rfile.read(chunk_size))
+            self.rfile.readline()
+
+        # Skip the trailer
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+
+        return b''.join(chunks)
+
+    def _write_api_response(self, api_response):
+        self.send_response(api_response.status_code, api_response.reason)
+        for header_name, header_value in api_response.headers:
+            self.send_header(header_name, header_value)
+        self.send_header('Content-Length', str(len(api_response.body)))
+        self.end_headers()
+
+        if api_response.body:
+            self.write_response_body(api_response.body)
+
+
+def make_api_response(response_body_deserialization):
+    if response_body_deserialization is None:
+        api_response = _make_api_response_for_status(HTTP_STATUS_NO_CONTENT)
+    else:
+        api_response = _make_json_api_response(
+            HTTP_STATUS_OK,
+            response_body_deserialization,
+            )
+    return api_response
+
+
+def make_api_response_for_exception(exception):
+    if isinstance(exception, HubspotClientError):
+        if exception.http_status_code:
+            status_code = exception.http_status_code
+        elif isinstance(exception, HubspotAuthenticationError):
+            status_code = HTTP_STATUS_UNAUTHORIZED
+        elif isinstance(exception, HubspotRateLimitError):
+            status_code = _HTTP_STATUS_TOO_MANY_REQUESTS
+        else:
+            status_code = _HTTP_STATUS_BAD_REQUEST
+        error_response_body_deserialization = {
+            'status': 'error',
+            'message': str(exception),
+            # HubSpot always identifies the request, and clients rely on it
+            'requestId': exception.request_id or '',
+            }
+        api_response = _make_json_api_response(
+            status_code,
+            error_response_body_deserialization,
+            )
+        retry_after = getattr(exception, 'retry_after', None)
+        response_headers = exception.response_headers or {}
+        if retry_after is not None and 'retry-after' not in response_headers:
+            api_response.headers.append(
+                ('Retry-After', str(int(ceil(retry_after)))),
+                )
+    elif isinstance(exception, HubspotServerError):
+        api_response = APIResponse(exception.http_status_code, exception.msg)
+    elif isinstance(exception, HubspotInvalidResponseError):
+        api_response = APIResponse(
+            HTTP_STATUS_OK,
+            HTTP_STATUS_REASONS[HTTP_STATUS_OK],
+            [('Content-Type', 'application/json')],
+            b'{',
+            )
+    else:
+        api_response = \
+            _make_api_response_for_status(_HTTP_STATUS_INTERNAL_SERVER_ERROR)
+
+    # Relay the headers of HubSpot's response, such as those on rate limits
+    response_headers = getattr(exception, 'response_headers', None)
+    if response_headers:
+        api_response.headers = \
+            list(api_response.headers) + sorted(response_headers.items())
+    return api_response
+
+
+def _make_json_api_response(status_code, response_body_deserialization):
+    response_body = json_serialize(response_body_deserialization)
+    api_response = APIResponse(
+        status_code,
+        HTTP_STATUS_REASONS.get(status_code, ''),
+        [('Content-Type', 'application/json; charset=UTF-8')],
+        response_body.encode('UTF-8'),
+        )
+    return api_response
+
+
+def _make_api_response_for_status(status_code):
+    api_response = APIResponse(status_code, HTTP_STATUS_REASONS[status_code])
+    return api_response
@@ -0,0 +1,66 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from hubspot.connection.exc import HubspotUnsupportedResponseError
+
+
+CONTACT_OFFSET_QUERY_STRING_ARG_NAMES_BY_RESPONSE_KEY = {
+    'vid-offset': 'vidOffset',
+    'time-offset': 'timeOffset',
+    }
+
+
+def iter_pages(
+    connection,
+    url_path,
+    query_string_args,
+    offset_query_string_args,
+    offset_query_string_arg_names_by_response_key,
+    has_more_key,
+    priority,
+    ):
+    """
+    Generate each page of a paginated collection, starting with the one at
+    ``offset_query_string_args``, along with the offsets to the next page and
+    whether there is one.
+
+    """
+    has_more_pages = True
+    while has_more_pages:
+        page_query_string_args = \
+            dict(query_string_args or {}, **offset_query_string_args)
+        page = connection.send_get_request(
+            url_path,
+            page_query_string_args,
+            priority=priority,
+            )
+
+        next_offset_query_string_args = {
+            query_string_arg_name: page[response_key]
+            for response_key, query_string_arg_name in
+            offset_query_string_arg_names_by_response_key.items()
+            if response_key in page
+            }
+        has_more_pages = page.get(has_more_key, False)
+
+        is_offset_stuck = not next_offset_query_string_args or \
+            next_offset_query_string_args == offset_query_string_args
+        if has_more_pages and is_offset_stuck:
+            raise HubspotUnsupportedResponseError(
+                'Page of {} without offsets to the next page'.format(url_path),
+                )
+        offset_query_string_args = next_offset_query_string_args
+
+        yield page, offset_query_string_args, has_more_pages
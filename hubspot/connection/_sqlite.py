@@ -0,0 +1,41 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from sqlite3 import connect as sqlite_connect
+
+
+class SQLiteConnection(object):
+    """
+    Context manager for a connection to an SQLite database, which commits
+    the transaction on success and closes the connection in any case.
+
+    """
+    def __init__(self, database_path):
+        super(SQLiteConnection, self).__init__()
+
+        self._database_connection = sqlite_connect(database_path, timeout=30)
+
+    def __enter__(self):
+        return self._database_connection.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            return self._database_connection.__exit__(
+                exc_type,
+                exc_value,
+                traceback,
+                )
+        finally:
+            self._database_connection.close()
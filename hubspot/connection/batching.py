@@ -0,0 +1,245 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from json import dumps as json_serialize
+from re import compile as compile_regex
+from threading import Event
+from threading import Lock
+from time import sleep
+
+from pyrecord import Record
+
+from hubspot.connection.exc import HubspotClientError
+
+
+BatchEndpoint = Record.create_type(
+    'BatchEndpoint',
+    'url_path_pattern',
+    'batch_url_path',
+    'id_query_string_arg_name',
+    'max_batch_size',
+    max_batch_size=100,
+    )
+
+
+CONTACT_PROFILE_BATCH_ENDPOINT = BatchEndpoint(
+    r'^/contacts/v1/contact/vid/(?P<id>\d+)/profile$',
+    '/contacts/v1/contact/vids/batch/',
+    'vid',
+    )
+
+
+class BatchingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    turns concurrent GET requests for single objects into requests to batch
+    endpoints
+
+    A GET request whose URL path matches the ``url_path_pattern`` of one of
+    the ``batch_endpoints`` is held for up to ``batch_window`` seconds, so
+    that the requests for other objects made in the meantime with the same
+    query string arguments and priority can join it. They're then all sent
+    as a single request to the ``batch_url_path``, with the identifiers of
+    the objects (captured by the ``id`` group of the pattern) in the
+    ``id_query_string_arg_name`` query string argument, and each caller gets
+    its object from the response. Each object is only requested once per
+    batch, however many callers ask for it, and a batch is sent as soon as
+    it holds ``max_batch_size`` objects.
+
+    An object missing from the response of the batch endpoint is reported
+    with a :class:`~hubspot.connection.exc.HubspotClientError`, as HubSpot
+    would for the single object. Other requests are sent as they are.
+
+    :param connection: The connection to wrap, which must be safe to use \
+            from several threads
+    :param batch_endpoints: The :class:`BatchEndpoint` instances
+    :param float batch_window: The number of seconds for which a batch \
+            waits for more requests
+
+    """
+    def __init__(
+        self,
+        connection,
+        batch_endpoints=(CONTACT_PROFILE_BATCH_ENDPOINT,),
+        batch_window=0.005,
+        ):
+        super(BatchingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._batch_endpoints_by_url_path_regex = [
+            (compile_regex(batch_endpoint.url_path_pattern), batch_endpoint)
+            for batch_endpoint in batch_endpoints
+            ]
+        self._batch_window = batch_window
+
+        self._lock = Lock()
+        self._pending_batches_by_key = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        for url_path_regex, batch_endpoint in \
+                self._batch_endpoints_by_url_path_regex:
+            url_path_match = url_path_regex.match(url_path)
+            if url_path_match:
+                return self._load_object(
+                    batch_endpoint,
+                    url_path_match.group('id'),
+                    query_string_args,
+                    priority,
+                    )
+
+        return self._connection.send_get_request(
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_post_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_put_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def _load_object(
+        self,
+        batch_endpoint,
+        object_id,
+        query_string_args,
+        priority,
+        ):
+        batch_key = _make_batch_key(
+            batch_endpoint,
+            query_string_args,
+            priority,
+            )
+        with self._lock:
+            batch = self._pending_batches_by_key.get(batch_key)
+            is_batch_new = batch is None
+            if is_batch_new:
+                batch = _Batch(batch_endpoint, query_string_args, priority)
+                self._pending_batches_by_key[batch_key] = batch
+
+            batch.add_object_id(object_id)
+
+            is_batch_full = \
+                batch_endpoint.max_batch_size <= len(batch.object_ids)
+            if is_batch_full:
+                del self._pending_batches_by_key[batch_key]
+
+        if is_batch_full:
+            self._send_batch(batch)
+        elif is_batch_new:
+            sleep(self._batch_window)
+            with self._lock:
+                is_batch_pending = \
+                    self._pending_batches_by_key.get(batch_key) is batch
+                if is_batch_pending:
+                    del self._pending_batches_by_key[batch_key]
+            if is_batch_pending:
+                self._send_batch(batch)
+
+        return batch.get_object(object_id)
+
+    def _send_batch(self, batch):
+        batch_endpoint = batch.batch_endpoint
+        query_string_args = dict(
+            batch.query_string_args or {},
+            **{batch_endpoint.id_query_string_arg_name: batch.object_ids}
+            )
+        try:
+            objects_by_id = self._connection.send_get_request(
+                batch_endpoint.batch_url_path,
+                query_string_args,
+                priority=batch.priority,
+                )
+        except Exception as exception:
+            batch.set_exception(exception)
+        else:
+            batch.set_objects(objects_by_id or {})
+
+
+class _Batch(object):
+
+    def __init__(self, batch_endpoint, query_string_args, priority):
+        super(_Batch, self).__init__()
+
+        self.batch_endpoint = batch_endpoint
+        self.query_string_args = query_string_args
+        self.priority = priority
+        self.object_ids = []
+
+        self._completion_event = Event()
+        self._objects_by_id = None
+        self._exception = None
+
+    def add_object_id(self, object_id):
+        if object_id not in self.object_ids:
+            self.object_ids.append(object_id)
+
+    def set_objects(self, objects_by_id):
+        self._objects_by_id = objects_by_id
+        self._completion_event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._completion_event.set()
+
+    def get_object(self, object_id):
+        self._completion_event.wait()
+
+        if self._exception is not None:
+            raise self._exception
+
+        object_ = self._objects_by_id.get(object_id)
+        if object_ is None:
+            raise HubspotClientError(
+                'Object {} not found in the response from {}'.format(
+                    object_id,
+                    self.batch_endpoint.batch_url_path,
+                    ),
+                None,
+                )
+        return object_
+
+
+def _make_batch_key(batch_endpoint, query_string_args, priority):
+    query_string_args_serialization = \
+        json_serialize(query_string_args or {}, sort_keys=True)
+    if priority:
+        priority_key = (priority.class_name, priority.tenant)
+    else:
+        priority_key = None
+    batch_key = (
+        batch_endpoint.batch_url_path,
+        query_string_args_serialization,
+        priority_key,
+        )
+    return batch_key
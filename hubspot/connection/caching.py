@@ -0,0 +1,370 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from sqlite3 import Binary
+from time import time
+from zlib import compress as zlib_compress
+from zlib import decompress as zlib_decompress
+
+from hubspot.connection._sqlite import SQLiteConnection
+
+
+_COMPRESSION_MIN_SIZE = 1024
+
+_CREATE_TABLE_STATEMENT = \
+    'CREATE TABLE IF NOT EXISTS {}responses (' \
+    'key TEXT PRIMARY KEY, ' \
+    'value BLOB NOT NULL, ' \
+    'size INTEGER NOT NULL, ' \
+    'is_compressed INTEGER NOT NULL, ' \
+    'expiry_time REAL, ' \
+    'access_time REAL NOT NULL' \
+    ')'
+
+# The size of the responses is kept up to date by triggers so that it's not
+# summed on each update
+_SIZE_STATEMENTS = (
+    'CREATE TABLE IF NOT EXISTS responses_size (size INTEGER NOT NULL)',
+    'INSERT INTO responses_size (size) '
+    'SELECT COALESCE(SUM(size), 0) FROM responses '
+    'WHERE NOT EXISTS (SELECT 1 FROM responses_size)',
+    'CREATE TRIGGER IF NOT EXISTS responses_insertion '
+    'AFTER INSERT ON responses BEGIN '
+    'UPDATE responses_size SET size = size + NEW.size; '
+    'END',
+    'CREATE TRIGGER IF NOT EXISTS responses_deletion '
+    'AFTER DELETE ON responses BEGIN '
+    'UPDATE responses_size SET size = size - OLD.size; '
+    'END',
+    )
+
+
+class SQLiteResponseCache(object):
+    """
+    Cache of the responses to GET requests in an SQLite database, which may
+    be shared by all the processes on a host
+
+    The responses are cached under ``namespace``, which must identify the
+    portal and credentials the responses were obtained with (e.g., the hub
+    identifier), so that connections to different portals can share the
+    database without getting each other's responses.
+
+    When the responses in the cache exceed ``max_size`` bytes, the least
+    recently used ones are evicted. The time at which a response was last
+    used is only updated once every ``access_time_resolution`` seconds, so
+    that most hits don't write to the database. Each response expires after the
+    time-to-live for the longest prefix of its URL path in
+    ``ttls_by_url_path_prefix``, or after ``default_ttl`` if none matches;
+    a time-to-live of ``None`` means that the response never expires, and a
+    time-to-live of zero means that it's not cached.
+
+    :param basestring database_path: The path to the database
+    :param namespace: The JSON-serializable identifier of the portal
+    :param int max_size: The maximum size of the responses cached, in bytes
+    :param float default_ttl: The default time-to-live of responses, in \
+            seconds
+    :param dict ttls_by_url_path_prefix: The time-to-live of the responses \
+            from the endpoints under each URL path prefix, in seconds
+    :param bool compress: Whether to compress large responses
+    :param float access_time_resolution: The number of seconds for which \
+            the time at which a response was last used isn't updated
+
+    """
+    def __init__(
+        self,
+        database_path,
+        namespace,
+        max_size=64 * 1024 * 1024,
+        default_ttl=300,
+        ttls_by_url_path_prefix=None,
+        compress=False,
+        access_time_resolution=60,
+        ):
+        super(SQLiteResponseCache, self).__init__()
+
+        self._database_path = database_path
+        self._namespace = namespace
+        self._max_size = max_size
+        self._default_ttl = default_ttl
+        self._ttls_by_url_path_prefix = sorted(
+            (ttls_by_url_path_prefix or {}).items(),
+            key=lambda item: len(item[0]),
+            reverse=True,
+            )
+        self._compress = compress
+        self._access_time_resolution = access_time_resolution
+
+        with self._connect() as database_connection:
+            database_connection.execute('PRAGMA journal_mode=WAL')
+            database_connection.execute(_CREATE_TABLE_STATEMENT.format(''))
+            database_connection.execute(
+                'CREATE INDEX IF NOT EXISTS responses_access_time '
+                'ON responses (access_time)'
+                )
+            for size_statement in _SIZE_STATEMENTS:
+                database_connection.execute(size_statement)
+
+    def get(self, url_path, query_string_args=None):
+        """
+        Return the cached response to the GET request.
+
+        :raises KeyError: If the response is not cached or it expired
+
+        """
+        cache_key = \
+            _make_cache_key(self._namespace, url_path, query_string_args)
+        current_time = time()
+        with self._connect() as database_connection:
+            row = database_connection.execute(
+                'SELECT value, is_compressed, expiry_time, access_time '
+                'FROM responses WHERE key = ?',
+                (cache_key,),
+                ).fetchone()
+            if row is None:
+                raise KeyError(cache_key)
+
+            value, is_compressed, expiry_time, access_time = row
+            is_expired = \
+                expiry_time is not None and expiry_time <= current_time
+            if is_expired:
+                database_connection.execute(
+                    'DELETE FROM responses WHERE key = ?',
+                    (cache_key,),
+                    )
+            elif self._access_time_resolution <= current_time - access_time:
+                database_connection.execute(
+                    'UPDATE responses SET access_time = ? WHERE key = ?',
+                    (current_time, cache_key),
+                    )
+
+        if is_expired:
+            raise KeyError(cache_key)
+
+        value = bytes(value)
+        if is_compressed:
+            value = zlib_decompress(value)
+        response_body_deserialization = json_deserialize(value.decode('UTF-8'))
+        return response_body_deserialization
+
+    def set(self, url_path, query_string_args, response_body_deserialization):
+        """Cache the response to the GET request."""
+        ttl = self._get_ttl(url_path)
+        if ttl == 0:
+            return
+
+        current_time = time()
+        expiry_time = None if ttl is None else current_time + ttl
+
+        value = json_serialize(response_body_deserialization).encode('UTF-8')
+        is_compressed = self._compress and _COMPRESSION_MIN_SIZE <= len(value)
+        if is_compressed:
+            value = zlib_compress(value)
+
+        cache_key = \
+            _make_cache_key(self._namespace, url_path, query_string_args)
+        with self._connect() as database_connection:
+            # Replacing the response wouldn't fire the deletion trigger
+            database_connection.execute(
+                'DELETE FROM responses WHERE key = ?',
+                (cache_key,),
+                )
+            database_connection.execute(
+                'INSERT INTO responses '
+                '(key, value, size, is_compressed, expiry_time, access_time) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    cache_key,
+                    Binary(value),
+                    len(value),
+                    is_compressed,
+                    expiry_time,
+                    current_time,
+                    ),
+                )
+            self._evict_responses(database_connection)
+
+    def clear(self):
+        """Remove every response from the cache, in every namespace."""
+        with self._connect() as database_connection:
+            database_connection.execute('DELETE FROM responses')
+
+    @property
+    def size(self):
+        """The size of the responses cached in every namespace, in bytes"""
+        with self._connect() as database_connection:
+            size = self._get_size(database_connection)
+        return size
+
+    def save_snapshot(self, snapshot_path):
+        """
+        Copy the responses which haven't expired to the database at
+        ``snapshot_path``, replacing any response already there.
+
+        """
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'ATTACH DATABASE ? AS snapshot',
+                (snapshot_path,),
+                )
+            database_connection.execute(
+                _CREATE_TABLE_STATEMENT.format('snapshot.'),
+                )
+            database_connection.execute(
+                'INSERT OR REPLACE INTO snapshot.responses '
+                'SELECT * FROM main.responses '
+                'WHERE expiry_time IS NULL OR ? < expiry_time',
+                (time(),),
+                )
+
+    def load_snapshot(self, snapshot_path):
+        """
+        Pre-warm the cache with the responses which haven't expired in the
+        snapshot saved at ``snapshot_path``.
+
+        """
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'ATTACH DATABASE ? AS snapshot',
+                (snapshot_path,),
+                )
+            database_connection.execute(
+                'DELETE FROM main.responses WHERE key IN ('
+                'SELECT key FROM snapshot.responses '
+                'WHERE expiry_time IS NULL OR ? < expiry_time'
+                ')',
+                (time(),),
+                )
+            database_connection.execute(
+                'INSERT INTO main.responses '
+                'SELECT * FROM snapshot.responses '
+                'WHERE expiry_time IS NULL OR ? < expiry_time',
+                (time(),),
+                )
+            self._evict_responses(database_connection)
+
+    def _get_ttl(self, url_path):
+        for url_path_prefix, ttl in self._ttls_by_url_path_prefix:
+            if url_path.startswith(url_path_prefix):
+                return ttl
+        return self._default_ttl
+
+    def _evict_responses(self, database_connection):
+        excess_size = self._get_size(database_connection) - self._max_size
+        if excess_size <= 0:
+            return
+
+        rows = database_connection.execute(
+            'SELECT key, size FROM responses ORDER BY access_time',
+            )
+        evicted_cache_keys = []
+        for cache_key, response_size in rows:
+            evicted_cache_keys.append((cache_key,))
+            excess_size -= response_size
+            if excess_size <= 0:
+                break
+        database_connection.executemany(
+            'DELETE FROM responses WHERE key = ?',
+            evicted_cache_keys,
+            )
+
+    @staticmethod
+    def _get_size(database_connection):
+        size = database_connection.execute(
+            'SELECT size FROM responses_size',
+            ).fetchone()[0]
+        return size
+
+    def _connect(self):
+        return SQLiteConnection(self._database_path)
+
+
+class CachingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    serves GET requests from a cache, such as a
+    :class:`SQLiteResponseCache`, when possible
+
+    Only successful responses are cached. Other requests are sent as they
+    are.
+
+    :param connection: The connection to wrap
+    :param cache: The cache of responses
+
+    """
+    def __init__(self, connection, cache):
+        super(CachingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        try:
+            response_body_deserialization = \
+                self._cache.get(url_path, query_string_args)
+        except KeyError:
+            response_body_deserialization = self._connection.send_get_request(
+                url_path,
+                query_string_args,
+                priority=priority,
+                )
+            self._cache.set(
+                url_path,
+                query_string_args,
+                response_body_deserialization,
+                )
+        return response_body_deserialization
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_post_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_put_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def get_rate_limit_headers(self):
+        """
+        Return the rate limit headers of the last response to the wrapped
+        connection, as in
+        :meth:`hubspot.connection.PortalConnection.get_rate_limit_headers`.
+
+        """
+        return self._connection.get_rate_limit_headers()
+
+
+def _make_cache_key(namespace, url_path, query_string_args):
+    cache_key = json_serialize(
+        [namespace, url_path, query_string_args or {}],
+        sort_keys=True,
+        separators=(',', ':'),
+        )
+    return cache_key
@@ -0,0 +1,295 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from collections import OrderedDict
+from hashlib import sha1
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from re import compile as compile_regex
+from threading import Lock
+
+from hubspot.connection._sqlite import SQLiteConnection
+
+
+# Writes whose URL path identifies the object updated, as opposed to
+# creating a new object every time
+DEFAULT_OBJECT_URL_PATH_PATTERNS = (
+    r'^/contacts/v1/contact/(vid|email)/[^/]+/profile$',
+    r'^/companies/v2/companies/\d+$',
+    r'^/deals/v1/deal/\d+$',
+    )
+
+# The name of the pseudo-property whose hash is that of the whole body, for
+# bodies which don't consist of a list of properties
+_BODY_HASH_KEY = ''
+
+_HASH_LENGTH = 16
+
+
+class WriteHashStore(object):
+    """
+    Store of the hashes of the last values written to the properties of
+    each object, for a :class:`ChangeDetectingPortalConnection`
+
+    The hashes of up to ``max_object_count`` objects are kept in memory,
+    evicting those of the least recently written objects. When a
+    ``database_path`` is given, the hashes are also written to an SQLite
+    database, so that they survive the process and can be shared by all the
+    processes on a host; the database is not bounded.
+
+    :param int max_object_count: The maximum number of objects whose hashes \
+            are kept in memory
+    :param basestring database_path: The path to the database, if any
+
+    """
+    def __init__(self, max_object_count=100000, database_path=None):
+        super(WriteHashStore, self).__init__()
+
+        self._max_object_count = max_object_count
+        self._database_path = database_path
+
+        self._lock = Lock()
+        self._property_hashes_by_object_key = OrderedDict()
+
+        if database_path:
+            with self._connect() as database_connection:
+                database_connection.execute('PRAGMA journal_mode=WAL')
+                database_connection.execute(
+                    'CREATE TABLE IF NOT EXISTS property_hashes '
+                    '(object_key TEXT PRIMARY KEY, hashes TEXT NOT NULL)'
+                    )
+
+    def get(self, object_key):
+        """
+        Return the hashes of the values last written to the properties of
+        the object, by property name.
+
+        """
+        with self._lock:
+            property_hashes = \
+                self._property_hashes_by_object_key.pop(object_key, None)
+            if property_hashes is not None:
+                self._property_hashes_by_object_key[object_key] = \
+                    property_hashes
+        if property_hashes is None and self._database_path:
+            property_hashes = self._get_persisted_property_hashes(object_key)
+            if property_hashes:
+                self._cache_property_hashes(object_key, property_hashes)
+        return dict(property_hashes or {})
+
+    def update(self, object_key, property_hashes):
+        """
+        Record the hashes of the values just written to some properties of
+        the object.
+
+        """
+        property_hashes = dict(self.get(object_key), **property_hashes)
+        self._cache_property_hashes(object_key, property_hashes)
+
+        if self._database_path:
+            with self._connect() as database_connection:
+                database_connection.execute(
+                    'INSERT OR REPLACE INTO property_hashes '
+                    '(object_key, hashes) VALUES (?, ?)',
+                    (object_key, json_serialize(property_hashes)),
+                    )
+
+    def delete(self, object_key):
+        """Forget the values written to the object."""
+        with self._lock:
+            self._property_hashes_by_object_key.pop(object_key, None)
+
+        if self._database_path:
+            with self._connect() as database_connection:
+                database_connection.execute(
+                    'DELETE FROM property_hashes WHERE object_key = ?',
+                    (object_key,),
+                    )
+
+    def _cache_property_hashes(self, object_key, property_hashes):
+        with self._lock:
+            self._property_hashes_by_object_key.pop(object_key, None)
+            self._property_hashes_by_object_key[object_key] = property_hashes
+            while self._max_object_count < \
+                    len(self._property_hashes_by_object_key):
+                self._property_hashes_by_object_key.popitem(last=False)
+
+    def _get_persisted_property_hashes(self, object_key):
+        with self._connect() as database_connection:
+            row = database_connection.execute(
+                'SELECT hashes FROM property_hashes WHERE object_key = ?',
+                (object_key,),
+                ).fetchone()
+        return json_deserialize(row[0]) if row else None
+
+    def _connect(self):
+        return SQLiteConnection(self._database_path)
+
+
+class ChangeDetectingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    skips the writes that wouldn't change anything
+
+    The POST and PUT requests to a URL path matching one of the
+    ``object_url_path_patterns`` are taken to update the object identified
+    by the URL path. Only the properties whose values differ from those last
+    written to the object through this connection are sent, and the request
+    isn't sent at all (and ``None`` is returned) if none do. Bodies which
+    don't consist of a list of properties (with a ``property`` or ``name``
+    and a ``value`` each) are only skipped when identical to the last one.
+    The values written are remembered, as hashes in ``write_hash_store``,
+    once HubSpot accepts them.
+
+    Since changes made by others aren't known, this is only suitable for
+    properties written by this connection alone. Other requests, including
+    the writes with bodies already serialized, are sent as they are.
+
+    :param connection: The connection to wrap
+    :param write_hash_store: The :class:`WriteHashStore`, which defaults to \
+            one in memory
+    :param object_url_path_patterns: The regular expressions matching the \
+            URL paths of the objects updated, which default to those of \
+            contacts, companies and deals
+
+    """
+    def __init__(
+        self,
+        connection,
+        write_hash_store=None,
+        object_url_path_patterns=DEFAULT_OBJECT_URL_PATH_PATTERNS,
+        ):
+        super(ChangeDetectingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._write_hash_store = write_hash_store or WriteHashStore()
+        self._object_url_path_regexes = [
+            compile_regex(pattern) for pattern in object_url_path_patterns
+            ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        return self._connection.send_get_request(
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._send_write(
+            self._connection.send_post_request,
+            url_path,
+            body_deserialization,
+            priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._send_write(
+            self._connection.send_put_request,
+            url_path,
+            body_deserialization,
+            priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def _send_write(
+        self,
+        request_sender,
+        url_path,
+        body_deserialization,
+        priority,
+        ):
+        is_write_to_object = \
+            isinstance(body_deserialization, (dict, list)) and \
+            self._is_object_url_path(url_path)
+        if not is_write_to_object:
+            return request_sender(
+                url_path,
+                body_deserialization,
+                priority=priority,
+                )
+
+        property_hashes = _hash_properties(body_deserialization)
+        last_property_hashes = self._write_hash_store.get(url_path)
+        changed_property_hashes = {
+            property_name: property_hash
+            for property_name, property_hash in property_hashes.items()
+            if last_property_hashes.get(property_name) != property_hash
+            }
+        if not changed_property_hashes:
+            return None
+
+        if _BODY_HASH_KEY not in property_hashes:
+            changed_properties = [
+                property_ for property_ in body_deserialization['properties']
+                if _get_property_name(property_) in changed_property_hashes
+                ]
+            body_deserialization = \
+                dict(body_deserialization, properties=changed_properties)
+
+        response_body_deserialization = request_sender(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+        self._write_hash_store.update(url_path, changed_property_hashes)
+
+        return response_body_deserialization
+
+    def _is_object_url_path(self, url_path):
+        is_object_url_path = any(
+            regex.match(url_path) for regex in self._object_url_path_regexes
+            )
+        return is_object_url_path
+
+
+def _hash_properties(body_deserialization):
+    properties = None
+    if isinstance(body_deserialization, dict):
+        properties = body_deserialization.get('properties')
+
+    is_property_list = isinstance(properties, list) and all(
+        isinstance(property_, dict) and
+        _get_property_name(property_) is not None and
+        'value' in property_
+        for property_ in properties
+        )
+    if is_property_list:
+        property_hashes = {
+            _get_property_name(property_): _hash_value(property_['value'])
+            for property_ in properties
+            }
+    else:
+        property_hashes = {_BODY_HASH_KEY: _hash_value(body_deserialization)}
+    return property_hashes
+
+
+def _get_property_name(property_):
+    return property_.get('property', property_.get('name'))
+
+
+def _hash_value(value):
+    value_serialization = json_serialize(value, sort_keys=True)
+    value_hash = \
+        sha1(value_serialization.encode('UTF-8')).hexdigest()[:_HASH_LENGTH]
+    return value_hash
@@ -0,0 +1,371 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from heapq import heappop
+from heapq import heappush
+from itertools import count
+from threading import Condition
+from time import time
+
+from pyrecord import Record
+
+from hubspot.connection.exc import HubspotRequestRejectedError
+
+
+_LATENCY_SMOOTHING_FACTOR = 0.1
+
+
+PRIORITY_CLASS_INTERACTIVE = 'interactive'
+
+PRIORITY_CLASS_NORMAL = 'normal'
+
+PRIORITY_CLASS_BULK = 'bulk'
+
+
+RequestPriority = Record.create_type(
+    'RequestPriority',
+    'class_name',
+    'tenant',
+    tenant=None,
+    )
+
+
+PriorityClass = Record.create_type(
+    'PriorityClass',
+    'name',
+    'max_in_flight_count',
+    'max_queue_depth',
+    max_in_flight_count=None,
+    max_queue_depth=None,
+    )
+
+
+_DEFAULT_PRIORITY_CLASSES = (
+    PriorityClass(PRIORITY_CLASS_INTERACTIVE),
+    PriorityClass(PRIORITY_CLASS_NORMAL),
+    PriorityClass(PRIORITY_CLASS_BULK),
+    )
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Limit on the number of requests in flight which adapts to how HubSpot
+    copes with them, using additive increase and multiplicative decrease
+    (AIMD)
+
+    The limit grows by one for every ``limit`` healthy responses, and it's
+    multiplied by ``backoff_ratio`` when HubSpot responds with "429 Too Many
+    Requests" or a server error, when the request fails at the network level,
+    or when a response takes more than ``latency_tolerance`` times as long as
+    the average response. The limit is cut at most once per average
+    response time, so that a burst of failures only counts once.
+
+    Pass the limiter to :class:`~hubspot.connection.PortalConnection` so that
+    requests wait for a free slot before being sent. The same limiter can be
+    shared by several connections.
+
+    :param int initial_limit: The number of requests in flight allowed \
+            initially
+    :param int min_limit: The lowest the limit may go
+    :param int max_limit: The highest the limit may go
+    :param float backoff_ratio: The factor by which the limit is multiplied \
+            when HubSpot is overloaded
+    :param float latency_tolerance: The factor by which the average latency \
+            of responses may be exceeded before HubSpot is deemed overloaded
+
+    """
+    def __init__(
+        self,
+        initial_limit=4,
+        min_limit=1,
+        max_limit=64,
+        backoff_ratio=0.5,
+        latency_tolerance=2.0,
+        ):
+        super(AdaptiveConcurrencyLimiter, self).__init__()
+
+        assert 1 <= min_limit <= initial_limit <= max_limit
+        assert 0 < backoff_ratio < 1
+
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff_ratio = backoff_ratio
+        self._latency_tolerance = latency_tolerance
+
+        self._condition = Condition()
+        self._in_flight_count = 0
+        self._waiting_count = 0
+        self._average_latency = None
+        self._last_backoff_time = None
+
+    @property
+    def limit(self):
+        """The current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight_count(self):
+        """The number of requests in flight"""
+        return self._in_flight_count
+
+    @property
+    def waiting_count(self):
+        """The number of requests waiting for a free slot"""
+        return self._waiting_count
+
+    def acquire(self):
+        """Wait until a request can be sent."""
+        with self._condition:
+            self._waiting_count += 1
+            try:
+                while int(self._limit) <= self._in_flight_count:
+                    self._condition.wait()
+            finally:
+                self._waiting_count -= 1
+
+            self._in_flight_count += 1
+
+    def release(self, latency, is_overloaded):
+        """
+        Free the slot taken by a request and adapt the limit to its outcome.
+
+        :param float latency: The number of seconds the request took
+        :param bool is_overloaded: Whether the response, or the lack of it, \
+                signals that HubSpot is overloaded
+
+        """
+        with self._condition:
+            self._in_flight_count -= 1
+
+            is_latency_excessive = \
+                self._average_latency is not None and \
+                self._average_latency * self._latency_tolerance < latency
+            if is_overloaded or is_latency_excessive:
+                self._back_off()
+            else:
+                self._limit = \
+                    min(self._max_limit, self._limit + 1 / self._limit)
+
+            # Slow responses count too, so that the average catches up with a
+            # lasting rise in HubSpot's latency instead of flagging every
+            # response as excessive from then on
+            if not is_overloaded:
+                self._update_average_latency(latency)
+
+            self._condition.notify_all()
+
+    def _back_off(self):
+        current_time = time()
+        is_backoff_recent = \
+            self._last_backoff_time is not None and \
+            self._average_latency is not None and \
+            current_time < self._last_backoff_time + self._average_latency
+        if not is_backoff_recent:
+            self._limit = \
+                max(self._min_limit, self._limit * self._backoff_ratio)
+            self._last_backoff_time = current_time
+
+    def _update_average_latency(self, latency):
+        if self._average_latency is None:
+            self._average_latency = latency
+        else:
+            self._average_latency += \
+                (latency - self._average_latency) * _LATENCY_SMOOTHING_FACTOR
+
+
+class RequestScheduler(object):
+    """
+    Scheduler sharing a budget of requests in flight between priority classes
+    and, within each class, between tenants
+
+    Requests of a class are only sent when no request of a higher class is
+    waiting, and requests of the same class are sent in weighted fair order
+    across their tenants (e.g., users or jobs), so a tenant with twice the
+    weight of another gets twice as many requests through while both are
+    waiting.
+
+    Pass the scheduler to :class:`~hubspot.connection.PortalConnection` and
+    tag each request with a :class:`RequestPriority`; untagged requests
+    belong to the default class and to no tenant in particular.
+
+    :param int max_in_flight_count: The number of requests allowed in flight \
+            across all classes
+    :param priority_classes: The :class:`PriorityClass` instances, from the \
+            highest priority to the lowest. By default, these are \
+            ``interactive``, ``normal`` and ``bulk``, without limits of their \
+            own
+    :param dict tenant_weights: The weight of each tenant, which defaults \
+            to 1
+    :param basestring default_class_name: The class of untagged requests
+
+    """
+    def __init__(
+        self,
+        max_in_flight_count,
+        priority_classes=_DEFAULT_PRIORITY_CLASSES,
+        tenant_weights=None,
+        default_class_name=PRIORITY_CLASS_NORMAL,
+        ):
+        super(RequestScheduler, self).__init__()
+
+        self._max_in_flight_count = max_in_flight_count
+        self._priority_classes = tuple(priority_classes)
+        self._tenant_weights = tenant_weights or {}
+        self._default_priority = RequestPriority(default_class_name)
+
+        self._condition = Condition()
+        self._in_flight_count = 0
+        self._class_states_by_name = {
+            priority_class.name: _PriorityClassState(priority_class)
+            for priority_class in self._priority_classes
+            }
+        assert default_class_name in self._class_states_by_name
+
+        self._ticket_sequence = count()
+
+    @property
+    def in_flight_count(self):
+        """The number of requests in flight across all classes"""
+        return self._in_flight_count
+
+    def get_queue_depth(self, class_name):
+        """Return the number of requests of the class waiting to be sent."""
+        return len(self._class_states_by_name[class_name].ticket_heap)
+
+    def get_in_flight_count(self, class_name):
+        """Return the number of requests of the class in flight."""
+        return self._class_states_by_name[class_name].in_flight_count
+
+    def acquire(self, priority=None):
+        """
+        Wait until the request can be sent.
+
+        :param RequestPriority priority: The priority of the request
+        :raises hubspot.connection.exc.HubspotRequestRejectedError: If the \
+                queue for the class is full
+
+        """
+        priority = priority or self._default_priority
+        with self._condition:
+            class_state = self._class_states_by_name[priority.class_name]
+            max_queue_depth = class_state.priority_class.max_queue_depth
+            if max_queue_depth is not None and \
+                    max_queue_depth <= len(class_state.ticket_heap):
+                exception_message = 'Queue for {!r} requests is full'.format(
+                    priority.class_name,
+                    )
+                raise HubspotRequestRejectedError(exception_message)
+
+            tenant_weight = self._tenant_weights.get(priority.tenant, 1)
+            ticket = class_state.enqueue(
+                priority.tenant,
+                tenant_weight,
+                next(self._ticket_sequence),
+                )
+
+            self._dispatch_tickets()
+            while not ticket.is_dispatched:
+                self._condition.wait()
+
+    def release(self, priority=None):
+        """
+        Free the slot taken by a request sent after :meth:`acquire`.
+
+        :param RequestPriority priority: The priority of the request
+
+        """
+        priority = priority or self._default_priority
+        with self._condition:
+            self._in_flight_count -= 1
+            class_state = self._class_states_by_name[priority.class_name]
+            class_state.in_flight_count -= 1
+
+            self._dispatch_tickets()
+
+    def _dispatch_tickets(self):
+        is_any_ticket_dispatched = False
+        while self._in_flight_count < self._max_in_flight_count:
+            class_state = self._get_next_dispatchable_class_state()
+            if not class_state:
+                break
+
+            ticket = class_state.dequeue()
+            ticket.is_dispatched = True
+            self._in_flight_count += 1
+            is_any_ticket_dispatched = True
+
+        if is_any_ticket_dispatched:
+            self._condition.notify_all()
+
+    def _get_next_dispatchable_class_state(self):
+        for priority_class in self._priority_classes:
+            class_state = self._class_states_by_name[priority_class.name]
+            if class_state.ticket_heap and not class_state.is_at_capacity:
+                return class_state
+        return None
+
+
+class _PriorityClassState(object):
+
+    def __init__(self, priority_class):
+        super(_PriorityClassState, self).__init__()
+
+        self.priority_class = priority_class
+        self.in_flight_count = 0
+
+        self.ticket_heap = []
+        self._virtual_time = 0
+        self._finish_tags_by_tenant = {}
+
+    @property
+    def is_at_capacity(self):
+        max_in_flight_count = self.priority_class.max_in_flight_count
+        return max_in_flight_count is not None and \
+            max_in_flight_count <= self.in_flight_count
+
+    def enqueue(self, tenant, tenant_weight, sequence_number):
+        start_tag = max(
+            self._virtual_time,
+            self._finish_tags_by_tenant.get(tenant, 0),
+            )
+        finish_tag = start_tag + 1.0 / tenant_weight
+        self._finish_tags_by_tenant[tenant] = finish_tag
+
+        ticket = _SchedulerTicket(tenant, start_tag)
+        heappush(self.ticket_heap, (finish_tag, sequence_number, ticket))
+        return ticket
+
+    def dequeue(self):
+        _, _, ticket = heappop(self.ticket_heap)
+        self._virtual_time = max(self._virtual_time, ticket.start_tag)
+        self.in_flight_count += 1
+
+        # Forget tenants which have caught up, as they'd start afresh anyway
+        tenant_finish_tag = self._finish_tags_by_tenant[ticket.tenant]
+        if tenant_finish_tag <= self._virtual_time:
+            del self._finish_tags_by_tenant[ticket.tenant]
+
+        return ticket
+
+
+class _SchedulerTicket(object):
+
+    def __init__(self, tenant, start_tag):
+        super(_SchedulerTicket, self).__init__()
+
+        self.tenant = tenant
+        self.start_tag = start_tag
+        self.is_dispatched = False
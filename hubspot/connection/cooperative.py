@@ -0,0 +1,41 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from gevent import sleep as gevent_sleep
+from gevent.queue import LifoQueue
+
+from hubspot.connection.pooling import _HTTPConnectionPool
+from hubspot.connection.pooling import _HTTPSConnectionPool
+
+
+class _CooperativeHTTPConnectionPool(_HTTPConnectionPool):
+
+    QueueCls = LifoQueue
+
+
+class _CooperativeHTTPSConnectionPool(_HTTPSConnectionPool):
+
+    QueueCls = LifoQueue
+
+
+_COOPERATIVE_POOL_CLASSES_BY_SCHEME = {
+    'http': _CooperativeHTTPConnectionPool,
+    'https': _CooperativeHTTPSConnectionPool,
+    }
+
+
+def yield_to_other_greenlets():
+    """Let the other greenlets ready to run do so before carrying on."""
+    gevent_sleep(0)
@@ -16,8 +16,40 @@
 
 
 class HubspotException(Exception):
-    """The base HubSpot error."""
-    pass
+    """
+    The base HubSpot error.
+
+    The exceptions raised by :class:`~hubspot.connection.PortalConnection`
+    carry the following metadata about the response which caused them, when
+    there is one.
+
+    .. attribute:: http_status_code
+
+        The status of the response
+
+    .. attribute:: request_id
+
+        The identifier HubSpot gave to the request, if any
+
+    .. attribute:: elapsed_time
+
+        The number of seconds HubSpot took to respond
+
+    .. attribute:: response_headers
+
+        The response headers about rate limits (such as ``Retry-After`` and
+        ``X-HubSpot-RateLimit-Remaining``) and the request identifier, keyed
+        by lowercase name
+
+    """
+
+    http_status_code = None
+
+    request_id = None
+
+    elapsed_time = None
+
+    response_headers = None
 
 
 class HubspotUnsupportedResponseError(HubspotException):
@@ -30,6 +62,15 @@ class HubspotInvalidResponseError(HubspotException):
         Exception.__init__(self, 'Invalid JSON response body')
 
 
+class HubspotRequestRejectedError(HubspotException):
+    """
+    The request was not sent to HubSpot because it would exceed a limit set
+    on this side, such as the depth of a scheduler's queue.
+
+    """
+    pass
+
+
 class HubspotClientError(HubspotException):
     """
     HubSpot deemed the request invalid. This represents an HTTP response code
@@ -53,6 +94,24 @@ class HubspotAuthenticationError(HubspotClientError):
     pass
 
 
+class HubspotRateLimitError(HubspotClientError):
+    """
+    HubSpot rejected the request because a rate limit was reached. This
+    represents an HTTP response code of 429.
+
+    :param unicode request_id:
+    :param float retry_after: The number of seconds to wait before retrying, \
+            if HubSpot said so
+
+    """
+    http_status_code = 429
+
+    def __init__(self, msg, request_id, retry_after=None):
+        super(HubspotRateLimitError, self).__init__(msg, request_id)
+
+        self.retry_after = retry_after
+
+
 class HubspotServerError(HubspotException):
     """
     HubSpot failed to process the request due to a problem at their end. This
@@ -0,0 +1,326 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from gzip import GzipFile
+from json import dumps as json_serialize
+from os import fsync
+from os import listdir
+from os import remove
+from os.path import join as join_path
+from re import compile as compile_regex
+from re import escape as escape_regex
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from pyrecord import Record
+from six.moves.queue import Empty
+from six.moves.queue import Full
+from six.moves.queue import Queue
+
+from hubspot.connection._pagination import \
+    CONTACT_OFFSET_QUERY_STRING_ARG_NAMES_BY_RESPONSE_KEY
+from hubspot.connection._pagination import iter_pages
+
+
+_QUEUE_POLL_INTERVAL = 0.1
+
+
+CollectionExport = Record.create_type(
+    'CollectionExport',
+    'name',
+    'url_path',
+    'records_key',
+    'query_string_args',
+    'offset_query_string_arg_names_by_response_key',
+    'has_more_key',
+    query_string_args=None,
+    offset_query_string_arg_names_by_response_key=
+        CONTACT_OFFSET_QUERY_STRING_ARG_NAMES_BY_RESPONSE_KEY,
+    has_more_key='has-more',
+    )
+
+
+def export_collections(
+    connection,
+    collection_exports,
+    directory_path,
+    checkpoint_store,
+    max_records_per_shard=100000,
+    compress=True,
+    max_parallel_export_count=4,
+    max_queued_page_count=4,
+    priority=None,
+    ):
+    """
+    Export paginated collections to files of newline-delimited JSON records
+    (NDJSON), in parallel
+
+    The records of each collection are written to a series of shards in
+    ``directory_path``, named after the collection and numbered from zero
+    (e.g., ``contacts-00000.ndjson.gz``). A shard is closed once it holds at
+    least ``max_records_per_shard`` records, and its collection's progress is
+    then checkpointed in ``checkpoint_store``, so that an interrupted export
+    resumes by overwriting the last, incomplete shard. The checkpoint is
+    deleted once the collection is exported, and the collection's shards from
+    previous exports are deleted when the next one starts from scratch.
+
+    Each collection's pages are fetched in one thread and written in another,
+    with at most ``max_queued_page_count`` pages waiting in between, so the
+    memory used doesn't depend on the size of the collections.
+
+    :param connection: The :class:`~hubspot.connection.PortalConnection`, \
+            which will be used from several threads
+    :param collection_exports: The :class:`CollectionExport` instances
+    :param basestring directory_path: The path to the directory for the shards
+    :param checkpoint_store: The store of the checkpoints, such as a \
+            :class:`~hubspot.connection.sync.FileCheckpointStore`
+    :param int max_records_per_shard: The number of records after which a \
+            shard is closed at the end of a page
+    :param bool compress: Whether to compress the shards with gzip
+    :param int max_parallel_export_count: The number of collections exported \
+            at the same time
+    :param int max_queued_page_count: The number of pages fetched but not \
+            written yet allowed per collection
+    :param priority: The \
+            :class:`~hubspot.connection.concurrency.RequestPriority` of the \
+            requests, if any
+    :return: The number of records written for each collection, by name
+    :rtype: dict
+
+    """
+    collection_exporter = _CollectionExporter(
+        connection,
+        directory_path,
+        checkpoint_store,
+        max_records_per_shard,
+        compress,
+        max_queued_page_count,
+        priority,
+        )
+
+    pending_collection_exports = Queue()
+    for collection_export in collection_exports:
+        pending_collection_exports.put(collection_export)
+
+    worker_threads = [
+        Thread(
+            target=collection_exporter.export_pending_collections,
+            args=(pending_collection_exports,),
+            )
+        for _ in range(max_parallel_export_count)
+        ]
+    for worker_thread in worker_threads:
+        worker_thread.start()
+    for worker_thread in worker_threads:
+        worker_thread.join()
+
+    if collection_exporter.exceptions:
+        raise collection_exporter.exceptions[0]
+
+    return collection_exporter.record_counts_by_collection_name
+
+
+class _CollectionExporter(object):
+
+    def __init__(
+        self,
+        connection,
+        directory_path,
+        checkpoint_store,
+        max_records_per_shard,
+        compress,
+        max_queued_page_count,
+        priority,
+        ):
+        super(_CollectionExporter, self).__init__()
+
+        self._connection = connection
+        self._directory_path = directory_path
+        self._checkpoint_store = checkpoint_store
+        self._max_records_per_shard = max_records_per_shard
+        self._compress = compress
+        self._max_queued_page_count = max_queued_page_count
+        self._priority = priority
+
+        self._lock = Lock()
+        self.exceptions = []
+        self.record_counts_by_collection_name = {}
+
+    def export_pending_collections(self, pending_collection_exports):
+        while not self.exceptions:
+            try:
+                collection_export = pending_collection_exports.get_nowait()
+            except Empty:
+                break
+
+            try:
+                record_count = self._export_collection(collection_export)
+            except Exception as exception:
+                with self._lock:
+                    self.exceptions.append(exception)
+            else:
+                with self._lock:
+                    self.record_counts_by_collection_name[
+                        collection_export.name] = record_count
+
+    def _export_collection(self, collection_export):
+        checkpoint = self._checkpoint_store.get(collection_export.name)
+        if checkpoint is None:
+            self._delete_shards(collection_export.name)
+            checkpoint = {'offset_query_string_args': {}, 'shard_number': 0}
+        shard_number = checkpoint['shard_number']
+
+        queued_pages = Queue(self._max_queued_page_count)
+        stop_event = Event()
+        page_fetcher_thread = Thread(
+            target=self._fetch_pages,
+            args=(
+                collection_export,
+                checkpoint['offset_query_string_args'],
+                queued_pages,
+                stop_event,
+                ),
+            )
+        page_fetcher_thread.daemon = True
+        page_fetcher_thread.start()
+
+        record_count = 0
+        shard_record_count = 0
+        shard_file = self._open_shard(collection_export.name, shard_number)
+        try:
+            while True:
+                page_data = queued_pages.get()
+                if isinstance(page_data, Exception):
+                    raise page_data
+                if page_data is None:
+                    break
+
+                records, offset_query_string_args, has_more_pages = page_data
+                for record in records:
+                    record_serialization = json_serialize(record) + '\n'
+                    shard_file.write(record_serialization.encode('UTF-8'))
+                record_count += len(records)
+                shard_record_count += len(records)
+
+                if has_more_pages and \
+                        self._max_records_per_shard <= shard_record_count:
+                    shard_file.close()
+                    shard_number += 1
+                    self._checkpoint_store.set(
+                        collection_export.name,
+                        {
+                            'offset_query_string_args':
+                                offset_query_string_args,
+                            'shard_number': shard_number,
+                            },
+                        )
+                    shard_file = \
+                        self._open_shard(collection_export.name, shard_number)
+                    shard_record_count = 0
+        finally:
+            stop_event.set()
+            shard_file.close()
+
+        self._checkpoint_store.delete(collection_export.name)
+        return record_count
+
+    def _fetch_pages(
+        self,
+        collection_export,
+        offset_query_string_args,
+        queued_pages,
+        stop_event,
+        ):
+        pages = iter_pages(
+            self._connection,
+            collection_export.url_path,
+            collection_export.query_string_args,
+            offset_query_string_args,
+            collection_export.offset_query_string_arg_names_by_response_key,
+            collection_export.has_more_key,
+            self._priority,
+            )
+        try:
+            for page, offset_query_string_args, has_more_pages in pages:
+                page_data = (
+                    page[collection_export.records_key],
+                    offset_query_string_args,
+                    has_more_pages,
+                    )
+                if not _put_unless_stopped(queued_pages, page_data, stop_event):
+                    return
+        except Exception as exception:
+            _put_unless_stopped(queued_pages, exception, stop_event)
+        else:
+            _put_unless_stopped(queued_pages, None, stop_event)
+
+    def _delete_shards(self, collection_name):
+        # Whether or not they were compressed
+        shard_file_name_regex = compile_regex(
+            r'^{}-\d{{5}}\.ndjson(\.gz)?$'.format(
+                escape_regex(collection_name),
+                ),
+            )
+        for file_name in listdir(self._directory_path):
+            if shard_file_name_regex.match(file_name):
+                remove(join_path(self._directory_path, file_name))
+
+    def _open_shard(self, collection_name, shard_number):
+        shard_file_name = \
+            '{}-{:05d}.ndjson'.format(collection_name, shard_number)
+        if self._compress:
+            shard_file_name += '.gz'
+        shard_file_path = join_path(self._directory_path, shard_file_name)
+        return _Shard(shard_file_path, self._compress)
+
+
+class _Shard(object):
+
+    def __init__(self, file_path, compress):
+        super(_Shard, self).__init__()
+
+        self._file = open(file_path, 'wb')
+        if compress:
+            self._compressed_file = GzipFile(fileobj=self._file, mode='wb')
+        else:
+            self._compressed_file = None
+        self.is_closed = False
+
+    def write(self, data):
+        (self._compressed_file or self._file).write(data)
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+
+        try:
+            if self._compressed_file:
+                self._compressed_file.close()
+            self._file.flush()
+            fsync(self._file.fileno())
+        finally:
+            self._file.close()
+
+
+def _put_unless_stopped(queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            queue.put(item, timeout=_QUEUE_POLL_INTERVAL)
+        except Full:
+            continue
+        return True
+    return False
@@ -0,0 +1,283 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+import signal as signal_module
+from sys import stderr
+from threading import Lock
+from time import gmtime
+from time import strftime
+
+from pyrecord import Record
+
+from hubspot.connection.exc import HubspotException
+from hubspot.connection.metrics import template_url_path
+
+
+RequestRecord = Record.create_type(
+    'RequestRecord',
+    'http_method',
+    'url_path_template',
+    'start_time',
+    'wait_time',
+    'latency',
+    'status_code',
+    'retry_count',
+    'exception_class',
+    )
+
+
+class FlightRecorder(object):
+    """
+    Ring buffer of the last requests sent by a
+    :class:`~hubspot.connection.PortalConnection`, to find out what led to a
+    failure
+
+    Pass the recorder to the connection so that every request gets recorded
+    into one of the ``capacity`` slots allocated upfront, overwriting the
+    oldest request. Only the HTTP method, URL path, timings, response status,
+    retry count and exception class are recorded, so no credentials or
+    personal data in query strings and bodies end up in the dumps. The URL
+    paths are turned into templates by ``url_path_templater`` when the
+    requests are retrieved, not when they're recorded.
+
+    :param int capacity: The number of requests kept
+    :param callable url_path_templater: The function returning the template \
+            for a URL path
+    :param exception_dump_stream: The file-like object to which the requests \
+            are dumped whenever a request fails with a \
+            :class:`~hubspot.connection.exc.HubspotException`, if any
+
+    """
+
+    def __init__(
+        self,
+        capacity=256,
+        url_path_templater=template_url_path,
+        exception_dump_stream=None,
+        ):
+        super(FlightRecorder, self).__init__()
+
+        assert 0 < capacity
+
+        self._url_path_templater = url_path_templater
+        self._exception_dump_stream = exception_dump_stream
+
+        self._lock = Lock()
+        self._slots = [_RequestSlot() for _ in range(capacity)]
+        self._recorded_request_count = 0
+
+    def record_request(
+        self,
+        http_method,
+        url_path,
+        start_time,
+        wait_time=0,
+        latency=None,
+        status_code=None,
+        retry_count=None,
+        exception=None,
+        ):
+        """
+        Record a request
+
+        :param str http_method: The HTTP method of the request
+        :param str url_path: The URL path of the request, without the query \
+                string
+        :param float start_time: The time at which the request was made, as \
+                a UNIX timestamp
+        :param float wait_time: The number of seconds the request waited \
+                before being sent, for instance on a scheduler
+        :param float latency: The number of seconds HubSpot took to respond, \
+                if the request was sent
+        :param int status_code: The response status, if any
+        :param int retry_count: The number of times the request was retried \
+                by the connection, if known
+        :param Exception exception: The exception raised, if any
+
+        """
+        exception_class = exception.__class__ if exception else None
+        with self._lock:
+            slot_index = self._recorded_request_count % len(self._slots)
+            self._slots[slot_index].set(
+                http_method,
+                url_path,
+                start_time,
+                wait_time,
+                latency,
+                status_code,
+                retry_count,
+                exception_class,
+                )
+            self._recorded_request_count += 1
+
+        is_dump_required = self._exception_dump_stream is not None and \
+            isinstance(exception, HubspotException)
+        if is_dump_required:
+            self.dump(self._exception_dump_stream)
+
+    def get_records(self):
+        """
+        Return the requests recorded, from the oldest to the most recent
+
+        :rtype: :class:`list` of :class:`RequestRecord`
+
+        """
+        with self._lock:
+            slots = self._copy_recorded_slots()
+        return self._make_records(slots)
+
+    def dump(self, stream=None):
+        """
+        Write the requests recorded to ``stream``, one per line and from the
+        oldest to the most recent
+
+        :param stream: The file-like object to write to, which defaults to \
+                the standard error
+
+        """
+        _write_request_records(self.get_records(), stream or stderr)
+
+    def dump_on_signal(self, signal_number=None, stream=None):
+        """
+        Dump the requests recorded whenever the process receives
+        ``signal_number``
+
+        This replaces any existing handler for the signal, and has to be
+        called from the main thread. The handler doesn't wait for the
+        requests being recorded, since the signal may interrupt the thread
+        recording them, so the dump may include a partially recorded request.
+
+        :param int signal_number: The signal to handle, which defaults to \
+                ``SIGUSR1``
+        :param stream: The file-like object to write to, which defaults to \
+                the standard error
+
+        """
+        signal_module.signal(
+            signal_number or signal_module.SIGUSR1,
+            lambda signal_number, frame: self._dump_snapshot(stream),
+            )
+
+    def _dump_snapshot(self, stream):
+        records = self._make_records(self._copy_recorded_slots())
+        _write_request_records(records, stream or stderr)
+
+    def _copy_recorded_slots(self):
+        recorded_request_count = self._recorded_request_count
+        slot_count = len(self._slots)
+        record_count = min(recorded_request_count, slot_count)
+        first_slot_index = recorded_request_count - record_count
+        slots = [
+            self._slots[slot_index % slot_count].copy()
+            for slot_index in range(first_slot_index, recorded_request_count)
+            ]
+        return slots
+
+    def _make_records(self, slots):
+        records = [slot.make_record(self._url_path_templater) for slot in slots]
+        return records
+
+
+class _RequestSlot(object):
+
+    __slots__ = (
+        'http_method',
+        'url_path',
+        'start_time',
+        'wait_time',
+        'latency',
+        'status_code',
+        'retry_count',
+        'exception_class',
+        )
+
+    def __init__(self):
+        super(_RequestSlot, self).__init__()
+
+        self.set(None, None, None, None, None, None, None, None)
+
+    def set(
+        self,
+        http_method,
+        url_path,
+        start_time,
+        wait_time,
+        latency,
+        status_code,
+        retry_count,
+        exception_class,
+        ):
+        self.http_method = http_method
+        self.url_path = url_path
+        self.start_time = start_time
+        self.wait_time = wait_time
+        self.latency = latency
+        self.status_code = status_code
+        self.retry_count = retry_count
+        self.exception_class = exception_class
+
+    def copy(self):
+        slot = _RequestSlot()
+        slot.set(
+            self.http_method,
+            self.url_path,
+            self.start_time,
+            self.wait_time,
+            self.latency,
+            self.status_code,
+            self.retry_count,
+            self.exception_class,
+            )
+        return slot
+
+    def make_record(self, url_path_templater):
+        record = RequestRecord(
+            self.http_method,
+            url_path_templater(self.url_path),
+            self.start_time,
+            self.wait_time,
+            self.latency,
+            self.status_code,
+            self.retry_count,
+            self.exception_class,
+            )
+        return record
+
+
+def _write_request_records(records, stream):
+    stream.write('Last {} requests to HubSpot:\n'.format(len(records)))
+    for record in records:
+        stream.write(_format_request_record(record) + '\n')
+    stream.flush()
+
+
+def _format_request_record(record):
+    start_time_string = '{}.{:03d}Z'.format(
+        strftime('%Y-%m-%dT%H:%M:%S', gmtime(record.start_time)),
+        int(record.start_time % 1 * 1000),
+        )
+    request_record_string = \
+        '{} {} {} status={} wait={:.3f}s latency={} retries={} ' \
+        'exception={}'.format(
+            start_time_string,
+            record.http_method,
+            record.url_path_template,
+            record.status_code or '-',
+            record.wait_time,
+            '-' if record.latency is None else '{:.3f}s'.format(record.latency),
+            '-' if record.retry_count is None else record.retry_count,
+            record.exception_class.__name__ if record.exception_class else '-',
+            )
+    return request_record_string
@@ -0,0 +1,352 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from pyrecord import Record
+from six.moves.queue import Empty
+from six.moves.queue import Queue
+
+
+_MAX_HEDGE_BURST = 10
+
+_MAX_WORKER_IDLE_TIME = 60
+
+
+HedgingStatistics = Record.create_type(
+    'HedgingStatistics',
+    'request_count',
+    'hedge_count',
+    'hedge_win_count',
+    )
+
+
+class HedgingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    sends a duplicate of the GET requests taking unusually long
+
+    When a GET request hasn't got a response after the ``latency_percentile``
+    of the latencies of its endpoint in ``metrics_registry``, or after
+    ``hedge_delay`` seconds while no latency is known for the endpoint, the
+    request is sent again and the caller gets the first response to arrive.
+    The other response is discarded when it arrives, since requests in
+    flight can't be cancelled. An error is only reported once all the
+    requests sent failed. The requests which may be duplicated are sent
+    from a pool of threads reused across requests.
+
+    Each GET request earns ``max_hedge_ratio`` of a duplicate, and requests
+    are only duplicated while a whole one was earned, so that hedging can
+    add at most that proportion of requests, in bursts of up to ten.
+    Duplicates are sent through ``connection`` like any other request, so
+    they're subject to its limits. Other requests are sent as they are.
+
+    :param connection: The connection to wrap, which must be safe to use \
+            from several threads
+    :param metrics_registry: The \
+            :class:`~hubspot.connection.metrics.MetricsRegistry` given to \
+            ``connection``, if any
+    :param float hedge_delay: The number of seconds after which requests to \
+            endpoints of unknown latency are duplicated, if any
+    :param float latency_percentile: The percentile of the latencies of an \
+            endpoint after which its requests are duplicated
+    :param float max_hedge_ratio: The greatest number of duplicates per \
+            request
+
+    """
+    def __init__(
+        self,
+        connection,
+        metrics_registry=None,
+        hedge_delay=None,
+        latency_percentile=95,
+        max_hedge_ratio=0.05,
+        ):
+        super(HedgingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._metrics_registry = metrics_registry
+        self._hedge_delay = hedge_delay
+        self._latency_percentile = latency_percentile
+        self._max_hedge_ratio = max_hedge_ratio
+
+        self._worker_pool = _WorkerPool()
+
+        self._lock = Lock()
+        self._hedge_budget = 0.0
+        self._request_count = 0
+        self._hedge_count = 0
+        self._hedge_win_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        with self._lock:
+            self._request_count += 1
+            self._hedge_budget = min(
+                self._hedge_budget + self._max_hedge_ratio,
+                _MAX_HEDGE_BURST,
+                )
+            is_hedge_affordable = 1 <= self._hedge_budget
+
+        hedge_delay = self._get_hedge_delay(url_path)
+        if hedge_delay is None or not is_hedge_affordable:
+            return self._connection.send_get_request(
+                url_path,
+                query_string_args,
+                priority=priority,
+                )
+
+        hedged_request = _HedgedRequest()
+        self._start_request(
+            hedged_request,
+            url_path,
+            query_string_args,
+            priority,
+            )
+        is_request_complete = hedged_request.wait(hedge_delay)
+        if not is_request_complete:
+            self._start_hedge(
+                hedged_request,
+                url_path,
+                query_string_args,
+                priority,
+                )
+
+        response_body_deserialization = hedged_request.get_response()
+        if hedged_request.winning_attempt_index == 1:
+            with self._lock:
+                self._hedge_win_count += 1
+        return response_body_deserialization
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_post_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_put_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def get_statistics(self):
+        """
+        Return the number of GET requests, how many of them were duplicated
+        and how many got the response of the duplicate first
+
+        :rtype: :class:`HedgingStatistics`
+
+        """
+        with self._lock:
+            statistics = HedgingStatistics(
+                self._request_count,
+                self._hedge_count,
+                self._hedge_win_count,
+                )
+        return statistics
+
+    def _get_hedge_delay(self, url_path):
+        hedge_delay = None
+        if self._metrics_registry:
+            hedge_delay = self._metrics_registry.get_latency_percentile(
+                'GET',
+                url_path,
+                self._latency_percentile,
+                )
+        if hedge_delay is None:
+            hedge_delay = self._hedge_delay
+        return hedge_delay
+
+    def _start_hedge(
+        self,
+        hedged_request,
+        url_path,
+        query_string_args,
+        priority,
+        ):
+        with self._lock:
+            is_hedge_affordable = 1 <= self._hedge_budget
+            if is_hedge_affordable:
+                self._hedge_budget -= 1
+        if not is_hedge_affordable:
+            return
+
+        is_hedge_started = self._start_request(
+            hedged_request,
+            url_path,
+            query_string_args,
+            priority,
+            )
+        with self._lock:
+            if is_hedge_started:
+                self._hedge_count += 1
+            else:
+                # The request completed in the meantime
+                self._hedge_budget += 1
+
+    def _start_request(
+        self,
+        hedged_request,
+        url_path,
+        query_string_args,
+        priority,
+        ):
+        attempt_index = hedged_request.add_attempt()
+        is_request_started = attempt_index is not None
+        if is_request_started:
+            self._worker_pool.submit(
+                self._send_request,
+                hedged_request,
+                attempt_index,
+                url_path,
+                query_string_args,
+                priority,
+                )
+        return is_request_started
+
+    def _send_request(
+        self,
+        hedged_request,
+        attempt_index,
+        url_path,
+        query_string_args,
+        priority,
+        ):
+        try:
+            response_body_deserialization = self._connection.send_get_request(
+                url_path,
+                query_string_args,
+                priority=priority,
+                )
+        except Exception as exception:
+            hedged_request.set_exception(exception)
+        else:
+            hedged_request.set_response(
+                attempt_index,
+                response_body_deserialization,
+                )
+
+
+class _WorkerPool(object):
+    """
+    Pool of threads running functions, which only grows when all the threads
+    are busy and shrinks when threads remain idle
+    """
+
+    def __init__(self):
+        super(_WorkerPool, self).__init__()
+
+        self._lock = Lock()
+        self._queued_calls = Queue()
+        self._idle_worker_count = 0
+
+    def submit(self, function, *args):
+        with self._lock:
+            is_worker_idle = 0 < self._idle_worker_count
+            if is_worker_idle:
+                self._idle_worker_count -= 1
+
+        self._queued_calls.put((function, args))
+
+        if not is_worker_idle:
+            worker_thread = Thread(target=self._run_calls)
+            worker_thread.daemon = True
+            worker_thread.start()
+
+    def _run_calls(self):
+        while True:
+            try:
+                function, args = \
+                    self._queued_calls.get(timeout=_MAX_WORKER_IDLE_TIME)
+            except Empty:
+                with self._lock:
+                    # Another call may have been submitted to this worker
+                    is_worker_redundant = 0 < self._idle_worker_count
+                    if is_worker_redundant:
+                        self._idle_worker_count -= 1
+                if is_worker_redundant:
+                    return
+            else:
+                function(*args)
+                with self._lock:
+                    self._idle_worker_count += 1
+
+
+class _HedgedRequest(object):
+
+    def __init__(self):
+        super(_HedgedRequest, self).__init__()
+
+        self.winning_attempt_index = None
+
+        self._lock = Lock()
+        self._completion_event = Event()
+        self._attempt_count = 0
+        self._failure_count = 0
+        self._response_body_deserialization = None
+        self._exception = None
+
+    def add_attempt(self):
+        with self._lock:
+            if self._completion_event.is_set():
+                attempt_index = None
+            else:
+                attempt_index = self._attempt_count
+                self._attempt_count += 1
+        return attempt_index
+
+    def set_response(self, attempt_index, response_body_deserialization):
+        with self._lock:
+            if not self._completion_event.is_set():
+                self.winning_attempt_index = attempt_index
+                self._response_body_deserialization = \
+                    response_body_deserialization
+                self._completion_event.set()
+
+    def set_exception(self, exception):
+        with self._lock:
+            if self._completion_event.is_set():
+                return
+
+            self._failure_count += 1
+            if self._exception is None:
+                self._exception = exception
+            if self._failure_count == self._attempt_count:
+                self._completion_event.set()
+
+    def wait(self, timeout):
+        return self._completion_event.wait(timeout)
+
+    def get_response(self):
+        self._completion_event.wait()
+
+        if self.winning_attempt_index is None:
+            raise self._exception
+
+        return self._response_body_deserialization
@@ -0,0 +1,229 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from collections import OrderedDict
+from threading import Lock
+from time import sleep
+
+from requests.exceptions import ConnectTimeout
+from requests.exceptions import RequestException
+
+from hubspot.connection import _is_iterator
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotServerError
+
+
+_AMBIGUOUS_EXCEPTION_CLASSES = (RequestException, HubspotServerError)
+
+
+class OutcomeStore(object):
+    """
+    Bounded store of the responses to the writes which HubSpot applied,
+    keyed by idempotency key
+
+    The least recently used outcomes are discarded first. The store can be
+    shared by several connections and threads.
+
+    :param int max_entry_count: The maximum number of outcomes to remember
+
+    """
+    def __init__(self, max_entry_count=10000):
+        super(OutcomeStore, self).__init__()
+
+        self._max_entry_count = max_entry_count
+
+        self._lock = Lock()
+        self._outcomes_by_key = OrderedDict()
+
+    def __len__(self):
+        return len(self._outcomes_by_key)
+
+    def __contains__(self, idempotency_key):
+        return idempotency_key in self._outcomes_by_key
+
+    def get(self, idempotency_key):
+        """
+        Return the outcome stored for ``idempotency_key``.
+
+        :raises KeyError: If there's no outcome for ``idempotency_key``
+
+        """
+        with self._lock:
+            outcome = self._outcomes_by_key.pop(idempotency_key)
+            self._outcomes_by_key[idempotency_key] = outcome
+        return outcome
+
+    def set(self, idempotency_key, outcome):
+        with self._lock:
+            self._outcomes_by_key.pop(idempotency_key, None)
+            self._outcomes_by_key[idempotency_key] = outcome
+            while self._max_entry_count < len(self._outcomes_by_key):
+                self._outcomes_by_key.popitem(last=False)
+
+
+class IdempotentPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    makes POST requests safe to retry
+
+    A POST request can be tagged with an idempotency key identifying the
+    logical write, and the response to it is remembered once HubSpot applies
+    it. Repeating the request with the same key returns the remembered
+    response instead of sending the request again. Requests without a key
+    are always sent, since identical writes may legitimately be repeated
+    (e.g., to set a property back to a previous value).
+
+    Failures are retried up to ``max_attempts`` times, except for requests
+    whose body is an iterator, which can only be sent once. When it's unknown
+    whether HubSpot applied the request (e.g., the connection dropped or a
+    server error was returned), it's only retried if ``duplicate_resolver``
+    is set, and only after the resolver reports that HubSpot didn't apply
+    it. The resolver is called with the connection, the URL path and the body
+    of the request, and must return the response HubSpot would've given to
+    the request if it was applied (e.g., by looking up a contact by email), or
+    ``None`` otherwise.
+
+    Other requests are sent as they are.
+
+    :param connection: The connection to wrap
+    :param OutcomeStore outcome_store: The store of the responses to the \
+            writes applied, which defaults to a new one
+    :param int max_attempts: The number of times a request is sent at most
+    :param callable duplicate_resolver: The callable to find out whether a \
+            write was applied
+    :param float retry_delay: The number of seconds to wait before the first \
+            retry, which doubles on each retry
+
+    """
+    def __init__(
+        self,
+        connection,
+        outcome_store=None,
+        max_attempts=3,
+        duplicate_resolver=None,
+        retry_delay=0.5,
+        ):
+        super(IdempotentPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._outcome_store = \
+            OutcomeStore() if outcome_store is None else outcome_store
+        self._max_attempts = max_attempts
+        self._duplicate_resolver = duplicate_resolver
+        self._retry_delay = retry_delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        return self._connection.send_get_request(
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+
+    def send_post_request(
+        self,
+        url_path,
+        body_deserialization,
+        priority=None,
+        idempotency_key=None,
+        ):
+        """
+        Send a POST request to HubSpot unless it was already applied
+
+        :param basestring idempotency_key: The key identifying the logical \
+                write, if it mustn't be applied more than once across calls
+
+        Other arguments and the return value are those of
+        :meth:`hubspot.connection.PortalConnection.send_post_request`.
+
+        """
+        if idempotency_key is not None and \
+                idempotency_key in self._outcome_store:
+            return self._outcome_store.get(idempotency_key)
+
+        if _is_iterator(body_deserialization):
+            max_attempts = 1
+        else:
+            max_attempts = self._max_attempts
+
+        is_outcome_ambiguous = False
+        attempt_number = 1
+        while True:
+            if is_outcome_ambiguous:
+                response_body_deserialization = \
+                    self._resolve_duplicate(url_path, body_deserialization)
+                if response_body_deserialization is not None:
+                    break
+
+            try:
+                response_body_deserialization = \
+                    self._connection.send_post_request(
+                        url_path,
+                        body_deserialization,
+                        priority=priority,
+                        )
+            except ConnectTimeout:
+                # The request never reached HubSpot
+                if max_attempts <= attempt_number:
+                    raise
+            except HubspotClientError:
+                # HubSpot may be rejecting the request as a duplicate
+                if is_outcome_ambiguous:
+                    response_body_deserialization = \
+                        self._resolve_duplicate(url_path, body_deserialization)
+                    if response_body_deserialization is not None:
+                        break
+                raise
+            except _AMBIGUOUS_EXCEPTION_CLASSES:
+                is_outcome_ambiguous = True
+                if not self._duplicate_resolver or \
+                        max_attempts <= attempt_number:
+                    raise
+            else:
+                break
+
+            sleep(self._retry_delay * 2 ** (attempt_number - 1))
+            attempt_number += 1
+
+        if idempotency_key is not None:
+            self._outcome_store.set(
+                idempotency_key,
+                response_body_deserialization,
+                )
+        return response_body_deserialization
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_put_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def _resolve_duplicate(self, url_path, body_deserialization):
+        response_body_deserialization = self._duplicate_resolver(
+            self._connection,
+            url_path,
+            body_deserialization,
+            )
+        return response_body_deserialization
+
@@ -0,0 +1,450 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from re import compile as compile_regex
+from threading import Lock
+
+from pyrecord import Record
+
+
+_URL_PATH_SEGMENT_PLACEHOLDERS_BY_REGEX = (
+    (compile_regex(r'^\d+$'), '{id}'),
+    (compile_regex(r'^[0-9a-fA-F]{8}(-?[0-9a-fA-F]{4}){3}-?[0-9a-fA-F]{12}$'),
+        '{id}'),
+    (compile_regex(r'^[^@]+@[^@]+$'), '{email}'),
+    )
+
+_OTHER_URL_PATH_TEMPLATE = '{other}'
+
+_LATENCY_SUMMARY_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def template_url_path(url_path):
+    """
+    Return ``url_path`` with the segments which identify an object replaced
+    with placeholders, so that the URL paths of an endpoint share a template
+
+    For example, ``/contacts/v1/contact/vid/123/profile`` becomes
+    ``/contacts/v1/contact/vid/{id}/profile`` and
+    ``/contacts/v1/contact/email/jane@example.com/profile`` becomes
+    ``/contacts/v1/contact/email/{email}/profile``.
+
+    """
+    url_path_segments = url_path.split('/')
+    for index, url_path_segment in enumerate(url_path_segments):
+        for regex, placeholder in _URL_PATH_SEGMENT_PLACEHOLDERS_BY_REGEX:
+            if regex.match(url_path_segment):
+                url_path_segments[index] = placeholder
+                break
+    return '/'.join(url_path_segments)
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies in a fixed amount of memory, with buckets whose
+    width grows with the latency as in HDR histograms
+
+    Latencies are counted in microseconds, exactly up to
+    ``2 ** significant_bit_count`` and with a relative error of at most
+    ``2 ** (1 - significant_bit_count)`` beyond that. Latencies greater than
+    ``max_latency`` are counted as ``max_latency``.
+
+    :param float max_latency: The greatest latency tracked, in seconds
+    :param int significant_bit_count: The precision of the buckets
+
+    """
+
+    def __init__(self, max_latency=60.0, significant_bit_count=7):
+        super(LatencyHistogram, self).__init__()
+
+        self._significant_bit_count = significant_bit_count
+        self._max_value = int(max_latency * 1000000)
+        self._bucket_counts = \
+            [0] * (self._get_bucket_index(self._max_value) + 1)
+
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, latency):
+        """
+        Count ``latency``
+
+        :param float latency: The latency in seconds
+
+        """
+        value = min(max(int(latency * 1000000), 0), self._max_value)
+        self._bucket_counts[self._get_bucket_index(value)] += 1
+        self.count += 1
+        self.total += latency
+
+    def get_percentile(self, percentile):
+        """
+        Return the latency under which ``percentile`` percent of the latencies
+        counted fall
+
+        :param float percentile: The percentile, between 0 and 100
+        :return: The latency in seconds, or ``None`` if none was counted
+        :rtype: float
+
+        """
+        if not self.count:
+            return None
+
+        target_count = max(percentile / 100.0 * self.count, 1)
+        cumulative_count = 0
+        for bucket_index, bucket_count in enumerate(self._bucket_counts):
+            cumulative_count += bucket_count
+            if target_count <= cumulative_count:
+                break
+        latency = self._get_bucket_upper_value(bucket_index) / 1000000.0
+        return latency
+
+    def copy(self):
+        """
+        Return a copy of the histogram
+
+        :rtype: LatencyHistogram
+
+        """
+        histogram_copy = self.__class__.__new__(self.__class__)
+        histogram_copy.__dict__.update(self.__dict__)
+        histogram_copy._bucket_counts = list(self._bucket_counts)
+        return histogram_copy
+
+    def _get_bucket_index(self, value):
+        sub_bucket_count = 1 << self._significant_bit_count
+        if value < sub_bucket_count:
+            return value
+
+        half_sub_bucket_count = sub_bucket_count >> 1
+        exponent = value.bit_length() - self._significant_bit_count
+        mantissa = value >> exponent
+        bucket_index = sub_bucket_count + \
+            (exponent - 1) * half_sub_bucket_count + \
+            mantissa - half_sub_bucket_count
+        return bucket_index
+
+    def _get_bucket_upper_value(self, bucket_index):
+        sub_bucket_count = 1 << self._significant_bit_count
+        if bucket_index < sub_bucket_count:
+            return bucket_index
+
+        half_sub_bucket_count = sub_bucket_count >> 1
+        exponent, mantissa_offset = divmod(
+            bucket_index - sub_bucket_count,
+            half_sub_bucket_count,
+            )
+        exponent += 1
+        mantissa = half_sub_bucket_count + mantissa_offset
+        upper_value = ((mantissa + 1) << exponent) - 1
+        return min(upper_value, self._max_value)
+
+
+EndpointMetrics = Record.create_type(
+    'EndpointMetrics',
+    'http_method',
+    'url_path_template',
+    'request_count',
+    'counts_by_status_class',
+    'counts_by_exception_name',
+    'request_byte_count',
+    'response_byte_count',
+    'latency_histogram',
+    )
+
+
+class MetricsRegistry(object):
+    """
+    Registry of the latencies, outcomes and sizes of the requests to each
+    endpoint
+
+    Pass the registry to :class:`~hubspot.connection.PortalConnection` so that
+    every request gets counted. The URL paths are turned into templates by
+    ``url_path_templater`` to group the requests by endpoint, and the requests
+    to any endpoint beyond the first ``max_endpoint_count`` are counted
+    together under the template ``{other}`` so that memory remains bounded.
+
+    :param callable url_path_templater: The function returning the template \
+            for a URL path
+    :param int max_endpoint_count: The number of endpoints tracked separately
+    :param float max_latency: The greatest latency tracked by the \
+            histograms, in seconds
+
+    """
+
+    def __init__(
+        self,
+        url_path_templater=template_url_path,
+        max_endpoint_count=256,
+        max_latency=60.0,
+        ):
+        super(MetricsRegistry, self).__init__()
+
+        self._url_path_templater = url_path_templater
+        self._max_endpoint_count = max_endpoint_count
+        self._max_latency = max_latency
+
+        self._lock = Lock()
+        self._endpoint_metrics_by_key = {}
+
+    def record_request(
+        self,
+        http_method,
+        url_path,
+        latency=None,
+        status_code=None,
+        exception=None,
+        request_byte_count=0,
+        response_byte_count=0,
+        ):
+        """
+        Count a request
+
+        :param basestring http_method: The HTTP method of the request
+        :param basestring url_path: The URL path of the request
+        :param float latency: The time taken to get the response, in \
+                seconds, unless the request wasn't sent
+        :param int status_code: The status code of the response, if any
+        :param Exception exception: The exception raised, if any
+        :param int request_byte_count: The size of the request body
+        :param int response_byte_count: The size of the response body
+
+        """
+        url_path_template = self._url_path_templater(url_path)
+        with self._lock:
+            endpoint_metrics = \
+                self._get_endpoint_metrics(http_method, url_path_template)
+
+            endpoint_metrics.request_count += 1
+            if status_code is not None:
+                status_class = '{}xx'.format(status_code // 100)
+                _increment_count(
+                    endpoint_metrics.counts_by_status_class,
+                    status_class,
+                    )
+            if exception is not None:
+                _increment_count(
+                    endpoint_metrics.counts_by_exception_name,
+                    exception.__class__.__name__,
+                    )
+            endpoint_metrics.request_byte_count += request_byte_count
+            endpoint_metrics.response_byte_count += response_byte_count
+            if latency is not None:
+                endpoint_metrics.latency_histogram.record(latency)
+
+    def get_snapshot(self):
+        """
+        Return a copy of the metrics of each endpoint
+
+        The requests are counted by status class, such as ``'2xx'`` and
+        ``'4xx'``, and by the name of the class of the exception raised, such
+        as ``'HubspotClientError'``.
+
+        :rtype: list of :class:`EndpointMetrics`
+
+        """
+        with self._lock:
+            snapshot = [
+                EndpointMetrics(
+                    endpoint_metrics.http_method,
+                    endpoint_metrics.url_path_template,
+                    endpoint_metrics.request_count,
+                    dict(endpoint_metrics.counts_by_status_class),
+                    dict(endpoint_metrics.counts_by_exception_name),
+                    endpoint_metrics.request_byte_count,
+                    endpoint_metrics.response_byte_count,
+                    endpoint_metrics.latency_histogram.copy(),
+                    )
+                for endpoint_metrics in self._endpoint_metrics_by_key.values()
+                ]
+        snapshot.sort(key=_get_endpoint_metrics_sort_key)
+        return snapshot
+
+    def get_latency_percentile(self, http_method, url_path, percentile):
+        """
+        Return a percentile of the latencies of the endpoint of ``url_path``
+
+        :return: The latency in seconds, or ``None`` if no latency was \
+                counted for the endpoint
+        :rtype: float
+
+        """
+        url_path_template = self._url_path_templater(url_path)
+        key = (http_method, url_path_template)
+        with self._lock:
+            endpoint_metrics = self._endpoint_metrics_by_key.get(key)
+            if endpoint_metrics is None:
+                latency = None
+            else:
+                latency_histogram = endpoint_metrics.latency_histogram
+                latency = latency_histogram.get_percentile(percentile)
+        return latency
+
+    def export_prometheus_text(self, metric_name_prefix='hubspot'):
+        """
+        Return the metrics in the Prometheus text exposition format
+
+        :param basestring metric_name_prefix: The prefix of the metric names
+        :rtype: str
+
+        """
+        request_count_lines = []
+        exception_count_lines = []
+        request_byte_count_lines = []
+        response_byte_count_lines = []
+        latency_lines = []
+        for endpoint_metrics in self.get_snapshot():
+            labels = (
+                ('method', endpoint_metrics.http_method),
+                ('endpoint', endpoint_metrics.url_path_template),
+                )
+
+            for status_class, request_count in \
+                    sorted(endpoint_metrics.counts_by_status_class.items()):
+                request_count_lines.append(_format_prometheus_sample(
+                    metric_name_prefix + '_requests_total',
+                    labels + (('status_class', status_class),),
+                    request_count,
+                    ))
+
+            for exception_name, exception_count in \
+                    sorted(endpoint_metrics.counts_by_exception_name.items()):
+                exception_count_lines.append(_format_prometheus_sample(
+                    metric_name_prefix + '_request_exceptions_total',
+                    labels + (('exception', exception_name),),
+                    exception_count,
+                    ))
+
+            request_byte_count_lines.append(_format_prometheus_sample(
+                metric_name_prefix + '_request_bytes_total',
+                labels,
+                endpoint_metrics.request_byte_count,
+                ))
+            response_byte_count_lines.append(_format_prometheus_sample(
+                metric_name_prefix + '_response_bytes_total',
+                labels,
+                endpoint_metrics.response_byte_count,
+                ))
+
+            latency_histogram = endpoint_metrics.latency_histogram
+            latency_metric_name = \
+                metric_name_prefix + '_request_latency_seconds'
+            for quantile in _LATENCY_SUMMARY_QUANTILES:
+                latency = latency_histogram.get_percentile(quantile * 100)
+                latency_lines.append(_format_prometheus_sample(
+                    latency_metric_name,
+                    labels + (('quantile', str(quantile)),),
+                    'NaN' if latency is None else latency,
+                    ))
+            latency_lines.append(_format_prometheus_sample(
+                latency_metric_name + '_sum',
+                labels,
+                latency_histogram.total,
+                ))
+            latency_lines.append(_format_prometheus_sample(
+                latency_metric_name + '_count',
+                labels,
+                latency_histogram.count,
+                ))
+
+        metric_families = (
+            (
+                '_requests_total',
+                'counter',
+                'Responses received from HubSpot.',
+                request_count_lines,
+                ),
+            (
+                '_request_exceptions_total',
+                'counter',
+                'Exceptions raised by requests to HubSpot.',
+                exception_count_lines,
+                ),
+            (
+                '_request_bytes_total',
+                'counter',
+                'Bytes sent in request bodies.',
+                request_byte_count_lines,
+                ),
+            (
+                '_response_bytes_total',
+                'counter',
+                'Bytes received in response bodies.',
+                response_byte_count_lines,
+                ),
+            (
+                '_request_latency_seconds',
+                'summary',
+                'Time taken by HubSpot to respond.',
+                latency_lines,
+                ),
+            )
+        text_lines = []
+        for name_suffix, metric_type, help_text, sample_lines in \
+                metric_families:
+            metric_name = metric_name_prefix + name_suffix
+            text_lines.append('# HELP {} {}'.format(metric_name, help_text))
+            text_lines.append('# TYPE {} {}'.format(metric_name, metric_type))
+            text_lines.extend(sample_lines)
+        return '\n'.join(text_lines) + '\n'
+
+    def _get_endpoint_metrics(self, http_method, url_path_template):
+        key = (http_method, url_path_template)
+        endpoint_metrics = self._endpoint_metrics_by_key.get(key)
+        if endpoint_metrics is None:
+            if self._max_endpoint_count <= len(self._endpoint_metrics_by_key):
+                key = (http_method, _OTHER_URL_PATH_TEMPLATE)
+                endpoint_metrics = self._endpoint_metrics_by_key.get(key)
+
+            if endpoint_metrics is None:
+                endpoint_metrics = EndpointMetrics(
+                    key[0],
+                    key[1],
+                    0,
+                    {},
+                    {},
+                    0,
+                    0,
+                    LatencyHistogram(self._max_latency),
+                    )
+                self._endpoint_metrics_by_key[key] = endpoint_metrics
+        return endpoint_metrics
+
+
+def _get_endpoint_metrics_sort_key(endpoint_metrics):
+    return endpoint_metrics.url_path_template, endpoint_metrics.http_method
+
+
+def _increment_count(counts_by_key, key):
+    counts_by_key[key] = counts_by_key.get(key, 0) + 1
+
+
+def _format_prometheus_sample(metric_name, labels, value):
+    labels_serialization = ','.join(
+        '{}="{}"'.format(
+            label_name,
+            _escape_prometheus_label_value(label_value),
+            )
+        for label_name, label_value in labels
+        )
+    sample = '{}{{{}}} {}'.format(metric_name, labels_serialization, value)
+    return sample
+
+
+def _escape_prometheus_label_value(label_value):
+    label_value = label_value.replace('\\', '\\\\')
+    label_value = label_value.replace('"', '\\"')
+    label_value = label_value.replace('\n', '\\n')
+    return label_value
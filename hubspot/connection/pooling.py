@@ -0,0 +1,452 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from socket import getaddrinfo
+from socket import SOCK_STREAM
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import time
+from weakref import ref as weak_reference
+
+from pyrecord import Record
+from requests import Request
+from requests.adapters import DEFAULT_POOLBLOCK
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from requests.packages.urllib3.connection import HTTPSConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+from requests.packages.urllib3.connectionpool import HTTPSConnectionPool
+from requests.packages.urllib3.poolmanager import PoolManager
+from six.moves.queue import Empty
+from six.moves.queue import Full
+
+
+# Idle connections aren't checked more often than this, however short their
+# maximum idle age
+_MIN_REAPING_INTERVAL = 1
+
+PoolStatistics = Record.create_type(
+    'PoolStatistics',
+    'reused_connection_count',
+    'fresh_connection_count',
+    'stale_connection_count',
+    'reaped_connection_count',
+    )
+
+
+class DNSCache(object):
+    """
+    Cache of the addresses of host names, which expire after ``ttl`` seconds
+
+    Pass the cache to :class:`~hubspot.connection.PortalConnection` so that
+    new connections don't wait for a DNS lookup, including after the
+    connections in the pool have been closed. The same cache can be shared
+    by several connections.
+
+    :param float ttl: The number of seconds for which an address is reused
+
+    """
+
+    def __init__(self, ttl=300):
+        super(DNSCache, self).__init__()
+
+        self._ttl = ttl
+
+        self._lock = Lock()
+        self._entries_by_host = {}
+
+    def resolve(self, host, port=None):
+        """
+        Return the address of ``host``, looking it up only if it isn't
+        cached or it has expired.
+
+        :raises socket.gaierror: If the host name can't be resolved
+
+        """
+        current_time = time()
+        with self._lock:
+            entry = self._entries_by_host.get(host)
+        if entry is not None:
+            address, expiry_time = entry
+            if current_time < expiry_time:
+                return address
+
+        address = self._look_up_address(host, port)
+        with self._lock:
+            self._entries_by_host[host] = (address, current_time + self._ttl)
+        return address
+
+    def clear(self):
+        """Forget all the addresses."""
+        with self._lock:
+            self._entries_by_host.clear()
+
+    @staticmethod
+    def _look_up_address(host, port):
+        address_infos = getaddrinfo(host, port, 0, SOCK_STREAM)
+        address = address_infos[0][4][0]
+        return address
+
+
+class _PoolingHTTPAdapter(HTTPAdapter):
+
+    __attrs__ = HTTPAdapter.__attrs__ + [
+        '_dns_cache',
+        '_pool_classes_by_scheme',
+        '_max_idle_age',
+        '_connection_statistics',
+        ]
+
+    def __init__(
+        self,
+        dns_cache=None,
+        pool_classes_by_scheme=None,
+        max_idle_age=None,
+        *args,
+        **kwargs
+        ):
+        self._dns_cache = dns_cache
+        self._pool_classes_by_scheme = \
+            pool_classes_by_scheme or _POOL_CLASSES_BY_SCHEME
+        self._max_idle_age = max_idle_age
+        self._connection_statistics = _ConnectionStatistics()
+
+        super(_PoolingHTTPAdapter, self).__init__(*args, **kwargs)
+
+        self._reaper_stop_event = Event()
+        if max_idle_age is not None:
+            reaper_thread = Thread(
+                target=_reap_idle_connections,
+                args=(
+                    weak_reference(self),
+                    self._reaper_stop_event,
+                    max(max_idle_age, _MIN_REAPING_INTERVAL),
+                    ),
+                )
+            reaper_thread.daemon = True
+            reaper_thread.start()
+
+    def init_poolmanager(
+        self,
+        connections,
+        maxsize,
+        block=DEFAULT_POOLBLOCK,
+        **pool_kwargs
+        ):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+
+        self.poolmanager = _PoolManager(
+            self._dns_cache,
+            self._pool_classes_by_scheme,
+            self._max_idle_age,
+            self._connection_statistics,
+            num_pools=connections,
+            maxsize=maxsize,
+            block=block,
+            **pool_kwargs
+            )
+
+    def open_connections(self, session, url, connection_count):
+        """
+        Open up to ``connection_count`` connections to ``url`` in parallel
+        and put them in the pool, along with those already open.
+
+        :return: The number of connections open
+
+        """
+        request = session.prepare_request(Request('GET', url))
+        settings = session.merge_environment_settings(url, {}, None, None, None)
+        if hasattr(self, 'get_connection_with_tls_context'):
+            connection_pool = self.get_connection_with_tls_context(
+                request,
+                settings['verify'],
+                settings['proxies'],
+                settings['cert'],
+                )
+        else:
+            # requests < 2.32
+            connection_pool = self.get_connection(url, settings['proxies'])
+
+        connection_count = min(connection_count, self._pool_maxsize)
+        connections = [
+            connection_pool._get_conn() for _ in range(connection_count)
+            ]
+        connected_connections = \
+            [connection for connection in connections if connection.sock]
+        connection_threads = [
+            Thread(
+                target=_connect,
+                args=(connection, connected_connections),
+                )
+            for connection in connections if not connection.sock
+            ]
+        for connection_thread in connection_threads:
+            connection_thread.start()
+        for connection_thread in connection_threads:
+            connection_thread.join()
+
+        for connection in connections:
+            connection_pool._put_conn(connection)
+        return len(connected_connections)
+
+    def close_idle_connections(self):
+        """
+        Close the connections in the pools which have been idle for longer
+        than the maximum idle age, if any.
+
+        """
+        if self._max_idle_age is None:
+            return
+
+        connection_pools = self.poolmanager.pools
+        for pool_key in connection_pools.keys():
+            connection_pool = connection_pools.get(pool_key)
+            if connection_pool is not None:
+                connection_pool.close_idle_connections()
+
+    def get_statistics(self):
+        return self._connection_statistics.get_snapshot()
+
+    def close(self):
+        self._reaper_stop_event.set()
+        super(_PoolingHTTPAdapter, self).close()
+
+
+class _PoolManager(PoolManager):
+
+    def __init__(
+        self,
+        dns_cache,
+        pool_classes_by_scheme,
+        max_idle_age,
+        connection_statistics,
+        *args,
+        **kwargs
+        ):
+        super(_PoolManager, self).__init__(*args, **kwargs)
+
+        self._dns_cache = dns_cache
+        self.pool_classes_by_scheme = pool_classes_by_scheme
+        self._max_idle_age = max_idle_age
+        self._connection_statistics = connection_statistics
+
+    def _new_pool(self, *args, **kwargs):
+        connection_pool = \
+            super(_PoolManager, self)._new_pool(*args, **kwargs)
+        connection_pool.dns_cache = self._dns_cache
+        connection_pool.max_idle_age = self._max_idle_age
+        connection_pool.connection_statistics = self._connection_statistics
+        return connection_pool
+
+
+class _ConnectionStatistics(object):
+
+    def __init__(self):
+        super(_ConnectionStatistics, self).__init__()
+
+        self._lock = Lock()
+        self._counts_by_connection_state = {
+            'reused': 0,
+            'fresh': 0,
+            'stale': 0,
+            'reaped': 0,
+            }
+
+    def increment(self, connection_state):
+        with self._lock:
+            self._counts_by_connection_state[connection_state] += 1
+
+    def get_snapshot(self):
+        with self._lock:
+            counts_by_connection_state = \
+                dict(self._counts_by_connection_state)
+        pool_statistics = PoolStatistics(
+            counts_by_connection_state['reused'],
+            counts_by_connection_state['fresh'],
+            counts_by_connection_state['stale'],
+            counts_by_connection_state['reaped'],
+            )
+        return pool_statistics
+
+
+class _IdleConnectionReapingPoolMixin(object):
+    """
+    Connection pool which keeps track of how long its connections have been
+    idle, so that those likely to have been closed by HubSpot's load
+    balancers aren't reused.
+
+    urllib3 already discards the connections found to be closed when they
+    are taken from the pool; this also discards those which have been idle
+    for longer than ``max_idle_age``, since a request sent on a connection
+    being closed fails only after it's been sent.
+
+    """
+
+    max_idle_age = None
+
+    connection_statistics = None
+
+    def _get_conn(self, timeout=None):
+        connection = \
+            super(_IdleConnectionReapingPoolMixin, self)._get_conn(timeout)
+
+        idle_start_time = getattr(connection, 'idle_start_time', None)
+        if idle_start_time is None:
+            connection_state = 'fresh'
+        elif not connection.sock:
+            # urllib3 found the connection closed
+            connection_state = 'stale'
+        elif self._is_connection_too_old(connection, time()):
+            connection.close()
+            connection_state = 'stale'
+        else:
+            connection_state = 'reused'
+        connection.idle_start_time = None
+
+        if self.connection_statistics:
+            self.connection_statistics.increment(connection_state)
+
+        return connection
+
+    def _put_conn(self, connection):
+        if connection is not None and connection.sock:
+            connection.idle_start_time = time()
+        super(_IdleConnectionReapingPoolMixin, self)._put_conn(connection)
+
+    def close_idle_connections(self):
+        pool = self.pool
+        if pool is None or self.max_idle_age is None:
+            return
+
+        connections = []
+        while True:
+            try:
+                connections.append(pool.get(block=False))
+            except Empty:
+                break
+
+        current_time = time()
+        # Put the connections back in the order they were in, so that the
+        # most recently used are still the first to be reused
+        for connection in reversed(connections):
+            is_connection_reapable = connection is not None and \
+                connection.sock and \
+                self._is_connection_too_old(connection, current_time)
+            if is_connection_reapable:
+                connection.close()
+                connection.idle_start_time = None
+                if self.connection_statistics:
+                    self.connection_statistics.increment('reaped')
+
+            try:
+                pool.put(connection, block=False)
+            except Full:
+                # Other threads have put new connections in the meantime
+                if connection is not None:
+                    connection.close()
+
+    def _is_connection_too_old(self, connection, current_time):
+        is_connection_too_old = self.max_idle_age is not None and \
+            self.max_idle_age < current_time - connection.idle_start_time
+        return is_connection_too_old
+
+
+class _DNSCachingConnectionPoolMixin(object):
+
+    dns_cache = None
+
+    def _new_conn(self):
+        connection = super(_DNSCachingConnectionPoolMixin, self)._new_conn()
+        connection.dns_cache = self.dns_cache
+        return connection
+
+
+class _DNSCachingConnectionMixin(object):
+
+    dns_cache = None
+
+    def _new_conn(self):
+        # The host name is only swapped for its address while the socket is
+        # created, so that the Host header and the TLS certificate
+        # verification still use the host name
+        dns_host = getattr(self, '_dns_host', None)
+        if not self.dns_cache or dns_host is None:
+            # urllib3 < 1.24 doesn't tell the host name from its address
+            return super(_DNSCachingConnectionMixin, self)._new_conn()
+
+        try:
+            self._dns_host = self.dns_cache.resolve(dns_host, self.port)
+        except EnvironmentError:
+            # Let the connection look the host name up itself, and report
+            # the failure the way it does
+            pass
+        try:
+            socket = super(_DNSCachingConnectionMixin, self)._new_conn()
+        finally:
+            self._dns_host = dns_host
+        return socket
+
+
+class _HTTPConnection(_DNSCachingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_DNSCachingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _HTTPConnectionPool(
+    _IdleConnectionReapingPoolMixin,
+    _DNSCachingConnectionPoolMixin,
+    HTTPConnectionPool,
+    ):
+
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSConnectionPool(
+    _IdleConnectionReapingPoolMixin,
+    _DNSCachingConnectionPoolMixin,
+    HTTPSConnectionPool,
+    ):
+
+    ConnectionCls = _HTTPSConnection
+
+
+_POOL_CLASSES_BY_SCHEME = {
+    'http': _HTTPConnectionPool,
+    'https': _HTTPSConnectionPool,
+    }
+
+
+def _reap_idle_connections(adapter_reference, stop_event, interval):
+    while not stop_event.wait(interval):
+        adapter = adapter_reference()
+        if adapter is None:
+            break
+        adapter.close_idle_connections()
+        del adapter
+
+
+def _connect(connection, connected_connections):
+    try:
+        connection.connect()
+    except Exception:
+        connection.close()
+    else:
+        connected_connections.append(connection)
@@ -0,0 +1,272 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from logging import getLogger
+from re import compile as compile_regex
+from threading import Lock
+
+from pyrecord import Record
+
+
+PropertyProjection = Record.create_type(
+    'PropertyProjection',
+    'url_path_pattern',
+    'query_string_arg_name',
+    'property_names',
+    'learning_request_count',
+    property_names=(),
+    learning_request_count=0,
+    )
+
+
+_LOGGER = getLogger(__name__)
+
+
+CONTACT_PROPERTY_PROJECTION = PropertyProjection(
+    r'^/contacts/v1/(contact|lists)/',
+    'property',
+    )
+
+
+COMPANY_PROPERTY_PROJECTION = PropertyProjection(
+    r'^/companies/v2/companies/',
+    'properties',
+    )
+
+
+class ProjectingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    requests only the properties of contacts and companies that are read
+
+    The GET requests whose URL path matches the ``url_path_pattern`` of one
+    of the ``projections`` get the ``query_string_arg_name`` query string
+    argument set to the names of the properties to be returned, unless it's
+    already set by the caller. Those are the ``property_names`` declared in
+    the projection, plus any learnt from the responses:
+
+    - The first ``learning_request_count`` requests are sent as they are,
+      and the properties that are then read from the ``properties`` of the
+      objects in the responses are recorded.
+    - The properties read afterwards are still recorded, so that the
+      subsequent requests include them. Until then, they're missing from
+      the objects, like those the objects don't have, and a warning is
+      logged the first time each of them is read from a response.
+
+    Properties are only recorded when read by key (e.g., with ``[]``,
+    ``get()`` or ``in``), not when iterating over all the properties of an
+    object. The requests for projections without any declared or learnt
+    properties are sent as they are.
+
+    :param connection: The connection to wrap
+    :param projections: The :class:`PropertyProjection` instances
+
+    """
+    def __init__(
+        self,
+        connection,
+        projections=(CONTACT_PROPERTY_PROJECTION, COMPANY_PROPERTY_PROJECTION),
+        ):
+        super(ProjectingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._projection_states = [
+            _ProjectionState(projection) for projection in projections
+            ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        projection_state = self._get_projection_state(url_path)
+        is_request_projectable = projection_state is not None and \
+            projection_state.projection.query_string_arg_name not in \
+            (query_string_args or {})
+        if not is_request_projectable:
+            return self._connection.send_get_request(
+                url_path,
+                query_string_args,
+                priority=priority,
+                )
+
+        is_learning = projection_state.start_request()
+        property_names = projection_state.get_property_names()
+        requested_property_names = None
+        if not is_learning and property_names:
+            requested_property_names = property_names
+            query_string_args = dict(
+                query_string_args or {},
+                **{
+                    projection_state.projection.query_string_arg_name:
+                        sorted(property_names),
+                    }
+                )
+
+        response_body_deserialization = self._connection.send_get_request(
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+
+        if projection_state.projection.learning_request_count:
+            property_read_tracker = _PropertyReadTracker(
+                url_path,
+                projection_state,
+                requested_property_names,
+                )
+            _track_property_reads(
+                response_body_deserialization,
+                property_read_tracker.record_property_read,
+                )
+
+        return response_body_deserialization
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_post_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._connection.send_put_request(
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._connection.send_delete_request(url_path, priority=priority)
+
+    def get_property_names(self, projection):
+        """
+        Return the names of the properties requested for ``projection``
+
+        :param projection: One of the :class:`PropertyProjection` instances \
+                passed to the constructor
+        :rtype: :class:`frozenset`
+
+        """
+        for projection_state in self._projection_states:
+            if projection_state.projection is projection:
+                return projection_state.get_property_names()
+        raise ValueError('Unknown projection {!r}'.format(projection))
+
+    def _get_projection_state(self, url_path):
+        for projection_state in self._projection_states:
+            if projection_state.url_path_regex.match(url_path):
+                return projection_state
+        return None
+
+
+class _ProjectionState(object):
+
+    def __init__(self, projection):
+        super(_ProjectionState, self).__init__()
+
+        self.projection = projection
+        self.url_path_regex = compile_regex(projection.url_path_pattern)
+
+        self._lock = Lock()
+        self._property_names = frozenset(projection.property_names)
+        self._started_request_count = 0
+
+    def start_request(self):
+        with self._lock:
+            is_learning = self._started_request_count < \
+                self.projection.learning_request_count
+            self._started_request_count += 1
+        return is_learning
+
+    def get_property_names(self):
+        return self._property_names
+
+    def add_property_name(self, property_name):
+        if property_name in self._property_names:
+            return
+
+        with self._lock:
+            self._property_names = self._property_names | {property_name}
+
+
+class _PropertyReadTracker(object):
+
+    def __init__(self, url_path, projection_state, requested_property_names):
+        super(_PropertyReadTracker, self).__init__()
+
+        self._url_path = url_path
+        self._projection_state = projection_state
+        self._requested_property_names = requested_property_names
+
+        self._unrequested_property_names = set()
+
+    def record_property_read(self, property_name):
+        self._projection_state.add_property_name(property_name)
+
+        is_property_unrequested = \
+            self._requested_property_names is not None and \
+            property_name not in self._requested_property_names and \
+            property_name not in self._unrequested_property_names
+        if is_property_unrequested:
+            self._unrequested_property_names.add(property_name)
+            _LOGGER.warning(
+                'Property %r was read from the response to %s but not '
+                'requested; it will be requested from now on',
+                property_name,
+                self._url_path,
+                )
+
+
+class _PropertyReadTrackingDict(dict):
+
+    def __init__(self, properties, record_property_name):
+        super(_PropertyReadTrackingDict, self).__init__(properties)
+
+        self._record_property_name = record_property_name
+
+    def __getitem__(self, property_name):
+        self._record_property_name(property_name)
+        return super(_PropertyReadTrackingDict, self).__getitem__(
+            property_name,
+            )
+
+    def __contains__(self, property_name):
+        self._record_property_name(property_name)
+        return super(_PropertyReadTrackingDict, self).__contains__(
+            property_name,
+            )
+
+    def get(self, property_name, default=None):
+        self._record_property_name(property_name)
+        return super(_PropertyReadTrackingDict, self).get(
+            property_name,
+            default,
+            )
+
+
+def _track_property_reads(response_body_deserialization, record_property_name):
+    if isinstance(response_body_deserialization, dict):
+        for key, value in list(response_body_deserialization.items()):
+            if key == 'properties' and isinstance(value, dict):
+                response_body_deserialization[key] = \
+                    _PropertyReadTrackingDict(value, record_property_name)
+            else:
+                _track_property_reads(value, record_property_name)
+    elif isinstance(response_body_deserialization, list):
+        for item in response_body_deserialization:
+            _track_property_reads(item, record_property_name)
@@ -0,0 +1,236 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from json import dumps as json_serialize
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from hubspot.connection._http_server import APIRequestHandler
+from hubspot.connection._http_server import make_api_response
+from hubspot.connection._http_server import make_api_response_for_exception
+from hubspot.connection._http_server import ThreadingHTTPServer
+from hubspot.connection.exc import HubspotException
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotRequestRejectedError
+from hubspot.connection.exc import HubspotServerError
+
+
+_HTTP_STATUS_BAD_GATEWAY = 502
+
+_SERVER_POLL_INTERVAL = 0.05
+
+
+class ProxyServer(object):
+    """
+    Local HTTP server which forwards the requests of the processes on a host
+    to HubSpot through a single connection, so that they share its pool of
+    keep-alive connections, its limits and its cache
+
+    The processes point their :class:`~hubspot.connection.PortalConnection`
+    at the server with ``api_url=proxy_server.api_url``. Their credentials
+    and ``auditId`` are discarded, since those of ``connection`` are used
+    instead, so they can use any authentication key. The priorities of their
+    requests aren't forwarded either.
+
+    Identical GET requests received at the same time are coalesced into a
+    single request to ``connection``. The responses and errors of HubSpot
+    are relayed as they are, except that requests rejected by
+    ``connection`` (e.g., by its
+    :class:`~hubspot.connection.quota.DailyQuota`) get a "429 Too Many
+    Requests" response, and requests that couldn't be sent get a "502 Bad
+    Gateway" one.
+
+    Errors are relayed along with the ``Retry-After`` and
+    ``X-HubSpot-RateLimit-*`` headers of HubSpot's response. Successful
+    responses get the latest ``X-HubSpot-RateLimit-*`` headers returned by
+    the ``get_rate_limit_headers()`` method of ``connection``, if it has
+    one (like :class:`~hubspot.connection.PortalConnection` does).
+
+    The server is started and stopped as a context manager, or run in the
+    current thread with :meth:`serve_forever`. It doesn't authenticate its
+    clients, so it must only listen on addresses they alone can reach.
+
+    :param connection: The :class:`~hubspot.connection.PortalConnection` \
+            or connection wrapper, such as a \
+            :class:`~hubspot.connection.caching.CachingPortalConnection`, to \
+            forward the requests to
+    :param basestring host: The address to listen on
+    :param int port: The port to listen on, which defaults to an unused one
+
+    """
+    def __init__(self, connection, host='127.0.0.1', port=0):
+        super(ProxyServer, self).__init__()
+
+        self._connection = connection
+        self._get_request_coalescer = _GetRequestCoalescer(connection)
+
+        self._http_server = \
+            ThreadingHTTPServer((host, port), _ProxyRequestHandler)
+        self._http_server.proxy_server = self
+        self._http_server_thread = None
+
+    @property
+    def api_url(self):
+        """The URL to pass to :class:`~hubspot.connection.PortalConnection`"""
+        host, port = self._http_server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def serve_forever(self):
+        """Serve requests until the process is interrupted."""
+        try:
+            self._http_server.serve_forever(poll_interval=_SERVER_POLL_INTERVAL)
+        finally:
+            self._http_server.server_close()
+
+    def __enter__(self):
+        self._http_server_thread = Thread(
+            target=self._http_server.serve_forever,
+            kwargs={'poll_interval': _SERVER_POLL_INTERVAL},
+            )
+        self._http_server_thread.daemon = True
+        self._http_server_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._http_server_thread.join()
+
+    def _handle_api_request(
+        self,
+        http_method,
+        url_path,
+        query_string_args,
+        request_body_deserialization,
+        ):
+        try:
+            if http_method == 'GET':
+                response_body_deserialization = \
+                    self._get_request_coalescer.send_get_request(
+                        url_path,
+                        query_string_args,
+                        )
+            elif http_method == 'POST':
+                response_body_deserialization = \
+                    self._connection.send_post_request(
+                        url_path,
+                        request_body_deserialization,
+                        )
+            elif http_method == 'PUT':
+                response_body_deserialization = \
+                    self._connection.send_put_request(
+                        url_path,
+                        request_body_deserialization,
+                        )
+            else:
+                response_body_deserialization = \
+                    self._connection.send_delete_request(url_path)
+        except Exception as exception:
+            api_response = make_api_response_for_exception(
+                _convert_exception(exception),
+                )
+        else:
+            api_response = make_api_response(response_body_deserialization)
+            api_response.headers = \
+                list(api_response.headers) + self._get_rate_limit_headers()
+        return api_response
+
+    def _get_rate_limit_headers(self):
+        get_rate_limit_headers = \
+            getattr(self._connection, 'get_rate_limit_headers', None)
+        if get_rate_limit_headers:
+            rate_limit_headers = sorted(get_rate_limit_headers().items())
+        else:
+            rate_limit_headers = []
+        return rate_limit_headers
+
+
+class _ProxyRequestHandler(APIRequestHandler):
+
+    def handle_api_request(self, *args, **kwargs):
+        return self.server.proxy_server._handle_api_request(*args, **kwargs)
+
+
+class _GetRequestCoalescer(object):
+
+    def __init__(self, connection):
+        super(_GetRequestCoalescer, self).__init__()
+
+        self._connection = connection
+
+        self._lock = Lock()
+        self._pending_requests_by_key = {}
+
+    def send_get_request(self, url_path, query_string_args):
+        request_key = (
+            url_path,
+            json_serialize(query_string_args, sort_keys=True),
+            )
+        with self._lock:
+            pending_request = self._pending_requests_by_key.get(request_key)
+            is_request_new = pending_request is None
+            if is_request_new:
+                pending_request = _PendingRequest()
+                self._pending_requests_by_key[request_key] = pending_request
+
+        if is_request_new:
+            try:
+                response_body_deserialization = \
+                    self._connection.send_get_request(
+                        url_path,
+                        query_string_args,
+                        )
+            except Exception as exception:
+                pending_request.set_exception(exception)
+            else:
+                pending_request.set_result(response_body_deserialization)
+            finally:
+                with self._lock:
+                    del self._pending_requests_by_key[request_key]
+
+        return pending_request.get_result()
+
+
+class _PendingRequest(object):
+
+    def __init__(self):
+        super(_PendingRequest, self).__init__()
+
+        self._completion_event = Event()
+        self._response_body_deserialization = None
+        self._exception = None
+
+    def set_result(self, response_body_deserialization):
+        self._response_body_deserialization = response_body_deserialization
+        self._completion_event.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._completion_event.set()
+
+    def get_result(self):
+        self._completion_event.wait()
+        if self._exception is not None:
+            raise self._exception
+        return self._response_body_deserialization
+
+
+def _convert_exception(exception):
+    if isinstance(exception, HubspotRequestRejectedError):
+        exception = HubspotRateLimitError(str(exception), None)
+    elif not isinstance(exception, HubspotException):
+        exception = HubspotServerError('Bad Gateway', _HTTP_STATUS_BAD_GATEWAY)
+    return exception
@@ -0,0 +1,366 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from threading import Lock
+from time import sleep
+from time import time
+
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.exc import HubspotRequestRejectedError
+
+
+_DAILY_LIMIT_HEADER_NAME = 'X-HubSpot-RateLimit-Daily'
+
+_DAILY_REMAINING_HEADER_NAME = 'X-HubSpot-RateLimit-Daily-Remaining'
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class DailyQuota(object):
+    """
+    Budget of the calls HubSpot allows per day, tracked from the
+    ``X-HubSpot-RateLimit-Daily`` and ``X-HubSpot-RateLimit-Daily-Remaining``
+    response headers
+
+    Tenants (e.g., jobs) can reserve a number of calls or a share of the daily
+    limit, which the requests of other tenants can't use. Once the calls
+    available to a tenant fall to ``slowdown_ratio`` of the daily limit, its
+    requests in the throttled priority classes are paced so that the calls
+    left last until the quota resets, and once they fall to
+    ``rejection_ratio``, these requests are rejected. Any request is rejected
+    when no call is available to its tenant.
+
+    Pass the quota to :class:`~hubspot.connection.PortalConnection` and tag
+    the requests with a
+    :class:`~hubspot.connection.concurrency.RequestPriority` whose tenant is
+    the one holding the reservation.
+
+    :param int daily_limit: The number of calls allowed per day, until a \
+            response says otherwise
+    :param int utc_offset: The offset from UTC, in seconds, of the time zone \
+            at whose midnight the quota resets
+    :param throttled_class_names: The names of the priority classes to slow \
+            down or reject as the quota runs out
+    :param float slowdown_ratio: The ratio of the daily limit under which \
+            requests in the throttled classes are paced
+    :param float rejection_ratio: The ratio of the daily limit under which \
+            requests in the throttled classes are rejected
+
+    """
+
+    def __init__(
+        self,
+        daily_limit=None,
+        utc_offset=0,
+        throttled_class_names=(PRIORITY_CLASS_BULK,),
+        slowdown_ratio=0.2,
+        rejection_ratio=0.05,
+        ):
+        super(DailyQuota, self).__init__()
+
+        assert 0 <= rejection_ratio <= slowdown_ratio <= 1
+
+        self._daily_limit = daily_limit
+        self._utc_offset = utc_offset
+        self._throttled_class_names = frozenset(throttled_class_names)
+        self._slowdown_ratio = slowdown_ratio
+        self._rejection_ratio = rejection_ratio
+
+        self._lock = Lock()
+        self._remaining_count = daily_limit
+        self._reserved_call_counts_by_tenant = {}
+        self._reserved_shares_by_tenant = {}
+        self._consumed_counts_by_tenant = {}
+        self._first_observation = None
+        self._last_observation = None
+        self._next_throttled_request_time = 0
+        self._reset_time = self._get_next_reset_time(self._get_current_time())
+
+    @property
+    def daily_limit(self):
+        """The number of calls allowed per day, if known"""
+        return self._daily_limit
+
+    @property
+    def remaining_count(self):
+        """The number of calls left until the quota resets, if known"""
+        return self._remaining_count
+
+    @property
+    def reset_time(self):
+        """The time at which the quota resets next, as a UNIX timestamp"""
+        return self._reset_time
+
+    def reserve_calls(self, tenant, call_count):
+        """
+        Reserve ``call_count`` calls a day for the requests of ``tenant``,
+        replacing any previous reservation.
+
+        """
+        with self._lock:
+            self._reserved_shares_by_tenant.pop(tenant, None)
+            self._reserved_call_counts_by_tenant[tenant] = call_count
+
+    def reserve_share(self, tenant, share):
+        """
+        Reserve the ratio ``share`` of the daily limit for the requests of
+        ``tenant``, replacing any previous reservation.
+
+        """
+        assert 0 <= share <= 1
+        with self._lock:
+            self._reserved_call_counts_by_tenant.pop(tenant, None)
+            self._reserved_shares_by_tenant[tenant] = share
+
+    def cancel_reservation(self, tenant):
+        """Release the calls reserved for ``tenant``, if any."""
+        with self._lock:
+            self._reserved_call_counts_by_tenant.pop(tenant, None)
+            self._reserved_shares_by_tenant.pop(tenant, None)
+
+    def get_consumed_count(self, tenant=None):
+        """
+        Return the number of calls made by ``tenant`` since the quota last
+        reset.
+
+        """
+        with self._lock:
+            self._reset_if_due(self._get_current_time())
+            return self._consumed_counts_by_tenant.get(tenant, 0)
+
+    def get_available_count(self, tenant=None):
+        """
+        Return the number of calls available to ``tenant`` until the quota
+        resets, or ``None`` if the remaining calls aren't known yet.
+
+        """
+        with self._lock:
+            self._reset_if_due(self._get_current_time())
+            return self._get_available_count(tenant)
+
+    def forecast_exhaustion_time(self):
+        """
+        Return the time at which the quota will run out at the rate it's been
+        consumed since it last reset.
+
+        :return: A UNIX timestamp, or ``None`` if the quota isn't being \
+                consumed or won't run out before it resets
+        :rtype: float
+
+        """
+        with self._lock:
+            self._reset_if_due(self._get_current_time())
+
+            if self._first_observation is None:
+                return None
+
+            first_time, first_remaining_count = self._first_observation
+            last_time, last_remaining_count = self._last_observation
+            consumed_count = first_remaining_count - last_remaining_count
+            if last_time <= first_time or consumed_count <= 0:
+                return None
+
+            consumption_rate = consumed_count / float(last_time - first_time)
+            exhaustion_time = \
+                last_time + last_remaining_count / consumption_rate
+            if self._reset_time <= exhaustion_time:
+                exhaustion_time = None
+            return exhaustion_time
+
+    def acquire(self, priority=None):
+        """
+        Take a call from the quota, waiting if the request must be paced.
+
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` of \
+                the request, if any
+        :raises hubspot.connection.exc.HubspotRequestRejectedError: If the \
+                request can't be made without eating into the calls \
+                reserved for others, or if it's in a throttled class and the \
+                quota is nearly exhausted
+
+        """
+        tenant = priority.tenant if priority else None
+        class_name = priority.class_name if priority else None
+
+        delay = 0
+        with self._lock:
+            current_time = self._get_current_time()
+            self._reset_if_due(current_time)
+
+            available_count = self._get_available_count(tenant)
+            if available_count is not None:
+                if available_count <= 0:
+                    raise HubspotRequestRejectedError(
+                        'Daily quota exhausted for tenant {!r}'.format(tenant),
+                        )
+
+                if class_name in self._throttled_class_names:
+                    delay = self._get_throttling_delay(
+                        available_count,
+                        current_time,
+                        )
+
+                self._remaining_count -= 1
+                self._observe_remaining_count(current_time)
+
+            self._consumed_counts_by_tenant[tenant] = \
+                self._consumed_counts_by_tenant.get(tenant, 0) + 1
+
+        if delay:
+            self._sleep(delay)
+
+    def refund(self, priority=None):
+        """
+        Give back the call taken by a request which wasn't sent after all.
+
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` of \
+                the request, if any
+
+        """
+        tenant = priority.tenant if priority else None
+        with self._lock:
+            self._reset_if_due(self._get_current_time())
+
+            consumed_count = self._consumed_counts_by_tenant.get(tenant, 0)
+            if not consumed_count:
+                # The quota reset since the call was taken
+                return
+
+            self._consumed_counts_by_tenant[tenant] = consumed_count - 1
+            if self._remaining_count is not None:
+                self._remaining_count += 1
+
+    def update(self, response_headers):
+        """
+        Update the remaining calls from the headers of a response.
+
+        :param response_headers: The case-insensitive mapping of response \
+                headers, such as ``requests.Response.headers``. Malformed \
+                headers are ignored
+
+        """
+        daily_limit = _get_count_from_response_header(
+            response_headers,
+            _DAILY_LIMIT_HEADER_NAME,
+            )
+        remaining_count = _get_count_from_response_header(
+            response_headers,
+            _DAILY_REMAINING_HEADER_NAME,
+            )
+        if daily_limit is None and remaining_count is None:
+            return
+
+        with self._lock:
+            current_time = self._get_current_time()
+            self._reset_if_due(current_time)
+
+            if daily_limit is not None:
+                self._daily_limit = daily_limit
+            if remaining_count is not None:
+                self._remaining_count = remaining_count
+                self._observe_remaining_count(current_time)
+
+    def _get_available_count(self, tenant):
+        if self._remaining_count is None:
+            return None
+
+        reserved_count = 0
+        for reserving_tenant in self._get_reserving_tenants():
+            if reserving_tenant != tenant:
+                reserved_count += \
+                    self._get_outstanding_reserved_count(reserving_tenant)
+        return self._remaining_count - reserved_count
+
+    def _get_reserving_tenants(self):
+        reserving_tenants = set(self._reserved_call_counts_by_tenant)
+        reserving_tenants.update(self._reserved_shares_by_tenant)
+        return reserving_tenants
+
+    def _get_outstanding_reserved_count(self, tenant):
+        if tenant in self._reserved_call_counts_by_tenant:
+            reserved_count = self._reserved_call_counts_by_tenant[tenant]
+        elif self._daily_limit is not None:
+            reserved_count = int(
+                self._reserved_shares_by_tenant[tenant] * self._daily_limit
+                )
+        else:
+            reserved_count = 0
+        consumed_count = self._consumed_counts_by_tenant.get(tenant, 0)
+        return max(reserved_count - consumed_count, 0)
+
+    def _get_throttling_delay(self, available_count, current_time):
+        if not self._daily_limit:
+            return 0
+
+        available_ratio = available_count / float(self._daily_limit)
+        if available_ratio <= self._rejection_ratio:
+            raise HubspotRequestRejectedError(
+                'Daily quota nearly exhausted: {} calls available'.format(
+                    available_count,
+                    ),
+                )
+
+        if self._slowdown_ratio < available_ratio:
+            return 0
+
+        request_interval = (self._reset_time - current_time) / available_count
+        request_time = max(current_time, self._next_throttled_request_time)
+        self._next_throttled_request_time = request_time + request_interval
+        return request_time - current_time
+
+    def _observe_remaining_count(self, current_time):
+        observation = (current_time, self._remaining_count)
+        if self._first_observation is None:
+            self._first_observation = observation
+        self._last_observation = observation
+
+    def _reset_if_due(self, current_time):
+        if current_time < self._reset_time:
+            return
+
+        self._remaining_count = self._daily_limit
+        self._consumed_counts_by_tenant.clear()
+        self._first_observation = None
+        self._last_observation = None
+        self._next_throttled_request_time = 0
+        self._reset_time = self._get_next_reset_time(current_time)
+
+    def _get_next_reset_time(self, current_time):
+        local_day_number = (current_time + self._utc_offset) // _SECONDS_PER_DAY
+        reset_time = \
+            (local_day_number + 1) * _SECONDS_PER_DAY - self._utc_offset
+        return reset_time
+
+    @staticmethod
+    def _get_current_time():
+        return time()
+
+    @staticmethod
+    def _sleep(seconds):
+        sleep(seconds)
+
+
+def _get_count_from_response_header(response_headers, header_name):
+    header_value = response_headers.get(header_name)
+    if header_value is None:
+        return None
+
+    try:
+        count = int(header_value)
+    except ValueError:
+        count = None
+    return count
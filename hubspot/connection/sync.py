@@ -0,0 +1,243 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from os import rename
+from os.path import exists as path_exists
+from threading import Lock
+
+from hubspot.connection._pagination import \
+    CONTACT_OFFSET_QUERY_STRING_ARG_NAMES_BY_RESPONSE_KEY
+from hubspot.connection._pagination import iter_pages
+from hubspot.connection._sqlite import SQLiteConnection
+
+
+def iter_changed_records(
+    connection,
+    url_path,
+    records_key,
+    checkpoint_store,
+    checkpoint_name,
+    query_string_args=None,
+    offset_query_string_arg_names_by_response_key=
+        CONTACT_OFFSET_QUERY_STRING_ARG_NAMES_BY_RESPONSE_KEY,
+    has_more_key='has-more',
+    checkpoint_interval=1,
+    priority=None,
+    change_time_getter=None,
+    ):
+    """
+    Generate the records changed in a paginated collection since the last
+    call, resuming from the last checkpoint if the last call was interrupted
+
+    The offsets in each page are checkpointed once all the records in the
+    page have been consumed, so every record is generated at least once even
+    if the process is interrupted. Once the last page has been consumed, the
+    checkpoint is updated so that the next call only generates the records
+    changed in the meantime:
+
+    - For collections sorted from the oldest change, it holds the offsets to
+      the end of the collection, from which the next call resumes.
+    - For collections sorted from the most recent change, such as
+      ``/contacts/v1/lists/recently_updated/contacts/recent``, pass
+      ``change_time_getter`` to get the time of the change from a record.
+      The checkpoint then holds the time of the most recent change, and the
+      next call starts from the first page again but stops at the first
+      record changed before that. The records changed at that very time are
+      generated again, so that none changed at the same time but after the
+      last call is missed.
+
+    :param connection: The :class:`~hubspot.connection.PortalConnection`
+    :param basestring url_path: The URL path to the collection
+    :param basestring records_key: The key to the records in each page
+    :param checkpoint_store: The store of the checkpoints, such as a \
+            :class:`FileCheckpointStore` or a :class:`SQLiteCheckpointStore`
+    :param basestring checkpoint_name: The name of the checkpoint for this \
+            collection in ``checkpoint_store``
+    :param dict query_string_args: Extra query string arguments
+    :param dict offset_query_string_arg_names_by_response_key: The names of \
+            the query string arguments to pass the offsets to the next page, \
+            by the key to each offset in the page. The default is for the \
+            contacts API
+    :param basestring has_more_key: The key to the flag in each page \
+            indicating whether there are more pages
+    :param int checkpoint_interval: The number of pages between checkpoints
+    :param priority: The \
+            :class:`~hubspot.connection.concurrency.RequestPriority` of the \
+            requests, if any
+    :param callable change_time_getter: The function returning the time of \
+            the change from a record, as a JSON-serializable value, for \
+            collections sorted from the most recent change
+
+    """
+    cursor = checkpoint_store.get(checkpoint_name) or {}
+    offset_query_string_args = cursor.get('offsets') or {}
+    high_water_mark = cursor.get('high_water_mark')
+    run_high_water_mark = cursor.get('run_high_water_mark')
+
+    pages = iter_pages(
+        connection,
+        url_path,
+        query_string_args,
+        offset_query_string_args,
+        offset_query_string_arg_names_by_response_key,
+        has_more_key,
+        priority,
+        )
+    for page_number, page_data in enumerate(pages, 1):
+        page, next_offset_query_string_args, has_more_pages = page_data
+
+        is_up_to_date = False
+        for record in page[records_key]:
+            if change_time_getter:
+                change_time = change_time_getter(record)
+                if high_water_mark is not None and \
+                        change_time < high_water_mark:
+                    is_up_to_date = True
+                    break
+                if run_high_water_mark is None or \
+                        run_high_water_mark < change_time:
+                    run_high_water_mark = change_time
+            yield record
+
+        if next_offset_query_string_args:
+            offset_query_string_args = next_offset_query_string_args
+
+        if is_up_to_date or not has_more_pages:
+            break
+
+        if page_number % checkpoint_interval == 0:
+            cursor = {'offsets': offset_query_string_args}
+            if change_time_getter:
+                cursor['high_water_mark'] = high_water_mark
+                cursor['run_high_water_mark'] = run_high_water_mark
+            checkpoint_store.set(checkpoint_name, cursor)
+
+    if change_time_getter:
+        if run_high_water_mark is not None:
+            high_water_mark = run_high_water_mark
+        cursor = {'high_water_mark': high_water_mark}
+    else:
+        cursor = {'offsets': offset_query_string_args}
+    checkpoint_store.set(checkpoint_name, cursor)
+
+
+class FileCheckpointStore(object):
+    """
+    Store of checkpoints in a JSON file, which is replaced atomically on
+    each update
+
+    :param basestring file_path: The path to the file
+
+    """
+    def __init__(self, file_path):
+        super(FileCheckpointStore, self).__init__()
+
+        self._file_path = file_path
+
+        self._lock = Lock()
+
+    def get(self, checkpoint_name):
+        """Return the cursor checkpointed as ``checkpoint_name``, if any."""
+        with self._lock:
+            cursors_by_checkpoint_name = self._read_cursors()
+        return cursors_by_checkpoint_name.get(checkpoint_name)
+
+    def set(self, checkpoint_name, cursor):
+        """Checkpoint ``cursor``, a JSON-serializable object."""
+        with self._lock:
+            cursors_by_checkpoint_name = self._read_cursors()
+            cursors_by_checkpoint_name[checkpoint_name] = cursor
+            self._write_cursors(cursors_by_checkpoint_name)
+
+    def delete(self, checkpoint_name):
+        with self._lock:
+            cursors_by_checkpoint_name = self._read_cursors()
+            if checkpoint_name in cursors_by_checkpoint_name:
+                del cursors_by_checkpoint_name[checkpoint_name]
+                self._write_cursors(cursors_by_checkpoint_name)
+
+    def _read_cursors(self):
+        if not path_exists(self._file_path):
+            return {}
+
+        with open(self._file_path, 'rb') as checkpoint_file:
+            cursors_serialization = checkpoint_file.read().decode('UTF-8')
+        return json_deserialize(cursors_serialization)
+
+    def _write_cursors(self, cursors_by_checkpoint_name):
+        cursors_serialization = json_serialize(cursors_by_checkpoint_name)
+        temporary_file_path = self._file_path + '.tmp'
+        with open(temporary_file_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(cursors_serialization.encode('UTF-8'))
+        _replace_file(temporary_file_path, self._file_path)
+
+
+class SQLiteCheckpointStore(object):
+    """
+    Store of checkpoints in an SQLite database, which may be shared by
+    several processes
+
+    :param basestring database_path: The path to the database
+
+    """
+    def __init__(self, database_path):
+        super(SQLiteCheckpointStore, self).__init__()
+
+        self._database_path = database_path
+
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'CREATE TABLE IF NOT EXISTS checkpoints '
+                '(name TEXT PRIMARY KEY, cursor TEXT NOT NULL)'
+                )
+
+    def get(self, checkpoint_name):
+        """Return the cursor checkpointed as ``checkpoint_name``, if any."""
+        with self._connect() as database_connection:
+            row = database_connection.execute(
+                'SELECT cursor FROM checkpoints WHERE name = ?',
+                (checkpoint_name,),
+                ).fetchone()
+        return json_deserialize(row[0]) if row else None
+
+    def set(self, checkpoint_name, cursor):
+        """Checkpoint ``cursor``, a JSON-serializable object."""
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'INSERT OR REPLACE INTO checkpoints (name, cursor) '
+                'VALUES (?, ?)',
+                (checkpoint_name, json_serialize(cursor)),
+                )
+
+    def delete(self, checkpoint_name):
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'DELETE FROM checkpoints WHERE name = ?',
+                (checkpoint_name,),
+                )
+
+    def _connect(self):
+        return SQLiteConnection(self._database_path)
+
+
+def _replace_file(source_file_path, destination_file_path):
+    try:
+        from os import replace
+    except ImportError:
+        # Python 2, where renaming replaces the destination on POSIX only
+        replace = rename
+    replace(source_file_path, destination_file_path)
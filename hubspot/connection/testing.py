@@ -14,9 +14,31 @@
 #
 ##############################################################################
 from builtins import str as text
-from copy import deepcopy
+from collections import deque
+from functools import partial
+from itertools import chain
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from mmap import ACCESS_READ
+from mmap import mmap
+from random import random
+from threading import Lock
+from threading import Thread
+from time import sleep
+from time import time
 
 from pyrecord import Record
+from six.moves.urllib.parse import parse_qs
+from six.moves.urllib.parse import urlencode
+
+from hubspot.connection import _is_iterator
+from hubspot.connection import exc
+from hubspot.connection._http_server import APIRequestHandler
+from hubspot.connection._http_server import APIResponse
+from hubspot.connection._http_server import make_api_response
+from hubspot.connection._http_server import make_api_response_for_exception
+from hubspot.connection._http_server import ThreadingHTTPServer
+from hubspot.connection.exc import HubspotException
 
 
 APICall = Record.create_type(
@@ -48,13 +70,15 @@ class MockPortalConnection(object):
     def __init__(self, *api_calls_simulators):
         super(MockPortalConnection, self).__init__()
 
-        self._expected_api_calls = []
-        for api_calls_simulator in api_calls_simulators:
-            for api_call in api_calls_simulator():
-                api_call = _normalize_api_call(api_call)
-                self._expected_api_calls.append(api_call)
+        # Simulators are only called, and their API calls normalized, as
+        # requests are made
+        self._expected_api_calls = chain.from_iterable(
+            api_calls_simulator()
+            for api_calls_simulator in api_calls_simulators
+            )
+        self._next_expected_api_call = None
 
-        self._request_count = 0
+        self._api_calls = []
 
     def __enter__(self):
         return self
@@ -63,30 +87,29 @@ class MockPortalConnection(object):
         if exc_type:
             return
 
-        expected_api_call_count = len(self._expected_api_calls)
-        pending_api_call_count = expected_api_call_count - self._request_count
+        pending_api_call_count = self._count_pending_api_calls()
         error_message = \
             '{} more requests were expected'.format(pending_api_call_count)
-        assert expected_api_call_count == self._request_count, error_message
+        assert not pending_api_call_count, error_message
 
-    def send_get_request(self, url_path, query_string_args=None):
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
         return self._call_remote_method(url_path, 'GET', query_string_args)
 
-    def send_post_request(self, url_path, body_deserialization):
+    def send_post_request(self, url_path, body_deserialization, priority=None):
         return self._call_remote_method(
             url_path,
             'POST',
             request_body_deserialization=body_deserialization,
             )
 
-    def send_put_request(self, url_path, body_deserialization):
+    def send_put_request(self, url_path, body_deserialization, priority=None):
         return self._call_remote_method(
             url_path,
             'PUT',
             request_body_deserialization=body_deserialization,
             )
 
-    def send_delete_request(self, url_path):
+    def send_delete_request(self, url_path, priority=None):
         return self._call_remote_method(url_path, 'DELETE')
 
     def _call_remote_method(
@@ -96,20 +119,15 @@ class MockPortalConnection(object):
         query_string_args=None,
         request_body_deserialization=None,
         ):
-        self._require_enough_api_calls(url_path)
-
-        expected_api_call = self._expected_api_calls[self._request_count]
-
-        _assert_request_matches_api_call(
-            expected_api_call,
+        request_body_deserialization = \
+            _deserialize_request_body(request_body_deserialization)
+        expected_api_call = self._pop_expected_api_call(
             url_path,
             http_method,
             query_string_args,
             request_body_deserialization,
             )
 
-        self._request_count += 1
-
         if isinstance(expected_api_call, UnsuccessfulAPICall):
             raise expected_api_call.exception
 
@@ -117,20 +135,133 @@ class MockPortalConnection(object):
 
     @property
     def api_calls(self):
-        api_calls = self._expected_api_calls[:self._request_count]
-        return api_calls
+        return list(self._api_calls)
+
+    def _pop_expected_api_call(
+        self,
+        url_path,
+        http_method,
+        query_string_args,
+        request_body_deserialization,
+        ):
+        expected_api_call = self._get_next_expected_api_call(url_path)
+
+        _assert_request_matches_api_call(
+            expected_api_call,
+            url_path,
+            http_method,
+            query_string_args,
+            request_body_deserialization,
+            )
+
+        self._next_expected_api_call = None
+        self._api_calls.append(expected_api_call)
+
+        return expected_api_call
+
+    def _get_next_expected_api_call(self, url_path):
+        # The expected API call is only discarded once the request matches it
+        if self._next_expected_api_call is None:
+            next_expected_api_call = next(self._expected_api_calls, None)
+            if next_expected_api_call is not None:
+                self._next_expected_api_call = \
+                    _normalize_api_call(next_expected_api_call)
 
-    def _require_enough_api_calls(self, url_path):
-        are_enough_api_calls = \
-            self._request_count < len(self._expected_api_calls)
         error_message = 'Not enough API calls for new requests ' \
             '(requested {!r})'.format(url_path)
-        assert are_enough_api_calls, error_message
+        assert self._next_expected_api_call is not None, error_message
+
+        return self._next_expected_api_call
+
+    def _count_pending_api_calls(self):
+        pending_api_call_count = sum(1 for _ in self._expected_api_calls)
+        if self._next_expected_api_call is not None:
+            pending_api_call_count += 1
+        return pending_api_call_count
+
+
+class UnorderedMockPortalConnection(MockPortalConnection):
+    """
+    Mock representation of a
+    :class:`~hubspot.connection.PortalConnection` which accepts the expected
+    API calls in any order
+
+    Unlike :class:`MockPortalConnection`, this connection can be used from
+    multiple threads at once. The simulators are consumed upfront, and the
+    expected API calls are indexed by their URL path, HTTP method, query
+    string arguments and request body deserialization. An API call expected
+    several times must be requested that many times.
+
+    """
+    def __init__(self, *api_calls_simulators):
+        super(UnorderedMockPortalConnection, self).__init__(
+            *api_calls_simulators
+            )
+
+        self._lock = Lock()
+
+        self._expected_api_calls_by_key = {}
+        for api_call in self._expected_api_calls:
+            api_call_key_serialization = _serialize_api_call_key(
+                api_call.http_method,
+                api_call.url_path,
+                api_call.query_string_args,
+                api_call.request_body_deserialization,
+                )
+            expected_api_calls = self._expected_api_calls_by_key.setdefault(
+                api_call_key_serialization,
+                deque(),
+                )
+            expected_api_calls.append(api_call)
+
+    def _pop_expected_api_call(
+        self,
+        url_path,
+        http_method,
+        query_string_args,
+        request_body_deserialization,
+        ):
+        api_call_key_serialization = _serialize_api_call_key(
+            http_method,
+            url_path,
+            query_string_args,
+            request_body_deserialization,
+            )
+        with self._lock:
+            expected_api_calls = \
+                self._expected_api_calls_by_key.get(api_call_key_serialization)
+            error_message = 'Unexpected API call {} {!r} with query string ' \
+                'arguments {!r} and request body deserialization {!r}'.format(
+                    http_method,
+                    url_path,
+                    query_string_args,
+                    request_body_deserialization,
+                    )
+            assert expected_api_calls, error_message
+
+            expected_api_call = expected_api_calls.popleft()
+            if not expected_api_calls:
+                del self._expected_api_calls_by_key[api_call_key_serialization]
+
+            expected_api_call = _normalize_api_call(expected_api_call)
+            self._api_calls.append(expected_api_call)
+
+        return expected_api_call
+
+    def _count_pending_api_calls(self):
+        with self._lock:
+            pending_api_call_count = sum(
+                len(expected_api_calls) for expected_api_calls in
+                self._expected_api_calls_by_key.values()
+                )
+        return pending_api_call_count
 
 
 def _normalize_api_call(api_call):
     if isinstance(api_call, SuccessfulAPICall):
-        api_call = deepcopy(api_call)
+        # The conversion copies the response, so a shallow copy is enough to
+        # leave the original API call untouched
+        api_call = api_call.copy()
         api_call.response_body_deserialization = \
             _convert_object_strings_to_unicode(
                 api_call.response_body_deserialization,
@@ -187,3 +318,581 @@ def _convert_object_strings_to_unicode(object_):
         object_converted = object_
 
     return object_converted
+
+
+_CHUNK_SIZE = 16 * 1024
+
+_SERVER_POLL_INTERVAL = 0.05
+
+
+class MockHubspotServer(object):
+    """
+    Local HTTP server which serves the expected API calls, so that the
+    network path of a real :class:`~hubspot.connection.PortalConnection`
+    can be exercised offline
+
+    The server is started and stopped as a context manager, and the
+    connection must be created with the server's :attr:`api_url`. The
+    requests are checked as in :class:`MockPortalConnection`, except that
+    unexpected requests get a "500 Internal Server Error" response and the
+    ``AssertionError`` is raised when the context manager exits.
+
+    :param bool is_order_significant: Whether the expected API calls must be \
+            requested in order, as opposed to in any order as in \
+            :class:`UnorderedMockPortalConnection`
+    :param callable latency: Callable taking no arguments and returning the \
+            seconds to wait before each response, such as \
+            ``functools.partial(random.expovariate, 20)``
+    :param float connection_drop_rate: The probability of closing the \
+            connection instead of responding to a request
+    :param int max_throughput: The maximum number of response body bytes \
+            per second, across all connections
+    :param callable response_headers: Callable taking no arguments and \
+            returning the extra ``(name, value)`` header pairs of each \
+            response, such as rate limit headers
+    :param basestring host: The address to listen on
+    :param int port: The port to listen on, which defaults to an unused one
+
+    """
+    def __init__(self, *api_calls_simulators, **kwargs):
+        super(MockHubspotServer, self).__init__()
+
+        is_order_significant = kwargs.pop('is_order_significant', True)
+        self._latency = kwargs.pop('latency', None)
+        self._connection_drop_rate = kwargs.pop('connection_drop_rate', 0)
+        max_throughput = kwargs.pop('max_throughput', None)
+        self._response_headers = kwargs.pop('response_headers', None)
+        host = kwargs.pop('host', '127.0.0.1')
+        port = kwargs.pop('port', 0)
+        assert not kwargs, \
+            'Unexpected keyword arguments {!r}'.format(sorted(kwargs))
+
+        api_calls_simulators = [
+            _HTTPAPICallsSimulator(api_calls_simulator)
+            for api_calls_simulator in api_calls_simulators
+            ]
+        if is_order_significant:
+            self._connection = MockPortalConnection(*api_calls_simulators)
+            self._connection_lock = Lock()
+        else:
+            self._connection = \
+                UnorderedMockPortalConnection(*api_calls_simulators)
+            self._connection_lock = None
+
+        if max_throughput:
+            self._throughput_throttle = _ThroughputThrottle(max_throughput)
+        else:
+            self._throughput_throttle = None
+
+        self._assertion_errors = []
+
+        self._http_server = \
+            ThreadingHTTPServer((host, port), _MockHubspotRequestHandler)
+        self._http_server.mock_hubspot_server = self
+        self._http_server_thread = None
+
+    @property
+    def api_url(self):
+        """The URL to pass to :class:`~hubspot.connection.PortalConnection`"""
+        host, port = self._http_server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    @property
+    def api_calls(self):
+        return self._connection.api_calls
+
+    def __enter__(self):
+        self._http_server_thread = Thread(
+            target=self._http_server.serve_forever,
+            kwargs={'poll_interval': _SERVER_POLL_INTERVAL},
+            )
+        self._http_server_thread.daemon = True
+        self._http_server_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._http_server.shutdown()
+        self._http_server.server_close()
+        self._http_server_thread.join()
+
+        if exc_type:
+            return
+
+        if self._assertion_errors:
+            raise self._assertion_errors[0]
+
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def _handle_api_request(
+        self,
+        http_method,
+        url_path,
+        query_string_args,
+        request_body_deserialization,
+        ):
+        if self._latency:
+            sleep(self._latency())
+
+        if random() < self._connection_drop_rate:
+            return None
+
+        try:
+            if self._connection_lock:
+                with self._connection_lock:
+                    response_body_deserialization = \
+                        self._connection._call_remote_method(
+                            url_path,
+                            http_method,
+                            query_string_args,
+                            request_body_deserialization,
+                            )
+            else:
+                response_body_deserialization = \
+                    self._connection._call_remote_method(
+                        url_path,
+                        http_method,
+                        query_string_args,
+                        request_body_deserialization,
+                        )
+        except AssertionError as assertion_error:
+            self._assertion_errors.append(assertion_error)
+            api_response = APIResponse(500, 'Unexpected API call')
+        except Exception as exception:
+            api_response = make_api_response_for_exception(exception)
+        else:
+            api_response = make_api_response(response_body_deserialization)
+
+        if self._response_headers:
+            api_response.headers = \
+                list(api_response.headers) + list(self._response_headers())
+
+        return api_response
+
+    def _write_response_body(self, response_body, output_stream):
+        if not self._throughput_throttle:
+            output_stream.write(response_body)
+            return
+
+        for chunk_offset in range(0, len(response_body), _CHUNK_SIZE):
+            chunk = response_body[chunk_offset:chunk_offset + _CHUNK_SIZE]
+            self._throughput_throttle.consume(len(chunk))
+            output_stream.write(chunk)
+
+
+class _MockHubspotRequestHandler(APIRequestHandler):
+
+    def handle_api_request(self, *args, **kwargs):
+        mock_hubspot_server = self.server.mock_hubspot_server
+        return mock_hubspot_server._handle_api_request(*args, **kwargs)
+
+    def write_response_body(self, response_body):
+        mock_hubspot_server = self.server.mock_hubspot_server
+        mock_hubspot_server._write_response_body(response_body, self.wfile)
+
+
+class _HTTPAPICallsSimulator(object):
+    """
+    Wrapper for API calls simulators to represent the query string arguments
+    and request body deserializations as decoded by the server.
+
+    """
+    def __init__(self, api_calls_simulator):
+        super(_HTTPAPICallsSimulator, self).__init__()
+
+        self._api_calls_simulator = api_calls_simulator
+
+    def __call__(self):
+        for api_call in self._api_calls_simulator():
+            api_call = api_call.copy()
+
+            query_string_args_serialization = \
+                urlencode(api_call.query_string_args or {}, doseq=True)
+            api_call.query_string_args = parse_qs(
+                query_string_args_serialization,
+                keep_blank_values=True,
+                )
+
+            if api_call.request_body_deserialization is not None:
+                api_call.request_body_deserialization = json_deserialize(
+                    json_serialize(api_call.request_body_deserialization),
+                    )
+
+            yield api_call
+
+
+class _ThroughputThrottle(object):
+
+    def __init__(self, max_throughput):
+        super(_ThroughputThrottle, self).__init__()
+
+        self._max_throughput = float(max_throughput)
+
+        self._lock = Lock()
+        self._next_transfer_time = 0
+
+    def consume(self, byte_count):
+        with self._lock:
+            current_time = time()
+            transfer_time = max(current_time, self._next_transfer_time)
+            self._next_transfer_time = \
+                transfer_time + byte_count / self._max_throughput
+
+        delay = transfer_time - current_time
+        if 0 < delay:
+            sleep(delay)
+
+
+_CREDENTIALS_QUERY_STRING_ARG_NAMES = frozenset(('access_token', 'hapikey'))
+
+_CASSETTE_FIELD_SEPARATOR = b'\t'
+
+_CASSETTE_RECORD_SEPARATOR = b'\n'
+
+
+class RecordingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    records every API call into a cassette file.
+
+    The cassette can then be replayed with
+    :class:`ReplayingPortalConnection`. Credentials are never recorded.
+
+    :param connection: The connection to wrap
+    :param basestring cassette_path: The path to the cassette file to create
+
+    """
+    def __init__(self, connection, cassette_path):
+        super(RecordingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._cassette_file = open(cassette_path, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._cassette_file.close()
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        request_sender = partial(
+            self._connection.send_get_request,
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+        return self._call_remote_method(
+            request_sender,
+            url_path,
+            'GET',
+            query_string_args=query_string_args,
+            )
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        body_deserialization = _materialize_request_body(body_deserialization)
+        request_sender = partial(
+            self._connection.send_post_request,
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+        return self._call_remote_method(
+            request_sender,
+            url_path,
+            'POST',
+            request_body_deserialization=body_deserialization,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        body_deserialization = _materialize_request_body(body_deserialization)
+        request_sender = partial(
+            self._connection.send_put_request,
+            url_path,
+            body_deserialization,
+            priority=priority,
+            )
+        return self._call_remote_method(
+            request_sender,
+            url_path,
+            'PUT',
+            request_body_deserialization=body_deserialization,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        request_sender = partial(
+            self._connection.send_delete_request,
+            url_path,
+            priority=priority,
+            )
+        return self._call_remote_method(request_sender, url_path, 'DELETE')
+
+    def _call_remote_method(
+        self,
+        request_sender,
+        url_path,
+        http_method,
+        query_string_args=None,
+        request_body_deserialization=None,
+        ):
+        request_body_deserialization = \
+            _deserialize_request_body(request_body_deserialization)
+        query_string_args = _strip_credentials(query_string_args)
+        try:
+            response_body_deserialization = request_sender()
+        except HubspotException as exception:
+            api_call = UnsuccessfulAPICall(
+                url_path,
+                http_method,
+                query_string_args,
+                request_body_deserialization,
+                exception=exception,
+                )
+            self._record_api_call(api_call)
+            raise
+
+        api_call = SuccessfulAPICall(
+            url_path,
+            http_method,
+            query_string_args,
+            request_body_deserialization,
+            response_body_deserialization=response_body_deserialization,
+            )
+        self._record_api_call(api_call)
+        return response_body_deserialization
+
+    def _record_api_call(self, api_call):
+        api_call_key_serialization = _serialize_api_call_key(
+            api_call.http_method,
+            api_call.url_path,
+            api_call.query_string_args,
+            api_call.request_body_deserialization,
+            )
+
+        if isinstance(api_call, SuccessfulAPICall):
+            api_call_outcome = \
+                {'response_body_deserialization':
+                    api_call.response_body_deserialization}
+        else:
+            api_call_outcome = \
+                {'exception': _serialize_exception(api_call.exception)}
+        api_call_outcome_serialization = _serialize_json(api_call_outcome)
+
+        self._cassette_file.write(
+            api_call_key_serialization +
+            _CASSETTE_FIELD_SEPARATOR +
+            api_call_outcome_serialization +
+            _CASSETTE_RECORD_SEPARATOR
+            )
+
+
+class ReplayingPortalConnection(object):
+    """
+    Mock representation of a :class:`~hubspot.connection.PortalConnection`
+    which serves the API calls in a cassette made with
+    :class:`RecordingPortalConnection`.
+
+    The cassette is memory-mapped and only the requests in it are read
+    upfront; each response is deserialized when it's requested.
+    Repeated requests are served in the order in which they were recorded.
+
+    :param basestring cassette_path: The path to the cassette file
+
+    """
+    def __init__(self, cassette_path):
+        super(ReplayingPortalConnection, self).__init__()
+
+        self._api_calls = []
+
+        with open(cassette_path, 'rb') as cassette_file:
+            try:
+                self._cassette = \
+                    mmap(cassette_file.fileno(), 0, access=ACCESS_READ)
+            except ValueError:
+                # The cassette is empty
+                self._cassette = b''
+        self._api_call_outcome_offsets_by_key = \
+            _index_cassette(self._cassette)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._cassette:
+            self._cassette.close()
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        return self._call_remote_method(url_path, 'GET', query_string_args)
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._call_remote_method(
+            url_path,
+            'POST',
+            request_body_deserialization=body_deserialization,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._call_remote_method(
+            url_path,
+            'PUT',
+            request_body_deserialization=body_deserialization,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._call_remote_method(url_path, 'DELETE')
+
+    def _call_remote_method(
+        self,
+        url_path,
+        http_method,
+        query_string_args=None,
+        request_body_deserialization=None,
+        ):
+        request_body_deserialization = \
+            _deserialize_request_body(request_body_deserialization)
+        api_call_key_serialization = _serialize_api_call_key(
+            http_method,
+            url_path,
+            _strip_credentials(query_string_args),
+            request_body_deserialization,
+            )
+        api_call_outcome_offsets = \
+            self._api_call_outcome_offsets_by_key.get(
+                api_call_key_serialization,
+                )
+        error_message = 'No recorded API call for {} {!r}'.format(
+            http_method,
+            url_path,
+            )
+        assert api_call_outcome_offsets, error_message
+
+        api_call_outcome_offset = api_call_outcome_offsets.popleft()
+        api_call_outcome_end_offset = self._cassette.find(
+            _CASSETTE_RECORD_SEPARATOR,
+            api_call_outcome_offset,
+            )
+        api_call_outcome_serialization = self._cassette[
+            api_call_outcome_offset:api_call_outcome_end_offset
+            ]
+        api_call_outcome = \
+            json_deserialize(api_call_outcome_serialization.decode('UTF-8'))
+
+        if 'exception' in api_call_outcome:
+            exception = _deserialize_exception(api_call_outcome['exception'])
+            api_call = UnsuccessfulAPICall(
+                url_path,
+                http_method,
+                query_string_args,
+                request_body_deserialization,
+                exception=exception,
+                )
+            self._api_calls.append(api_call)
+            raise exception
+
+        api_call = SuccessfulAPICall(
+            url_path,
+            http_method,
+            query_string_args,
+            request_body_deserialization,
+            response_body_deserialization=
+                api_call_outcome['response_body_deserialization'],
+            )
+        self._api_calls.append(api_call)
+        return api_call.response_body_deserialization
+
+    @property
+    def api_calls(self):
+        return list(self._api_calls)
+
+
+def _index_cassette(cassette):
+    api_call_outcome_offsets_by_key = {}
+    cassette_size = len(cassette)
+    record_offset = 0
+    while record_offset < cassette_size:
+        field_separator_offset = \
+            cassette.find(_CASSETTE_FIELD_SEPARATOR, record_offset)
+        record_end_offset = \
+            cassette.find(_CASSETTE_RECORD_SEPARATOR, field_separator_offset)
+        assert 0 <= field_separator_offset < record_end_offset, \
+            'Corrupt cassette record at offset {}'.format(record_offset)
+
+        api_call_key_serialization = \
+            cassette[record_offset:field_separator_offset]
+        api_call_outcome_offsets = api_call_outcome_offsets_by_key.setdefault(
+            api_call_key_serialization,
+            deque(),
+            )
+        api_call_outcome_offsets.append(field_separator_offset + 1)
+
+        record_offset = record_end_offset + 1
+    return api_call_outcome_offsets_by_key
+
+
+def _materialize_request_body(body_deserialization):
+    if _is_iterator(body_deserialization):
+        body_deserialization = b''.join(body_deserialization)
+    return body_deserialization
+
+
+def _deserialize_request_body(body_deserialization):
+    """
+    Return the deserialization of a request body which was passed already
+    serialized to :class:`~hubspot.connection.PortalConnection`.
+
+    """
+    body_deserialization = _materialize_request_body(body_deserialization)
+    if isinstance(body_deserialization, (bytes, bytearray, memoryview)):
+        body_serialization = bytes(body_deserialization).decode('UTF-8')
+        body_deserialization = json_deserialize(body_serialization)
+    return body_deserialization
+
+
+def _serialize_api_call_key(
+    http_method,
+    url_path,
+    query_string_args,
+    request_body_deserialization,
+    ):
+    api_call_key = [
+        http_method,
+        url_path,
+        query_string_args,
+        request_body_deserialization,
+        ]
+    return _serialize_json(api_call_key)
+
+
+def _serialize_json(object_):
+    # Non-ASCII characters are escaped, so the serialization can't contain
+    # the cassette separators
+    json_serialization = \
+        json_serialize(object_, sort_keys=True, separators=(',', ':'))
+    return json_serialization.encode('UTF-8')
+
+
+def _strip_credentials(query_string_args):
+    if not query_string_args:
+        return query_string_args
+
+    query_string_args = {
+        name: value for name, value in query_string_args.items()
+        if name not in _CREDENTIALS_QUERY_STRING_ARG_NAMES
+        }
+    return query_string_args
+
+
+def _serialize_exception(exception):
+    exception_serialization = {
+        'class_name': exception.__class__.__name__,
+        'args': exception.args,
+        'attributes': vars(exception),
+        }
+    return exception_serialization
+
+
+def _deserialize_exception(exception_serialization):
+    exception_class = getattr(exc, exception_serialization['class_name'])
+    exception = exception_class.__new__(exception_class)
+    exception.args = tuple(exception_serialization['args'])
+    vars(exception).update(exception_serialization['attributes'])
+    return exception
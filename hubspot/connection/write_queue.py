@@ -0,0 +1,512 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+from json import dumps as json_serialize
+from json import loads as json_deserialize
+from threading import Event
+from threading import Thread
+from time import time
+
+from pyrecord import Record
+from six import text_type
+
+from hubspot.connection import _is_iterator
+from hubspot.connection._sqlite import SQLiteConnection
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotRateLimitError
+
+
+_CREATE_TABLE_STATEMENT = \
+    'CREATE TABLE IF NOT EXISTS writes (' \
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, ' \
+    'http_method TEXT NOT NULL, ' \
+    'url_path TEXT NOT NULL, ' \
+    'body, ' \
+    'priority_class_name TEXT, ' \
+    'tenant TEXT, ' \
+    'enqueue_time REAL NOT NULL, ' \
+    'available_time REAL NOT NULL, ' \
+    'attempt_count INTEGER NOT NULL, ' \
+    'client_error_count INTEGER NOT NULL, ' \
+    'error_message TEXT, ' \
+    'is_dead INTEGER NOT NULL' \
+    ')'
+
+_WRITE_COLUMN_NAMES = \
+    'id, http_method, url_path, body, priority_class_name, tenant, ' \
+    'enqueue_time, attempt_count, error_message'
+
+
+QueuedWrite = Record.create_type(
+    'QueuedWrite',
+    'write_id',
+    'http_method',
+    'url_path',
+    'body_deserialization',
+    'priority',
+    'enqueue_time',
+    'attempt_count',
+    'error_message',
+    )
+
+
+WriteQueueStatus = Record.create_type(
+    'WriteQueueStatus',
+    'pending_write_count',
+    'dead_letter_count',
+    'lag',
+    )
+
+
+class SQLiteWriteQueue(object):
+    """
+    Queue of POST, PUT and DELETE requests in an SQLite database, which
+    survives the process enqueuing them and may be shared by all the
+    processes on a host
+
+    The writes are sent by a :class:`WriteQueueWorkerPool`, and each is
+    deleted only once HubSpot accepted it, so it's delivered at least once.
+    A worker leases a write for ``lease_duration`` seconds, after which it's
+    sent again if the worker didn't report back (e.g., because its process
+    died).
+
+    Failed writes are retried after a delay doubling from ``retry_delay``
+    with each attempt, up to ``max_retry_delay``, or after the delay
+    requested by HubSpot if it rate limited them. The writes rejected by
+    HubSpot with a :class:`~hubspot.connection.exc.HubspotClientError`
+    ``max_client_error_count`` times are moved to the dead letters, to be
+    inspected and requeued or discarded; other errors are retried
+    indefinitely.
+
+    Writes are sent in the order they were enqueued, but several workers
+    may send writes to the same object concurrently.
+
+    :param basestring database_path: The path to the database
+    :param float lease_duration: The number of seconds a worker may take to \
+            send a write
+    :param float retry_delay: The number of seconds to wait before the \
+            first retry
+    :param float max_retry_delay: The maximum number of seconds to wait \
+            before a retry
+    :param int max_client_error_count: The number of client errors after \
+            which a write becomes a dead letter
+
+    """
+    def __init__(
+        self,
+        database_path,
+        lease_duration=300,
+        retry_delay=1,
+        max_retry_delay=300,
+        max_client_error_count=3,
+        ):
+        super(SQLiteWriteQueue, self).__init__()
+
+        self._database_path = database_path
+        self._lease_duration = lease_duration
+        self._retry_delay = retry_delay
+        self._max_retry_delay = max_retry_delay
+        self._max_client_error_count = max_client_error_count
+
+        with self._connect() as database_connection:
+            database_connection.execute('PRAGMA journal_mode=WAL')
+            database_connection.execute(_CREATE_TABLE_STATEMENT)
+            database_connection.execute(
+                'CREATE INDEX IF NOT EXISTS writes_available_time '
+                'ON writes (is_dead, available_time)'
+                )
+
+    def enqueue(
+        self,
+        http_method,
+        url_path,
+        body_deserialization=None,
+        priority=None,
+        ):
+        """
+        Add a write to the queue.
+
+        :param str http_method: ``POST``, ``PUT`` or ``DELETE``
+        :param basestring url_path: The URL path to the endpoint
+        :param body_deserialization: The body of the request, if any, \
+                which may be pre-serialized or streamed as in \
+                :meth:`hubspot.connection.PortalConnection.send_post_request`; \
+                streamed bodies are read into the queue
+        :param priority: The \
+                :class:`~hubspot.connection.concurrency.RequestPriority` \
+                with which the write is sent, if any
+        :return: The identifier of the write
+        :rtype: int
+
+        """
+        assert http_method in ('POST', 'PUT', 'DELETE')
+
+        body_serialization = _serialize_body(body_deserialization)
+        if priority:
+            priority_class_name = priority.class_name
+            tenant_serialization = json_serialize(priority.tenant)
+        else:
+            priority_class_name = None
+            tenant_serialization = None
+
+        current_time = self._get_current_time()
+        with self._connect() as database_connection:
+            cursor = database_connection.execute(
+                'INSERT INTO writes (http_method, url_path, body, '
+                'priority_class_name, tenant, enqueue_time, available_time, '
+                'attempt_count, client_error_count, is_dead) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0, 0)',
+                (
+                    http_method,
+                    url_path,
+                    body_serialization,
+                    priority_class_name,
+                    tenant_serialization,
+                    current_time,
+                    current_time,
+                    ),
+                )
+        return cursor.lastrowid
+
+    def claim(self):
+        """
+        Lease the oldest write available, if any.
+
+        :rtype: :class:`QueuedWrite` or ``None``
+
+        """
+        while True:
+            current_time = self._get_current_time()
+            with self._connect() as database_connection:
+                row = database_connection.execute(
+                    'SELECT ' + _WRITE_COLUMN_NAMES + ' FROM writes '
+                    'WHERE is_dead = 0 AND available_time <= ? '
+                    'ORDER BY id LIMIT 1',
+                    (current_time,),
+                    ).fetchone()
+                if row is None:
+                    return None
+
+                # Another worker may have claimed the write in the meantime
+                cursor = database_connection.execute(
+                    'UPDATE writes '
+                    'SET available_time = ?, attempt_count = attempt_count + 1 '
+                    'WHERE id = ? AND is_dead = 0 AND available_time <= ?',
+                    (current_time + self._lease_duration, row[0], current_time),
+                    )
+            if cursor.rowcount:
+                queued_write = _make_queued_write(row)
+                queued_write.attempt_count += 1
+                return queued_write
+
+    def complete(self, write_id):
+        """Remove the write, which HubSpot accepted, from the queue."""
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'DELETE FROM writes WHERE id = ?',
+                (write_id,),
+                )
+
+    def fail(self, queued_write, exception):
+        """
+        Schedule the retry of the write, or make it a dead letter.
+
+        :param queued_write: The :class:`QueuedWrite` claimed
+        :param Exception exception: The exception raised when sending it
+
+        """
+        is_client_error = isinstance(exception, HubspotClientError) and \
+            not isinstance(exception, HubspotRateLimitError)
+
+        retry_delay = getattr(exception, 'retry_after', None)
+        if retry_delay is None:
+            retry_delay = min(
+                self._retry_delay * 2 ** (queued_write.attempt_count - 1),
+                self._max_retry_delay,
+                )
+
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'UPDATE writes '
+                'SET available_time = ?, error_message = ?, '
+                'client_error_count = client_error_count + ?, '
+                'is_dead = ? <= client_error_count + ? '
+                'WHERE id = ?',
+                (
+                    self._get_current_time() + retry_delay,
+                    '{}: {}'.format(exception.__class__.__name__, exception),
+                    int(is_client_error),
+                    self._max_client_error_count,
+                    int(is_client_error),
+                    queued_write.write_id,
+                    ),
+                )
+
+    def get_status(self):
+        """
+        Return the number of writes pending and dead, and the number of
+        seconds for which the oldest pending write has been waiting.
+
+        :rtype: :class:`WriteQueueStatus`
+
+        """
+        with self._connect() as database_connection:
+            pending_write_count, oldest_enqueue_time = \
+                database_connection.execute(
+                    'SELECT COUNT(*), MIN(enqueue_time) FROM writes '
+                    'WHERE is_dead = 0',
+                    ).fetchone()
+            dead_letter_count, = database_connection.execute(
+                'SELECT COUNT(*) FROM writes WHERE is_dead = 1',
+                ).fetchone()
+
+        if oldest_enqueue_time is None:
+            lag = 0
+        else:
+            lag = max(self._get_current_time() - oldest_enqueue_time, 0)
+        return WriteQueueStatus(pending_write_count, dead_letter_count, lag)
+
+    def get_dead_letters(self):
+        """
+        Return the writes which HubSpot kept rejecting, along with the last
+        error.
+
+        :rtype: :class:`list` of :class:`QueuedWrite`
+
+        """
+        with self._connect() as database_connection:
+            rows = database_connection.execute(
+                'SELECT ' + _WRITE_COLUMN_NAMES + ' FROM writes '
+                'WHERE is_dead = 1 ORDER BY id',
+                ).fetchall()
+        return [_make_queued_write(row) for row in rows]
+
+    def requeue_dead_letters(self):
+        """Put all the dead letters back in the queue, as new writes."""
+        with self._connect() as database_connection:
+            database_connection.execute(
+                'UPDATE writes '
+                'SET is_dead = 0, available_time = ?, attempt_count = 0, '
+                'client_error_count = 0 '
+                'WHERE is_dead = 1',
+                (self._get_current_time(),),
+                )
+
+    def discard_dead_letters(self):
+        """Delete all the dead letters."""
+        with self._connect() as database_connection:
+            database_connection.execute('DELETE FROM writes WHERE is_dead = 1')
+
+    def _connect(self):
+        return SQLiteConnection(self._database_path)
+
+    @staticmethod
+    def _get_current_time():
+        return time()
+
+
+class WriteQueueWorkerPool(object):
+    """
+    Pool of threads sending the writes in a :class:`SQLiteWriteQueue`
+    through a :class:`~hubspot.connection.PortalConnection`
+
+    The writes are sent with the priority they were enqueued with, so they
+    remain within the limits of the connection's
+    :class:`~hubspot.connection.concurrency.RequestScheduler` and
+    :class:`~hubspot.connection.quota.DailyQuota`, if any.
+
+    The workers are started and stopped as a context manager; they finish
+    sending the writes in progress before stopping.
+
+    :param connection: The connection to send the writes through
+    :param write_queue: The :class:`SQLiteWriteQueue`
+    :param int worker_count: The number of writes sent concurrently
+    :param float poll_interval: The number of seconds an idle worker waits \
+            before checking the queue again
+
+    """
+    def __init__(
+        self,
+        connection,
+        write_queue,
+        worker_count=4,
+        poll_interval=1,
+        ):
+        super(WriteQueueWorkerPool, self).__init__()
+
+        self._connection = connection
+        self._write_queue = write_queue
+        self._worker_count = worker_count
+        self._poll_interval = poll_interval
+
+        self._stop_event = Event()
+        self._worker_threads = []
+
+    def __enter__(self):
+        self._stop_event.clear()
+        self._worker_threads = [
+            Thread(target=self._send_writes) for _ in range(self._worker_count)
+            ]
+        for worker_thread in self._worker_threads:
+            worker_thread.daemon = True
+            worker_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop_event.set()
+        for worker_thread in self._worker_threads:
+            worker_thread.join()
+        self._worker_threads = []
+
+    def _send_writes(self):
+        while not self._stop_event.is_set():
+            queued_write = self._write_queue.claim()
+            if queued_write is None:
+                self._stop_event.wait(self._poll_interval)
+            else:
+                self._send_write(queued_write)
+
+    def _send_write(self, queued_write):
+        try:
+            if queued_write.http_method == 'POST':
+                self._connection.send_post_request(
+                    queued_write.url_path,
+                    queued_write.body_deserialization,
+                    priority=queued_write.priority,
+                    )
+            elif queued_write.http_method == 'PUT':
+                self._connection.send_put_request(
+                    queued_write.url_path,
+                    queued_write.body_deserialization,
+                    priority=queued_write.priority,
+                    )
+            else:
+                self._connection.send_delete_request(
+                    queued_write.url_path,
+                    priority=queued_write.priority,
+                    )
+        except Exception as exception:
+            self._write_queue.fail(queued_write, exception)
+        else:
+            self._write_queue.complete(queued_write.write_id)
+
+
+class WriteQueueingPortalConnection(object):
+    """
+    Wrapper around a :class:`~hubspot.connection.PortalConnection` which
+    adds POST, PUT and DELETE requests to a :class:`SQLiteWriteQueue`
+    instead of sending them
+
+    The writes return ``None`` as soon as they're enqueued, so callers
+    needing the response to a write must use the wrapped connection. GET
+    requests are sent as they are.
+
+    :param connection: The connection to wrap
+    :param write_queue: The :class:`SQLiteWriteQueue`
+
+    """
+    def __init__(self, connection, write_queue):
+        super(WriteQueueingPortalConnection, self).__init__()
+
+        self._connection = connection
+        self._write_queue = write_queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.__exit__(exc_type, exc_value, traceback)
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        return self._connection.send_get_request(
+            url_path,
+            query_string_args,
+            priority=priority,
+            )
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        self._write_queue.enqueue(
+            'POST',
+            url_path,
+            body_deserialization,
+            priority,
+            )
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        self._write_queue.enqueue(
+            'PUT',
+            url_path,
+            body_deserialization,
+            priority,
+            )
+
+    def send_delete_request(self, url_path, priority=None):
+        self._write_queue.enqueue('DELETE', url_path, priority=priority)
+
+
+def _make_queued_write(row):
+    (
+        write_id,
+        http_method,
+        url_path,
+        body_serialization,
+        priority_class_name,
+        tenant_serialization,
+        enqueue_time,
+        attempt_count,
+        error_message,
+        ) = row
+
+    if body_serialization is None:
+        body_deserialization = None
+    elif isinstance(body_serialization, text_type):
+        body_deserialization = json_deserialize(body_serialization)
+    else:
+        body_deserialization = bytes(body_serialization)
+
+    if priority_class_name is None:
+        priority = None
+    else:
+        priority = RequestPriority(
+            priority_class_name,
+            json_deserialize(tenant_serialization),
+            )
+
+    queued_write = QueuedWrite(
+        write_id,
+        http_method,
+        url_path,
+        body_deserialization,
+        priority,
+        enqueue_time,
+        attempt_count,
+        error_message,
+        )
+    return queued_write
+
+
+def _serialize_body(body_deserialization):
+    # Pre-serialized and streamed bodies are stored as BLOBs so that they're
+    # told apart from JSON bodies, which are stored as TEXT
+    if body_deserialization is None:
+        body_serialization = None
+    elif isinstance(body_deserialization, (bytes, bytearray, memoryview)):
+        body_serialization = bytes(body_deserialization)
+    elif _is_iterator(body_deserialization):
+        body_serialization = b''.join(body_deserialization)
+    else:
+        body_serialization = json_serialize(body_deserialization)
+    return body_serialization
@@ -57,6 +57,9 @@ setup(
         'six >= 1.10.0',
         'future >= 0.15.2',
         ],
+    extras_require={
+        'gevent': ['gevent >= 1.1'],
+        },
     test_suite='nose.collector',
     tests_require=[
         'nose >= 1.3.7',
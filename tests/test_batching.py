@@ -0,0 +1,229 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from threading import Lock
+from threading import Thread
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.batching import BatchEndpoint
+from hubspot.connection.batching import BatchingPortalConnection
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+
+
+_BATCH_URL_PATH = '/contacts/v1/contact/vids/batch/'
+
+_LONG_BATCH_WINDOW = 0.2
+
+
+class TestBatchingPortalConnection(object):
+
+    def test_single_request(self):
+        connection = _BatchReadingConnection()
+
+        with BatchingPortalConnection(connection) as batching_connection:
+            contact = batching_connection.send_get_request(
+                _make_contact_profile_url_path(1),
+                )
+
+        eq_(_make_contact('1'), contact)
+        eq_([(_BATCH_URL_PATH, {'vid': ['1']}, None)], connection.requests)
+
+    def test_concurrent_requests(self):
+        connection = _BatchReadingConnection()
+        batching_connection = BatchingPortalConnection(
+            connection,
+            batch_window=_LONG_BATCH_WINDOW,
+            )
+
+        contacts_by_vid = \
+            _get_contacts_concurrently(batching_connection, [1, 2, 3])
+
+        eq_(
+            {vid: _make_contact(str(vid)) for vid in [1, 2, 3]},
+            contacts_by_vid,
+            )
+        eq_([['1', '2', '3']], connection.get_requested_vids())
+
+    def test_repeated_object(self):
+        connection = _BatchReadingConnection()
+        batching_connection = BatchingPortalConnection(
+            connection,
+            batch_window=_LONG_BATCH_WINDOW,
+            )
+
+        _get_contacts_concurrently(batching_connection, [1, 1])
+
+        eq_([['1']], connection.get_requested_vids())
+
+    def test_full_batch(self):
+        connection = _BatchReadingConnection()
+        batch_endpoint = BatchEndpoint(
+            r'^/contacts/v1/contact/vid/(?P<id>\d+)/profile$',
+            _BATCH_URL_PATH,
+            'vid',
+            max_batch_size=2,
+            )
+        batching_connection = BatchingPortalConnection(
+            connection,
+            [batch_endpoint],
+            batch_window=_LONG_BATCH_WINDOW,
+            )
+
+        _get_contacts_concurrently(batching_connection, [1, 2, 3])
+
+        eq_(
+            [['1', '2', '3']],
+            [sorted(sum(connection.get_requested_vids(), []))],
+            )
+        eq_(
+            [1, 2],
+            sorted(len(vids) for vids in connection.get_requested_vids()),
+            )
+
+    def test_query_string_args(self):
+        connection = _BatchReadingConnection()
+        batching_connection = BatchingPortalConnection(connection)
+
+        batching_connection.send_get_request(
+            _make_contact_profile_url_path(1),
+            {'property': ['email']},
+            )
+
+        eq_(
+            [(_BATCH_URL_PATH, {'vid': ['1'], 'property': ['email']}, None)],
+            connection.requests,
+            )
+
+    def test_priority(self):
+        connection = _BatchReadingConnection()
+        batching_connection = BatchingPortalConnection(connection)
+        priority = RequestPriority(PRIORITY_CLASS_BULK)
+
+        batching_connection.send_get_request(
+            _make_contact_profile_url_path(1),
+            priority=priority,
+            )
+
+        eq_(priority, connection.requests[0][2])
+
+    def test_missing_object(self):
+        connection = _BatchReadingConnection(missing_vids=['1'])
+        batching_connection = BatchingPortalConnection(connection)
+
+        with assert_raises(HubspotClientError):
+            batching_connection.send_get_request(
+                _make_contact_profile_url_path(1),
+                )
+
+    def test_failed_batch(self):
+        connection = _BatchReadingConnection(
+            exception=HubspotServerError('Error', 503),
+            )
+        batching_connection = BatchingPortalConnection(
+            connection,
+            batch_window=_LONG_BATCH_WINDOW,
+            )
+
+        exceptions = []
+        _get_contacts_concurrently(batching_connection, [1, 2], exceptions)
+
+        eq_(2, len(exceptions))
+        eq_(1, len(connection.requests))
+
+    def test_other_requests(self):
+        api_call = SuccessfulAPICall(
+            '/contacts/v1/lists/all/contacts/all',
+            'GET',
+            response_body_deserialization={'contacts': []},
+            )
+        connection = MockPortalConnection(lambda: [api_call])
+
+        with BatchingPortalConnection(connection) as batching_connection:
+            response_body_deserialization = \
+                batching_connection.send_get_request(api_call.url_path)
+
+        eq_({'contacts': []}, response_body_deserialization)
+
+
+class _BatchReadingConnection(object):
+
+    def __init__(self, missing_vids=(), exception=None):
+        super(_BatchReadingConnection, self).__init__()
+
+        self._missing_vids = missing_vids
+        self._exception = exception
+
+        self._lock = Lock()
+        self.requests = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        with self._lock:
+            self.requests.append((url_path, query_string_args, priority))
+
+        if self._exception:
+            raise self._exception
+
+        contacts_by_vid = {
+            vid: _make_contact(vid)
+            for vid in query_string_args['vid']
+            if vid not in self._missing_vids
+            }
+        return contacts_by_vid
+
+    def get_requested_vids(self):
+        requested_vids = [
+            sorted(query_string_args['vid'])
+            for _, query_string_args, _ in self.requests
+            ]
+        return requested_vids
+
+
+def _get_contacts_concurrently(batching_connection, vids, exceptions=None):
+    contacts_by_vid = {}
+
+    def get_contact(vid):
+        try:
+            contacts_by_vid[vid] = batching_connection.send_get_request(
+                _make_contact_profile_url_path(vid),
+                )
+        except Exception as exception:
+            exceptions.append(exception)
+
+    threads = [Thread(target=get_contact, args=(vid,)) for vid in vids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return contacts_by_vid
+
+
+def _make_contact_profile_url_path(vid):
+    return '/contacts/v1/contact/vid/{}/profile'.format(vid)
+
+
+def _make_contact(vid):
+    return {'vid': int(vid), 'properties': {}}
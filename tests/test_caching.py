@@ -0,0 +1,281 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from os.path import join as join_path
+from time import sleep
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.caching import CachingPortalConnection
+from hubspot.connection.caching import SQLiteResponseCache
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import make_temporary_directory
+
+
+_STUB_URL_PATH = '/properties/v1/contacts/properties'
+
+_STUB_RESPONSE_BODY_DESERIALIZATION = [{'name': 'email'}]
+
+_STUB_NAMESPACE = 62515
+
+
+class TestSQLiteResponseCache(object):
+
+    def test_missing_response(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+
+            with assert_raises(KeyError):
+                cache.get(_STUB_URL_PATH)
+
+    def test_cached_response(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            cache.set(
+                _STUB_URL_PATH,
+                None,
+                _STUB_RESPONSE_BODY_DESERIALIZATION,
+                )
+
+            # Caches in other processes share the responses
+            cache = _make_cache(directory_path)
+            eq_(
+                _STUB_RESPONSE_BODY_DESERIALIZATION,
+                cache.get(_STUB_URL_PATH),
+                )
+            eq_(
+                _STUB_RESPONSE_BODY_DESERIALIZATION,
+                cache.get(_STUB_URL_PATH, {}),
+                )
+
+    def test_query_string_args(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            cache.set(_STUB_URL_PATH, {'a': 1, 'b': 2}, 1)
+            cache.set(_STUB_URL_PATH, {'a': 2}, 2)
+
+            eq_(1, cache.get(_STUB_URL_PATH, {'b': 2, 'a': 1}))
+            eq_(2, cache.get(_STUB_URL_PATH, {'a': 2}))
+
+    def test_namespaces(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            other_cache = _make_cache(directory_path, namespace='other')
+            cache.set(_STUB_URL_PATH, None, 1)
+
+            with assert_raises(KeyError):
+                other_cache.get(_STUB_URL_PATH)
+
+            other_cache.set(_STUB_URL_PATH, None, 2)
+
+            eq_(1, cache.get(_STUB_URL_PATH))
+            eq_(2, other_cache.get(_STUB_URL_PATH))
+
+    def test_size(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            cache.set('/a', None, 'a' * 8)
+            cache.set('/b', None, 'b' * 8)
+            cache.set('/a', None, 'a' * 18)
+
+            eq_(30, cache.size)
+
+            cache.clear()
+
+            eq_(0, cache.size)
+
+    def test_compressed_response(self):
+        response_body_deserialization = [{'name': 'x' * 4096}]
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path, compress=True)
+            cache.set(_STUB_URL_PATH, None, response_body_deserialization)
+
+            eq_(response_body_deserialization, cache.get(_STUB_URL_PATH))
+            ok_(cache.size < 4096)
+
+    def test_expired_response(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path, default_ttl=0.01)
+            cache.set(_STUB_URL_PATH, None, 1)
+
+            sleep(0.02)
+
+            with assert_raises(KeyError):
+                cache.get(_STUB_URL_PATH)
+            eq_(0, cache.size)
+
+    def test_ttls_by_url_path_prefix(self):
+        ttls_by_url_path_prefix = {
+            '/properties/': None,
+            '/properties/v1/companies/': 0,
+            }
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(
+                directory_path,
+                default_ttl=0.01,
+                ttls_by_url_path_prefix=ttls_by_url_path_prefix,
+                )
+            cache.set(_STUB_URL_PATH, None, 1)
+            cache.set('/properties/v1/companies/properties', None, 2)
+            cache.set('/owners/v2/owners', None, 3)
+
+            sleep(0.02)
+
+            eq_(1, cache.get(_STUB_URL_PATH))
+            with assert_raises(KeyError):
+                cache.get('/properties/v1/companies/properties')
+            with assert_raises(KeyError):
+                cache.get('/owners/v2/owners')
+
+    def test_least_recently_used_responses_evicted(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path, max_size=25)
+            cache.set('/a', None, 'a' * 8)
+            sleep(0.01)
+            cache.set('/b', None, 'b' * 8)
+            sleep(0.01)
+            cache.get('/a')
+            sleep(0.01)
+
+            cache.set('/c', None, 'c' * 8)
+
+            eq_('a' * 8, cache.get('/a'))
+            eq_('c' * 8, cache.get('/c'))
+            with assert_raises(KeyError):
+                cache.get('/b')
+            ok_(cache.size <= 25)
+
+    def test_access_time_resolution(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(
+                directory_path,
+                max_size=25,
+                access_time_resolution=60,
+                )
+            cache.set('/a', None, 'a' * 8)
+            sleep(0.01)
+            cache.set('/b', None, 'b' * 8)
+            sleep(0.01)
+            cache.get('/a')
+
+            cache.set('/c', None, 'c' * 8)
+
+            with assert_raises(KeyError):
+                cache.get('/a')
+            eq_('b' * 8, cache.get('/b'))
+
+    def test_clearing(self):
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            cache.set(_STUB_URL_PATH, None, 1)
+
+            cache.clear()
+
+            with assert_raises(KeyError):
+                cache.get(_STUB_URL_PATH)
+
+    def test_snapshots(self):
+        with make_temporary_directory() as directory_path:
+            snapshot_path = join_path(directory_path, 'snapshot')
+            cache = _make_cache(directory_path)
+            cache.set(_STUB_URL_PATH, None, 1)
+            cache.save_snapshot(snapshot_path)
+
+            cache = SQLiteResponseCache(
+                join_path(directory_path, 'other'),
+                _STUB_NAMESPACE,
+                )
+            cache.load_snapshot(snapshot_path)
+
+            eq_(1, cache.get(_STUB_URL_PATH))
+
+
+class TestCachingPortalConnection(object):
+
+    def test_get_requests(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization=_STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            connection = MockPortalConnection(lambda: [api_call])
+
+            with CachingPortalConnection(connection, cache) as connection:
+                for _ in range(2):
+                    response_body_deserialization = \
+                        connection.send_get_request(_STUB_URL_PATH)
+                    eq_(
+                        _STUB_RESPONSE_BODY_DESERIALIZATION,
+                        response_body_deserialization,
+                        )
+
+    def test_unsuccessful_get_requests(self):
+        api_call = UnsuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            exception=HubspotServerError('Bad Gateway', 502),
+            )
+        with make_temporary_directory() as directory_path:
+            cache = _make_cache(directory_path)
+            connection = CachingPortalConnection(
+                MockPortalConnection(lambda: [api_call]),
+                cache,
+                )
+
+            with assert_raises(HubspotServerError):
+                connection.send_get_request(_STUB_URL_PATH)
+
+            eq_(0, cache.size)
+
+    def test_other_requests(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                http_method,
+                request_body_deserialization=request_body_deserialization,
+                response_body_deserialization=None,
+                )
+            for http_method, request_body_deserialization in
+            (('POST', {'name': 'a'}), ('POST', {'name': 'a'}), ('DELETE', None))
+            ]
+        with make_temporary_directory() as directory_path:
+            connection = CachingPortalConnection(
+                MockPortalConnection(lambda: api_calls),
+                _make_cache(directory_path),
+                )
+
+            with connection:
+                connection.send_post_request(_STUB_URL_PATH, {'name': 'a'})
+                connection.send_post_request(_STUB_URL_PATH, {'name': 'a'})
+                connection.send_delete_request(_STUB_URL_PATH)
+
+
+def _make_cache(directory_path, namespace=_STUB_NAMESPACE, **kwargs):
+    kwargs.setdefault('access_time_resolution', 0)
+    cache = SQLiteResponseCache(
+        join_path(directory_path, 'cache'),
+        namespace,
+        **kwargs
+        )
+    return cache
@@ -0,0 +1,326 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from os.path import join as join_path
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.change_detection import ChangeDetectingPortalConnection
+from hubspot.connection.change_detection import WriteHashStore
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import make_temporary_directory
+
+
+_CONTACT_URL_PATH = '/contacts/v1/contact/vid/1/profile'
+
+_COMPANY_URL_PATH = '/companies/v2/companies/1'
+
+
+class TestWriteHashStore(object):
+
+    def test_unknown_object(self):
+        store = WriteHashStore()
+
+        eq_({}, store.get('/a'))
+
+    def test_update(self):
+        store = WriteHashStore()
+
+        store.update('/a', {'email': '1'})
+        store.update('/a', {'firstname': '2'})
+
+        eq_({'email': '1', 'firstname': '2'}, store.get('/a'))
+
+    def test_deletion(self):
+        store = WriteHashStore()
+        store.update('/a', {'email': '1'})
+
+        store.delete('/a')
+
+        eq_({}, store.get('/a'))
+
+    def test_objects_beyond_maximum(self):
+        store = WriteHashStore(max_object_count=2)
+
+        store.update('/a', {'email': '1'})
+        store.update('/b', {'email': '2'})
+        store.get('/a')
+        store.update('/c', {'email': '3'})
+
+        eq_({'email': '1'}, store.get('/a'))
+        eq_({}, store.get('/b'))
+        eq_({'email': '3'}, store.get('/c'))
+
+    def test_persistence(self):
+        with make_temporary_directory() as directory_path:
+            database_path = join_path(directory_path, 'hashes')
+            WriteHashStore(database_path=database_path).update(
+                '/a',
+                {'email': '1'},
+                )
+
+            store = \
+                WriteHashStore(max_object_count=1, database_path=database_path)
+            store.update('/b', {'email': '2'})
+            store.update('/a', {'firstname': '3'})
+
+            eq_({'email': '1', 'firstname': '3'}, store.get('/a'))
+            eq_({'email': '2'}, store.get('/b'))
+
+            store.delete('/a')
+            eq_({}, WriteHashStore(database_path=database_path).get('/a'))
+
+
+class TestChangeDetectingPortalConnection(object):
+
+    def test_first_write(self):
+        body_deserialization = _make_contact_body(email='a@example.com')
+        api_call = _make_write_api_call(body_deserialization)
+
+        _assert_writes_sent([body_deserialization], [api_call])
+
+    def test_identical_write(self):
+        body_deserialization = _make_contact_body(email='a@example.com')
+        api_call = _make_write_api_call(body_deserialization)
+
+        _assert_writes_sent(
+            [body_deserialization, body_deserialization],
+            [api_call],
+            )
+
+    def test_partially_changed_write(self):
+        body_deserialization_1 = \
+            _make_contact_body(email='a@example.com', firstname='Alice')
+        body_deserialization_2 = \
+            _make_contact_body(email='a@example.com', firstname='Alicia')
+
+        _assert_writes_sent(
+            [body_deserialization_1, body_deserialization_2],
+            [
+                _make_write_api_call(body_deserialization_1),
+                _make_write_api_call(_make_contact_body(firstname='Alicia')),
+                ],
+            )
+
+    def test_new_property(self):
+        body_deserialization_1 = _make_contact_body(email='a@example.com')
+        body_deserialization_2 = \
+            _make_contact_body(email='a@example.com', firstname='Alice')
+
+        _assert_writes_sent(
+            [body_deserialization_1, body_deserialization_2],
+            [
+                _make_write_api_call(body_deserialization_1),
+                _make_write_api_call(_make_contact_body(firstname='Alice')),
+                ],
+            )
+
+    def test_reverted_property(self):
+        body_deserialization_1 = _make_contact_body(firstname='Alice')
+        body_deserialization_2 = _make_contact_body(firstname='Alicia')
+
+        _assert_writes_sent(
+            [
+                body_deserialization_1,
+                body_deserialization_2,
+                body_deserialization_1,
+                ],
+            [
+                _make_write_api_call(body_deserialization_1),
+                _make_write_api_call(body_deserialization_2),
+                _make_write_api_call(body_deserialization_1),
+                ],
+            )
+
+    def test_failed_write(self):
+        body_deserialization = _make_contact_body(email='a@example.com')
+        api_calls = [
+            UnsuccessfulAPICall(
+                _CONTACT_URL_PATH,
+                'POST',
+                request_body_deserialization=body_deserialization,
+                exception=HubspotServerError('Service Unavailable', 503),
+                ),
+            _make_write_api_call(body_deserialization),
+            ]
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: api_calls),
+            )
+
+        with connection:
+            with assert_raises(HubspotServerError):
+                connection.send_post_request(
+                    _CONTACT_URL_PATH,
+                    body_deserialization,
+                    )
+            connection.send_post_request(
+                _CONTACT_URL_PATH,
+                body_deserialization,
+                )
+
+    def test_company_properties(self):
+        body_deserialization_1 = {
+            'properties': [
+                {'name': 'name', 'value': 'Acme'},
+                {'name': 'domain', 'value': 'acme.example.com'},
+                ],
+            }
+        body_deserialization_2 = {
+            'properties': [
+                {'name': 'name', 'value': 'Acme'},
+                {'name': 'domain', 'value': 'acme.example.org'},
+                ],
+            }
+        api_calls = [
+            SuccessfulAPICall(
+                _COMPANY_URL_PATH,
+                'PUT',
+                request_body_deserialization=body_deserialization_1,
+                response_body_deserialization={'companyId': 1},
+                ),
+            SuccessfulAPICall(
+                _COMPANY_URL_PATH,
+                'PUT',
+                request_body_deserialization={
+                    'properties': [
+                        {'name': 'domain', 'value': 'acme.example.org'},
+                        ],
+                    },
+                response_body_deserialization={'companyId': 1},
+                ),
+            ]
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: api_calls),
+            )
+
+        with connection:
+            for body_deserialization in (
+                body_deserialization_1,
+                body_deserialization_2,
+                body_deserialization_2,
+                ):
+                connection.send_put_request(
+                    _COMPANY_URL_PATH,
+                    body_deserialization,
+                    )
+
+    def test_other_body(self):
+        body_deserialization = {'vids': [1, 2]}
+        url_path = '/deals/v1/deal/1'
+        api_call = SuccessfulAPICall(
+            url_path,
+            'PUT',
+            request_body_deserialization=body_deserialization,
+            response_body_deserialization=None,
+            )
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: [api_call]),
+            )
+
+        with connection:
+            connection.send_put_request(url_path, body_deserialization)
+            connection.send_put_request(url_path, body_deserialization)
+
+    def test_serialized_body(self):
+        body_serialization = b'{"properties": []}'
+        api_call = SuccessfulAPICall(
+            _CONTACT_URL_PATH,
+            'POST',
+            request_body_deserialization={'properties': []},
+            response_body_deserialization=None,
+            )
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: [api_call, api_call]),
+            )
+
+        with connection:
+            for _ in range(2):
+                connection.send_post_request(
+                    _CONTACT_URL_PATH,
+                    body_serialization,
+                    )
+
+    def test_object_creation(self):
+        body_deserialization = _make_contact_body(email='a@example.com')
+        api_call = SuccessfulAPICall(
+            '/contacts/v1/contact',
+            'POST',
+            request_body_deserialization=body_deserialization,
+            response_body_deserialization={'vid': 1},
+            )
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: [api_call, api_call]),
+            )
+
+        with connection:
+            for _ in range(2):
+                connection.send_post_request(
+                    '/contacts/v1/contact',
+                    body_deserialization,
+                    )
+
+    def test_custom_object_url_path_patterns(self):
+        body_deserialization = _make_contact_body(email='a@example.com')
+        api_call = _make_write_api_call(body_deserialization)
+        connection = ChangeDetectingPortalConnection(
+            MockPortalConnection(lambda: [api_call, api_call]),
+            object_url_path_patterns=[r'^/companies/'],
+            )
+
+        with connection:
+            for _ in range(2):
+                connection.send_post_request(
+                    _CONTACT_URL_PATH,
+                    body_deserialization,
+                    )
+
+
+def _assert_writes_sent(body_deserializations, expected_api_calls):
+    connection = ChangeDetectingPortalConnection(
+        MockPortalConnection(lambda: expected_api_calls),
+        )
+    with connection:
+        for body_deserialization in body_deserializations:
+            connection.send_post_request(
+                _CONTACT_URL_PATH,
+                body_deserialization,
+                )
+
+
+def _make_write_api_call(body_deserialization):
+    api_call = SuccessfulAPICall(
+        _CONTACT_URL_PATH,
+        'POST',
+        request_body_deserialization=body_deserialization,
+        response_body_deserialization=None,
+        )
+    return api_call
+
+
+def _make_contact_body(**values_by_property_name):
+    body_deserialization = {
+        'properties': [
+            {'property': property_name, 'value': property_value}
+            for property_name, property_value
+            in sorted(values_by_property_name.items())
+            ],
+        }
+    return body_deserialization
@@ -0,0 +1,321 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from threading import Thread
+from time import sleep
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.concurrency import AdaptiveConcurrencyLimiter
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import PRIORITY_CLASS_INTERACTIVE
+from hubspot.connection.concurrency import PRIORITY_CLASS_NORMAL
+from hubspot.connection.concurrency import PriorityClass
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.concurrency import RequestScheduler
+from hubspot.connection.exc import HubspotRequestRejectedError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/foo'
+
+
+class TestAdaptiveConcurrencyLimiter(object):
+
+    def test_initial_limit(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+
+        eq_(2, limiter.limit)
+        eq_(0, limiter.in_flight_count)
+        eq_(0, limiter.waiting_count)
+
+    def test_requests_wait_for_free_slot(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        limiter.acquire()
+
+        waiting_thread = Thread(target=limiter.acquire)
+        waiting_thread.start()
+        _wait_for_waiting_requests(limiter, 1)
+
+        eq_(1, limiter.in_flight_count)
+
+        limiter.release(0.1, False)
+        waiting_thread.join()
+
+        eq_(0, limiter.waiting_count)
+        eq_(1, limiter.in_flight_count)
+
+    def test_additive_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+
+        _send_requests(limiter, 2, 0.1, False)
+        eq_(2, limiter.limit)
+
+        _send_requests(limiter, 1, 0.1, False)
+        eq_(3, limiter.limit)
+
+        _send_requests(limiter, 10, 0.1, False)
+        eq_(3, limiter.limit)
+
+    def test_multiplicative_decrease(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, min_limit=3)
+
+        _send_requests(limiter, 1, 0.1, True)
+        eq_(4, limiter.limit)
+
+        _send_requests(limiter, 1, 0.1, True)
+        eq_(3, limiter.limit)
+
+    def test_single_decrease_per_average_latency(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        _send_requests(limiter, 1, 10, False)
+
+        _send_requests(limiter, 3, 10, True)
+
+        eq_(4, limiter.limit)
+
+    def test_excessive_latency(self):
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=8,
+            latency_tolerance=2,
+            )
+        _send_requests(limiter, 1, 0.01, False)
+
+        _send_requests(limiter, 1, 0.05, False)
+
+        eq_(4, limiter.limit)
+
+    def test_lasting_latency_increase(self):
+        limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=8,
+            latency_tolerance=2,
+            )
+        _send_requests(limiter, 1, 0.01, False)
+
+        _send_requests(limiter, 100, 0.05, False)
+
+        ok_(8 < limiter.limit)
+
+    def test_server_errors(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+        api_call = UnsuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            exception=HubspotServerError('Service Unavailable', 503),
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                concurrency_limiter=limiter,
+                )
+            with connection:
+                with assert_raises(HubspotServerError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(4, limiter.limit)
+        eq_(0, limiter.in_flight_count)
+
+    def test_successful_responses(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization=None,
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                concurrency_limiter=limiter,
+                )
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(2, limiter.limit)
+        eq_(0, limiter.in_flight_count)
+
+
+class TestRequestScheduler(object):
+
+    def test_requests_within_budget(self):
+        scheduler = RequestScheduler(2)
+
+        scheduler.acquire()
+        scheduler.acquire(RequestPriority(PRIORITY_CLASS_BULK))
+
+        eq_(2, scheduler.in_flight_count)
+        eq_(1, scheduler.get_in_flight_count(PRIORITY_CLASS_NORMAL))
+        eq_(1, scheduler.get_in_flight_count(PRIORITY_CLASS_BULK))
+
+        scheduler.release()
+        eq_(1, scheduler.in_flight_count)
+        eq_(0, scheduler.get_in_flight_count(PRIORITY_CLASS_NORMAL))
+
+    def test_priority_classes(self):
+        scheduler = RequestScheduler(1)
+        scheduler.acquire()
+
+        dispatch_recorder = _DispatchRecorder(scheduler)
+        dispatch_recorder.enqueue(RequestPriority(PRIORITY_CLASS_BULK))
+        dispatch_recorder.enqueue(RequestPriority(PRIORITY_CLASS_NORMAL))
+        dispatch_recorder.enqueue(RequestPriority(PRIORITY_CLASS_INTERACTIVE))
+
+        scheduler.release()
+        dispatch_recorder.release_all()
+
+        eq_(
+            [PRIORITY_CLASS_INTERACTIVE, PRIORITY_CLASS_NORMAL,
+                PRIORITY_CLASS_BULK],
+            [priority.class_name for priority in
+                dispatch_recorder.dispatched_priorities],
+            )
+
+    def test_weighted_fair_queuing(self):
+        scheduler = RequestScheduler(1, tenant_weights={'a': 2, 'b': 1})
+        scheduler.acquire()
+
+        dispatch_recorder = _DispatchRecorder(scheduler)
+        for tenant in ('a', 'a', 'a', 'a', 'b', 'b'):
+            dispatch_recorder.enqueue(
+                RequestPriority(PRIORITY_CLASS_BULK, tenant),
+                )
+
+        scheduler.release()
+        dispatch_recorder.release_all()
+
+        eq_(
+            ['a', 'a', 'b', 'a', 'a', 'b'],
+            [priority.tenant for priority in
+                dispatch_recorder.dispatched_priorities],
+            )
+
+    def test_class_in_flight_limit(self):
+        priority_classes = [
+            PriorityClass(PRIORITY_CLASS_INTERACTIVE),
+            PriorityClass(PRIORITY_CLASS_BULK, max_in_flight_count=1),
+            ]
+        scheduler = RequestScheduler(
+            3,
+            priority_classes,
+            default_class_name=PRIORITY_CLASS_BULK,
+            )
+        bulk_priority = RequestPriority(PRIORITY_CLASS_BULK)
+        interactive_priority = RequestPriority(PRIORITY_CLASS_INTERACTIVE)
+        scheduler.acquire(bulk_priority)
+
+        dispatch_recorder = _DispatchRecorder(scheduler)
+        dispatch_recorder.enqueue(bulk_priority)
+        scheduler.acquire(interactive_priority)
+
+        eq_(1, scheduler.get_queue_depth(PRIORITY_CLASS_BULK))
+        eq_(2, scheduler.in_flight_count)
+
+        scheduler.release(bulk_priority)
+        dispatch_recorder.release_all()
+
+        eq_([bulk_priority], dispatch_recorder.dispatched_priorities)
+
+    def test_queue_depth_limit(self):
+        priority_classes = [
+            PriorityClass(PRIORITY_CLASS_NORMAL, max_queue_depth=1),
+            ]
+        scheduler = RequestScheduler(1, priority_classes)
+        scheduler.acquire()
+
+        dispatch_recorder = _DispatchRecorder(scheduler)
+        dispatch_recorder.enqueue(None)
+
+        with assert_raises(HubspotRequestRejectedError):
+            scheduler.acquire()
+
+        scheduler.release()
+        dispatch_recorder.release_all()
+
+    def test_connection_requests(self):
+        scheduler = RequestScheduler(1)
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization=None,
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                request_scheduler=scheduler,
+                )
+            with connection:
+                connection.send_get_request(
+                    _STUB_URL_PATH,
+                    priority=RequestPriority(PRIORITY_CLASS_INTERACTIVE),
+                    )
+
+        eq_(0, scheduler.in_flight_count)
+
+
+class _DispatchRecorder(object):
+    """
+    Enqueue requests in the scheduler, one at a time, and record the order in
+    which they get dispatched.
+
+    """
+    def __init__(self, scheduler):
+        super(_DispatchRecorder, self).__init__()
+
+        self._scheduler = scheduler
+
+        self.dispatched_priorities = []
+        self._threads = []
+
+    def enqueue(self, priority):
+        class_name = (priority or RequestPriority(PRIORITY_CLASS_NORMAL)) \
+            .class_name
+        queue_depth = self._scheduler.get_queue_depth(class_name)
+
+        thread = Thread(target=self._send_request, args=(priority,))
+        thread.start()
+        self._threads.append(thread)
+
+        while self._scheduler.get_queue_depth(class_name) == queue_depth:
+            sleep(0.001)
+
+    def release_all(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _send_request(self, priority):
+        self._scheduler.acquire(priority)
+        self.dispatched_priorities.append(priority)
+        self._scheduler.release(priority)
+
+
+def _send_requests(limiter, request_count, latency, is_overloaded):
+    for _ in range(request_count):
+        limiter.acquire()
+        limiter.release(latency, is_overloaded)
+
+
+def _wait_for_waiting_requests(limiter, waiting_count):
+    while limiter.waiting_count != waiting_count:
+        sleep(0.001)
@@ -15,10 +15,14 @@
 ##############################################################################
 from abc import abstractmethod
 from abc import ABCMeta
+from array import array
 
 from builtins import bytes
 
 from json import dumps as json_serialize
+from json import loads as json_deserialize
+from subprocess import check_output
+from sys import executable as python_executable
 
 from six import with_metaclass
 from six.moves.urllib.parse import parse_qs
@@ -41,6 +45,7 @@ from hubspot.connection import PortalConnection
 from hubspot.connection.exc import HubspotAuthenticationError
 from hubspot.connection.exc import HubspotClientError
 from hubspot.connection.exc import HubspotInvalidResponseError
+from hubspot.connection.exc import HubspotRateLimitError
 from hubspot.connection.exc import HubspotServerError
 from hubspot.connection.exc import HubspotUnsupportedResponseError
 
@@ -174,6 +179,28 @@ class TestPortalConnection(object):
         exception = context_manager.exception
         eq_('Invalid JSON response body', str(exception))
 
+    def test_rate_limit_headers(self):
+        """The latest rate limit headers from HubSpot are made available."""
+        response_headers = {
+            'X-HubSpot-RateLimit-Daily-Remaining': '9000',
+            'X-HubSpot-Correlation-Id': get_uuid4_str(),
+        }
+        response_data_maker = _ResponseMaker(
+            200,
+            {},
+            'application/json',
+            response_headers,
+        )
+        connection = _MockPortalConnection(response_data_maker)
+        eq_({}, connection.get_rate_limit_headers())
+
+        connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(
+            {'x-hubspot-ratelimit-daily-remaining': '9000'},
+            connection.get_rate_limit_headers(),
+        )
+
     def test_unexpected_response_status_code(self):
         """
         An exception is raised when the response status code is unsupported.
@@ -251,6 +278,66 @@ class TestPortalConnection(object):
         ok_(connection.adapter.is_keep_alive_always_used)
 
 
+class TestRequestBodies(object):
+
+    def test_empty_body(self):
+        prepared_request = self._send_post_request({})
+
+        eq_('application/json', prepared_request.headers['content-type'])
+        eq_('{}', prepared_request.body)
+
+    def test_bytes(self):
+        body_serialization = b'{"foo": "bar"}'
+
+        prepared_request = self._send_post_request(body_serialization)
+
+        eq_('application/json', prepared_request.headers['content-type'])
+        eq_(body_serialization, prepared_request.body)
+        eq_(
+            str(len(body_serialization)),
+            prepared_request.headers['Content-Length'],
+            )
+
+    def test_memoryview(self):
+        body_serialization = memoryview(b'{"foo": "bar"}')
+
+        prepared_request = self._send_post_request(body_serialization)
+
+        ok_(prepared_request.body is body_serialization)
+        eq_(
+            str(len(body_serialization)),
+            prepared_request.headers['Content-Length'],
+            )
+
+    def test_memoryview_of_wide_items(self):
+        body_serialization = memoryview(array('i', [0, 1]))
+
+        prepared_request = self._send_post_request(body_serialization)
+
+        eq_('B', prepared_request.body.format)
+        eq_(
+            str(body_serialization.nbytes),
+            prepared_request.headers['Content-Length'],
+            )
+
+    def test_iterator(self):
+        body_chunks = iter([b'{"foo": ', b'"bar"}'])
+
+        prepared_request = self._send_post_request(body_chunks)
+
+        eq_('application/json', prepared_request.headers['content-type'])
+        eq_('chunked', prepared_request.headers['Transfer-Encoding'])
+        eq_(body_chunks, prepared_request.body)
+
+    @staticmethod
+    def _send_post_request(body_deserialization):
+        connection = _MockPortalConnection()
+        connection.send_post_request(_STUB_URL_PATH, body_deserialization)
+
+        prepared_request, = connection.prepared_requests
+        return prepared_request
+
+
 class TestErrorResponses(object):
 
     def test_server_error_response(self):
@@ -281,6 +368,95 @@ class TestErrorResponses(object):
         exception = context_manager.exception
         eq_(request_id, exception.request_id)
         eq_(error_message, str(exception))
+        eq_(400, exception.http_status_code)
+
+    def test_rate_limit_error_response(self):
+        request_id = get_uuid4_str()
+        error_message = 'You have reached your secondly limit.'
+        body_deserialization = {
+            'status': 'error',
+            'message': error_message,
+            'errorType': 'RATE_LIMIT',
+            'requestId': request_id,
+            }
+        response_headers = {
+            'Retry-After': '2',
+            'X-HubSpot-RateLimit-Secondly-Remaining': '0',
+            'X-HubSpot-RateLimit-Daily-Remaining': '9000',
+            }
+        response_data_maker = _ResponseMaker(
+            429,
+            body_deserialization,
+            'application/json',
+            response_headers,
+            )
+        connection = _MockPortalConnection(response_data_maker)
+
+        with assert_raises(HubspotRateLimitError) as context_manager:
+            connection.send_get_request(_STUB_URL_PATH)
+
+        exception = context_manager.exception
+        assert_is_instance(exception, HubspotClientError)
+        eq_(error_message, str(exception))
+        eq_(request_id, exception.request_id)
+        eq_(2, exception.retry_after)
+        eq_(429, exception.http_status_code)
+        eq_(
+            {
+                'retry-after': '2',
+                'x-hubspot-ratelimit-secondly-remaining': '0',
+                'x-hubspot-ratelimit-daily-remaining': '9000',
+                },
+            exception.response_headers,
+            )
+
+    def test_rate_limit_error_response_without_error_message(self):
+        response_data_maker = _ResponseMaker(429, content_type='text/html')
+        connection = _MockPortalConnection(response_data_maker)
+
+        with assert_raises(HubspotRateLimitError) as context_manager:
+            connection.send_get_request(_STUB_URL_PATH)
+
+        exception = context_manager.exception
+        eq_('Reason', str(exception))
+        eq_(None, exception.request_id)
+        eq_(None, exception.retry_after)
+
+    def test_rate_limit_error_response_with_retry_date(self):
+        response_headers = {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+        response_data_maker = \
+            _ResponseMaker(429, response_headers=response_headers)
+        connection = _MockPortalConnection(response_data_maker)
+
+        with assert_raises(HubspotRateLimitError) as context_manager:
+            connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(0, context_manager.exception.retry_after)
+
+    def test_response_metadata(self):
+        request_id = get_uuid4_str()
+        response_headers = {
+            'X-HubSpot-Correlation-Id': request_id,
+            'X-HubSpot-RateLimit-Remaining': '99',
+            'Set-Cookie': 'foo=bar',
+            }
+        response_data_maker = \
+            _ResponseMaker(503, response_headers=response_headers)
+        connection = _MockPortalConnection(response_data_maker)
+
+        with assert_raises(HubspotServerError) as context_manager:
+            connection.send_get_request(_STUB_URL_PATH)
+
+        exception = context_manager.exception
+        eq_(request_id, exception.request_id)
+        ok_(0 <= exception.elapsed_time)
+        eq_(
+            {
+                'x-hubspot-correlation-id': request_id,
+                'x-hubspot-ratelimit-remaining': '99',
+                },
+            exception.response_headers,
+            )
 
     def test_corrupted_json_response(self):
         """An exception is raised for responses containing malformed JSON."""
@@ -343,6 +519,52 @@ class TestAuthentication(object):
         eq_(error_message, str(exception))
 
 
+class TestImportTime(object):
+    """
+    Importing :mod:`hubspot.connection` must not pull in the modules which
+    are only needed when a connection is used.
+
+    """
+    _LAZY_MODULE_NAMES = ('pkg_resources', 'voluptuous')
+
+    def test_lazy_modules_not_imported(self):
+        imported_module_names = _get_imported_module_names('hubspot.connection')
+
+        lazily_imported_module_names = [
+            module_name for module_name in self._LAZY_MODULE_NAMES
+            if module_name in imported_module_names
+            ]
+        eq_([], lazily_imported_module_names)
+
+
+_IMPORT_SCRIPT = """
+import json
+import sys
+
+import hubspot
+
+module_names_before = set(sys.modules)
+__import__({module_name!r})
+imported_module_names = sorted(set(sys.modules) - module_names_before)
+
+json.dump(imported_module_names, sys.stdout)
+"""
+
+
+def _get_imported_module_names(module_name):
+    """
+    Import ``module_name`` in a fresh interpreter and return the names of the
+    modules imported as a consequence.
+
+    """
+    script = _IMPORT_SCRIPT.format(module_name=module_name)
+    imported_module_names_serialization = \
+        check_output([python_executable, '-c', script]).decode('UTF-8')
+    imported_module_names = \
+        json_deserialize(imported_module_names_serialization)
+    return imported_module_names
+
+
 class _MockPortalConnection(PortalConnection):
 
     def __init__(
@@ -412,11 +634,13 @@ class _ResponseMaker(_BaseResponseMaker):
         status_code,
         body_deserialization=None,
         content_type=None,
+        response_headers=None,
     ):
         super(_ResponseMaker, self).__init__(status_code)
 
         self._body_deserialization = body_deserialization
         self._content_type = content_type
+        self._response_headers = response_headers or {}
 
     def __call__(self, request):
         response = super(_ResponseMaker, self).__call__(request)
@@ -425,6 +649,7 @@ class _ResponseMaker(_BaseResponseMaker):
             content_type_header_value = \
                 '{}; charset=UTF-8'.format(self._content_type)
             response.headers['Content-Type'] = content_type_header_value
+        response.headers.update(self._response_headers)
 
         if self._status_code != 204 and self._body_deserialization is not None:
             response._content = \
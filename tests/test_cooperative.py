@@ -0,0 +1,154 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from json import loads as json_deserialize
+from subprocess import check_output
+from sys import executable as python_executable
+from unittest import SkipTest
+
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+
+_COOPERATIVE_REQUESTS_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+
+import json
+import sys
+from time import time
+
+import gevent
+
+from hubspot.connection import APIKey
+from hubspot.connection import PortalConnection
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+
+response_body_deserialization = {{'contacts': list(range(20000))}}
+api_calls = [
+    SuccessfulAPICall(
+        {url_path!r},
+        'GET',
+        response_body_deserialization=response_body_deserialization,
+        )
+    for _ in range({request_count})
+    ]
+
+with MockHubspotServer(
+    lambda: api_calls,
+    is_order_significant=False,
+    latency=lambda: {latency},
+    ) as server:
+    connection = PortalConnection(
+        APIKey('key'),
+        'Testing',
+        api_url=server.api_url,
+        pool_size={pool_size},
+        cooperative=True,
+        )
+    with connection:
+        start_time = time()
+        greenlets = [
+            gevent.spawn(connection.send_get_request, {url_path!r})
+            for _ in range({request_count})
+            ]
+        gevent.joinall(greenlets, raise_error=True)
+        duration = time() - start_time
+
+json.dump(
+    {{
+        'duration': duration,
+        'successful_response_count': sum(
+            greenlet.value == response_body_deserialization
+            for greenlet in greenlets
+            ),
+        }},
+    sys.stdout,
+    )
+"""
+
+
+class TestCooperativeMode(object):
+
+    def test_concurrent_requests_under_monkey_patching(self):
+        _require_gevent()
+
+        request_count = 16
+        pool_size = 4
+        latency = 0.1
+
+        report = _run_cooperative_requests(request_count, pool_size, latency)
+
+        eq_(request_count, report['successful_response_count'])
+        serial_duration = request_count * latency
+        ok_(
+            report['duration'] < serial_duration / 2,
+            'Requests took {} seconds'.format(report['duration']),
+            )
+
+    def test_requests_without_monkey_patching(self):
+        _require_gevent()
+
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'contacts': []},
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                cooperative=True,
+                )
+            with connection:
+                response_body_deserialization = \
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        eq_({'contacts': []}, response_body_deserialization)
+
+
+def _require_gevent():
+    try:
+        import gevent
+    except ImportError:
+        raise SkipTest('gevent is not installed')
+
+
+def _run_cooperative_requests(request_count, pool_size, latency):
+    """
+    Send concurrent requests from greenlets in a fresh interpreter
+    monkey-patched by gevent.
+
+    """
+    script = _COOPERATIVE_REQUESTS_SCRIPT.format(
+        url_path=_STUB_URL_PATH,
+        request_count=request_count,
+        pool_size=pool_size,
+        latency=latency,
+        )
+    report_serialization = \
+        check_output([python_executable, '-c', script]).decode('UTF-8')
+    report = json_deserialize(report_serialization)
+    return report
@@ -0,0 +1,302 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from gzip import GzipFile
+from json import loads as json_deserialize
+from os import listdir
+from os.path import join as join_path
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.export import CollectionExport
+from hubspot.connection.export import export_collections
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnorderedMockPortalConnection
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import MemoryCheckpointStore
+from tests.utils import make_temporary_directory
+
+
+_STUB_CONTACTS_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+_STUB_COMPANIES_URL_PATH = '/companies/v2/companies/paged'
+
+_CONTACTS_EXPORT = CollectionExport(
+    'contacts',
+    _STUB_CONTACTS_URL_PATH,
+    'contacts',
+    )
+
+_COMPANIES_EXPORT = CollectionExport(
+    'companies',
+    _STUB_COMPANIES_URL_PATH,
+    'companies',
+    offset_query_string_arg_names_by_response_key={'offset': 'offset'},
+    has_more_key='has-more',
+    )
+
+
+class TestCollectionsExport(object):
+
+    def test_single_shard(self):
+        api_calls = [_make_contacts_page_api_call({}, [1, 2], None)]
+
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = MemoryCheckpointStore()
+            record_counts = self._export(
+                api_calls,
+                [_CONTACTS_EXPORT],
+                directory_path,
+                checkpoint_store,
+                )
+
+            eq_({'contacts': 2}, record_counts)
+            eq_(['contacts-00000.ndjson.gz'], listdir(directory_path))
+            eq_(
+                [{'vid': 1}, {'vid': 2}],
+                _read_shard(directory_path, 'contacts-00000.ndjson.gz'),
+                )
+            eq_([], checkpoint_store.updates)
+            eq_({}, checkpoint_store.cursors_by_checkpoint_name)
+
+    def test_shard_rotation(self):
+        api_calls = [
+            _make_contacts_page_api_call({}, [1], 1),
+            _make_contacts_page_api_call(_make_offsets(1), [2], 2),
+            _make_contacts_page_api_call(_make_offsets(2), [3], None),
+            ]
+
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = MemoryCheckpointStore()
+            self._export(
+                api_calls,
+                [_CONTACTS_EXPORT],
+                directory_path,
+                checkpoint_store,
+                max_records_per_shard=2,
+                )
+
+            eq_(
+                ['contacts-00000.ndjson.gz', 'contacts-00001.ndjson.gz'],
+                sorted(listdir(directory_path)),
+                )
+            eq_(
+                [{'vid': 1}, {'vid': 2}],
+                _read_shard(directory_path, 'contacts-00000.ndjson.gz'),
+                )
+            eq_(
+                [{'vid': 3}],
+                _read_shard(directory_path, 'contacts-00001.ndjson.gz'),
+                )
+            eq_(
+                [('contacts', _make_checkpoint(_make_offsets(2), 1))],
+                checkpoint_store.updates,
+                )
+            eq_({}, checkpoint_store.cursors_by_checkpoint_name)
+
+    def test_uncompressed_shards(self):
+        api_calls = [_make_contacts_page_api_call({}, [1], None)]
+
+        with make_temporary_directory() as directory_path:
+            self._export(
+                api_calls,
+                [_CONTACTS_EXPORT],
+                directory_path,
+                MemoryCheckpointStore(),
+                compress=False,
+                )
+
+            eq_(
+                [{'vid': 1}],
+                _read_shard(directory_path, 'contacts-00000.ndjson'),
+                )
+
+    def test_resumption(self):
+        api_calls = [_make_contacts_page_api_call(_make_offsets(2), [3], None)]
+
+        with make_temporary_directory() as directory_path:
+            stale_shard_path = join_path(
+                directory_path,
+                'contacts-00001.ndjson.gz',
+                )
+            with open(stale_shard_path, 'wb') as stale_shard_file:
+                stale_shard_file.write(b'incomplete')
+
+            checkpoint_store = MemoryCheckpointStore()
+            checkpoint_store.set(
+                'contacts',
+                _make_checkpoint(_make_offsets(2), 1),
+                )
+            record_counts = self._export(
+                api_calls,
+                [_CONTACTS_EXPORT],
+                directory_path,
+                checkpoint_store,
+                )
+
+            eq_({'contacts': 1}, record_counts)
+            eq_(
+                [{'vid': 3}],
+                _read_shard(directory_path, 'contacts-00001.ndjson.gz'),
+                )
+            eq_({}, checkpoint_store.cursors_by_checkpoint_name)
+
+    def test_shards_from_previous_export(self):
+        api_calls = [_make_contacts_page_api_call({}, [1], None)]
+
+        with make_temporary_directory() as directory_path:
+            previous_file_names = (
+                'contacts-00000.ndjson.gz',
+                'contacts-00001.ndjson.gz',
+                'contacts-00002.ndjson',
+                'companies-00000.ndjson.gz',
+                )
+            for file_name in previous_file_names:
+                file_path = join_path(directory_path, file_name)
+                with open(file_path, 'wb') as previous_file:
+                    previous_file.write(b'stale')
+
+            self._export(
+                api_calls,
+                [_CONTACTS_EXPORT],
+                directory_path,
+                MemoryCheckpointStore(),
+                )
+
+            eq_(
+                ['companies-00000.ndjson.gz', 'contacts-00000.ndjson.gz'],
+                sorted(listdir(directory_path)),
+                )
+            eq_(
+                [{'vid': 1}],
+                _read_shard(directory_path, 'contacts-00000.ndjson.gz'),
+                )
+
+    def test_multiple_collections(self):
+        api_calls = [
+            _make_contacts_page_api_call({}, [1], 1),
+            _make_contacts_page_api_call(_make_offsets(1), [2], None),
+            SuccessfulAPICall(
+                _STUB_COMPANIES_URL_PATH,
+                'GET',
+                {},
+                response_body_deserialization={
+                    'companies': [{'companyId': 10}],
+                    'has-more': False,
+                    },
+                ),
+            ]
+
+        with make_temporary_directory() as directory_path:
+            record_counts = self._export(
+                api_calls,
+                [_CONTACTS_EXPORT, _COMPANIES_EXPORT],
+                directory_path,
+                MemoryCheckpointStore(),
+                max_parallel_export_count=2,
+                max_queued_page_count=1,
+                )
+
+            eq_({'contacts': 2, 'companies': 1}, record_counts)
+            eq_(
+                [{'vid': 1}, {'vid': 2}],
+                _read_shard(directory_path, 'contacts-00000.ndjson.gz'),
+                )
+            eq_(
+                [{'companyId': 10}],
+                _read_shard(directory_path, 'companies-00000.ndjson.gz'),
+                )
+
+    def test_failed_request(self):
+        api_calls = [
+            _make_contacts_page_api_call({}, [1], 1),
+            UnsuccessfulAPICall(
+                _STUB_CONTACTS_URL_PATH,
+                'GET',
+                _make_offsets(1),
+                exception=HubspotServerError('Error', 503),
+                ),
+            ]
+
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = MemoryCheckpointStore()
+            checkpoint_store.set('contacts', _make_checkpoint({}, 0))
+            with assert_raises(HubspotServerError):
+                self._export(
+                    api_calls,
+                    [_CONTACTS_EXPORT],
+                    directory_path,
+                    checkpoint_store,
+                    )
+
+            eq_(
+                {'contacts': _make_checkpoint({}, 0)},
+                checkpoint_store.cursors_by_checkpoint_name,
+                )
+
+    @staticmethod
+    def _export(api_calls, collection_exports, *args, **kwargs):
+        with UnorderedMockPortalConnection(lambda: api_calls) as connection:
+            record_counts = export_collections(
+                connection,
+                collection_exports,
+                *args,
+                **kwargs
+                )
+        return record_counts
+
+
+
+def _make_contacts_page_api_call(query_string_args, vids, vid_offset):
+    api_call = SuccessfulAPICall(
+        _STUB_CONTACTS_URL_PATH,
+        'GET',
+        query_string_args,
+        response_body_deserialization={
+            'contacts': [{'vid': vid} for vid in vids],
+            'has-more': vid_offset is not None,
+            'vid-offset': vid_offset,
+            },
+        )
+    return api_call
+
+
+def _make_offsets(vid_offset):
+    return {'vidOffset': vid_offset}
+
+
+def _make_checkpoint(offset_query_string_args, shard_number):
+    checkpoint = {
+        'offset_query_string_args': offset_query_string_args,
+        'shard_number': shard_number,
+        }
+    return checkpoint
+
+
+def _read_shard(directory_path, shard_file_name):
+    shard_file_path = join_path(directory_path, shard_file_name)
+    if shard_file_name.endswith('.gz'):
+        shard_file = GzipFile(shard_file_path, 'rb')
+    else:
+        shard_file = open(shard_file_path, 'rb')
+    with shard_file:
+        records = [
+            json_deserialize(line.decode('UTF-8')) for line in shard_file
+            ]
+    return records
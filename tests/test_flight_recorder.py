@@ -0,0 +1,242 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from os import getpid
+from os import kill
+from signal import SIGUSR2
+from signal import getsignal
+from signal import signal as set_signal_handler
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+from six import StringIO
+
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.flight_recorder import FlightRecorder
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import get_uuid4_str
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/contact/vid/123/profile'
+
+_STUB_URL_PATH_TEMPLATE = '/contacts/v1/contact/vid/{id}/profile'
+
+_STUB_START_TIME = 1400000000.25
+
+
+class TestFlightRecorder(object):
+
+    def test_no_requests(self):
+        recorder = FlightRecorder()
+
+        eq_([], recorder.get_records())
+
+    def test_request(self):
+        recorder = FlightRecorder()
+
+        recorder.record_request(
+            'GET',
+            _STUB_URL_PATH,
+            _STUB_START_TIME,
+            0.5,
+            0.25,
+            200,
+            1,
+            )
+
+        record, = recorder.get_records()
+        eq_('GET', record.http_method)
+        eq_(_STUB_URL_PATH_TEMPLATE, record.url_path_template)
+        eq_(_STUB_START_TIME, record.start_time)
+        eq_(0.5, record.wait_time)
+        eq_(0.25, record.latency)
+        eq_(200, record.status_code)
+        eq_(1, record.retry_count)
+        eq_(None, record.exception_class)
+
+    def test_failed_request(self):
+        recorder = FlightRecorder()
+
+        recorder.record_request(
+            'GET',
+            _STUB_URL_PATH,
+            _STUB_START_TIME,
+            exception=HubspotServerError('Error', 503),
+            )
+
+        record, = recorder.get_records()
+        eq_(HubspotServerError, record.exception_class)
+
+    def test_requests_beyond_capacity(self):
+        recorder = FlightRecorder(capacity=2)
+
+        for url_path in ('/a', '/b', '/c'):
+            recorder.record_request('GET', url_path, _STUB_START_TIME)
+
+        eq_(
+            ['/b', '/c'],
+            [record.url_path_template for record in recorder.get_records()],
+            )
+
+    def test_custom_url_path_templater(self):
+        recorder = FlightRecorder(url_path_templater=lambda url_path: '/x')
+
+        recorder.record_request('GET', _STUB_URL_PATH, _STUB_START_TIME)
+
+        record, = recorder.get_records()
+        eq_('/x', record.url_path_template)
+
+    def test_dump(self):
+        recorder = FlightRecorder()
+        recorder.record_request(
+            'GET',
+            _STUB_URL_PATH,
+            _STUB_START_TIME,
+            0.5,
+            0.25,
+            200,
+            0,
+            )
+        recorder.record_request(
+            'POST',
+            '/contacts/v1/contact',
+            _STUB_START_TIME,
+            exception=HubspotServerError('Error', 503),
+            )
+
+        stream = StringIO()
+        recorder.dump(stream)
+
+        eq_(
+            'Last 2 requests to HubSpot:\n'
+            '2014-05-13T16:53:20.250Z GET ' + _STUB_URL_PATH_TEMPLATE +
+            ' status=200 wait=0.500s latency=0.250s retries=0 exception=-\n'
+            '2014-05-13T16:53:20.250Z POST /contacts/v1/contact status=- '
+            'wait=0.000s latency=- retries=- exception=HubspotServerError\n',
+            stream.getvalue(),
+            )
+
+    def test_dump_on_exception(self):
+        stream = StringIO()
+        recorder = FlightRecorder(exception_dump_stream=stream)
+
+        recorder.record_request('GET', '/a', _STUB_START_TIME)
+        eq_('', stream.getvalue())
+
+        recorder.record_request(
+            'GET',
+            '/b',
+            _STUB_START_TIME,
+            exception=HubspotServerError('Error', 503),
+            )
+        ok_(stream.getvalue().startswith('Last 2 requests'))
+
+    def test_no_dump_on_other_exceptions(self):
+        stream = StringIO()
+        recorder = FlightRecorder(exception_dump_stream=stream)
+
+        recorder.record_request(
+            'GET',
+            '/a',
+            _STUB_START_TIME,
+            exception=ValueError(),
+            )
+
+        eq_('', stream.getvalue())
+
+    def test_dump_on_signal(self):
+        stream = StringIO()
+        recorder = FlightRecorder()
+        recorder.record_request('GET', '/a', _STUB_START_TIME)
+
+        original_signal_handler = getsignal(SIGUSR2)
+        try:
+            recorder.dump_on_signal(SIGUSR2, stream)
+            kill(getpid(), SIGUSR2)
+        finally:
+            set_signal_handler(SIGUSR2, original_signal_handler)
+
+        ok_(stream.getvalue().startswith('Last 1 requests'))
+
+    def test_dump_on_signal_while_recording(self):
+        stream = StringIO()
+        recorder = FlightRecorder()
+        recorder.record_request('GET', '/a', _STUB_START_TIME)
+
+        original_signal_handler = getsignal(SIGUSR2)
+        try:
+            recorder.dump_on_signal(SIGUSR2, stream)
+            with recorder._lock:
+                kill(getpid(), SIGUSR2)
+        finally:
+            set_signal_handler(SIGUSR2, original_signal_handler)
+
+        ok_(stream.getvalue().startswith('Last 1 requests'))
+
+
+class TestPortalConnectionFlightRecorder(object):
+
+    def test_successful_request(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'vid': 123},
+            )
+        recorder = FlightRecorder()
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                flight_recorder=recorder,
+                )
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        record, = recorder.get_records()
+        eq_('GET', record.http_method)
+        eq_(_STUB_URL_PATH_TEMPLATE, record.url_path_template)
+        eq_(200, record.status_code)
+        eq_(0, record.retry_count)
+        ok_(0 < record.latency)
+        ok_(0 <= record.wait_time)
+        eq_(None, record.exception_class)
+
+    def test_failed_request(self):
+        api_call = UnsuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            exception=HubspotClientError('Error', get_uuid4_str()),
+            )
+        recorder = FlightRecorder()
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                flight_recorder=recorder,
+                )
+            with connection:
+                with assert_raises(HubspotClientError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        record, = recorder.get_records()
+        eq_(400, record.status_code)
+        eq_(HubspotClientError, record.exception_class)
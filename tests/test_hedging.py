@@ -0,0 +1,284 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from threading import current_thread
+from threading import Lock
+from time import sleep
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.hedging import _HedgedRequest
+from hubspot.connection.hedging import HedgingPortalConnection
+from hubspot.connection.hedging import HedgingStatistics
+from hubspot.connection.metrics import MetricsRegistry
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+
+
+_URL_PATH = '/contacts/v1/contact/vid/1/profile'
+
+_HEDGE_DELAY = 0.02
+
+_SHORT_LATENCY = 0.1
+
+_LONG_LATENCY = 0.5
+
+
+class TestHedgingPortalConnection(object):
+
+    def test_fast_request(self):
+        connection = _DelayingConnection([(0, 'response')])
+        hedging_connection = \
+            HedgingPortalConnection(connection, hedge_delay=_HEDGE_DELAY)
+
+        response_body_deserialization = \
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_('response', response_body_deserialization)
+        eq_(1, len(connection.requests))
+        eq_(HedgingStatistics(1, 0, 0), hedging_connection.get_statistics())
+
+    def test_slow_request(self):
+        connection = _DelayingConnection(
+            [(_LONG_LATENCY, 'slow response'), (0, 'fast response')],
+            )
+        hedging_connection = _make_hedging_connection(connection)
+
+        response_body_deserialization = \
+            hedging_connection.send_get_request(_URL_PATH, {'a': 'b'})
+
+        eq_('fast response', response_body_deserialization)
+        eq_([(_URL_PATH, {'a': 'b'}, None)] * 2, connection.requests)
+        eq_(HedgingStatistics(1, 1, 1), hedging_connection.get_statistics())
+
+    def test_slower_hedge(self):
+        connection = _DelayingConnection(
+            [(_SHORT_LATENCY, 'first response'), (_LONG_LATENCY, 'hedge')],
+            )
+        hedging_connection = _make_hedging_connection(connection)
+
+        response_body_deserialization = \
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_('first response', response_body_deserialization)
+        eq_(HedgingStatistics(1, 1, 0), hedging_connection.get_statistics())
+
+    def test_failed_request(self):
+        connection = _DelayingConnection([
+            (_SHORT_LATENCY, HubspotServerError('Bad Gateway', 502)),
+            (_SHORT_LATENCY, 'response'),
+            ])
+        hedging_connection = _make_hedging_connection(connection)
+
+        response_body_deserialization = \
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_('response', response_body_deserialization)
+
+    def test_failed_hedge(self):
+        connection = _DelayingConnection([
+            (_SHORT_LATENCY, 'response'),
+            (0, HubspotServerError('Bad Gateway', 502)),
+            ])
+        hedging_connection = _make_hedging_connection(connection)
+
+        response_body_deserialization = \
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_('response', response_body_deserialization)
+
+    def test_failed_request_and_hedge(self):
+        exception = HubspotServerError('Bad Gateway', 502)
+        connection = _DelayingConnection([
+            (_SHORT_LATENCY, exception),
+            (_SHORT_LATENCY, HubspotServerError('Gateway Timeout', 504)),
+            ])
+        hedging_connection = _make_hedging_connection(connection)
+
+        with assert_raises(HubspotServerError) as context_manager:
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_(exception, context_manager.exception)
+
+    def test_request_failed_before_hedge_delay(self):
+        exception = HubspotServerError('Bad Gateway', 502)
+        connection = _DelayingConnection([(0, exception)])
+        hedging_connection = _make_hedging_connection(connection)
+
+        with assert_raises(HubspotServerError):
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_(1, len(connection.requests))
+
+    def test_threads_reused(self):
+        connection = _DelayingConnection([(0, 'response')] * 3)
+        hedging_connection = _make_hedging_connection(connection)
+
+        for _ in range(3):
+            hedging_connection.send_get_request(_URL_PATH)
+            sleep(0.01)
+
+        eq_(1, len(set(connection.threads)))
+
+    def test_hedge_after_completion(self):
+        connection = _DelayingConnection([(0, 'response')] * 2)
+        hedging_connection = _make_hedging_connection(connection)
+        hedging_connection.send_get_request(_URL_PATH)
+        hedged_request = _HedgedRequest()
+        hedged_request.add_attempt()
+        hedged_request.set_response(0, 'response')
+
+        hedging_connection._start_hedge(hedged_request, _URL_PATH, None, None)
+
+        eq_(1, len(connection.requests))
+        eq_(HedgingStatistics(1, 0, 0), hedging_connection.get_statistics())
+
+    def test_unknown_hedge_delay(self):
+        connection = _DelayingConnection([(_SHORT_LATENCY, 'response')])
+        hedging_connection = HedgingPortalConnection(connection)
+
+        hedging_connection.send_get_request(_URL_PATH)
+
+        eq_(1, len(connection.requests))
+
+    def test_observed_latency(self):
+        metrics_registry = MetricsRegistry()
+        for _ in range(20):
+            metrics_registry.record_request('GET', _URL_PATH, _HEDGE_DELAY)
+        connection = _DelayingConnection([
+            (_LONG_LATENCY, 'slow response'),
+            (0, 'fast response'),
+            (_SHORT_LATENCY, 'other response'),
+            ])
+        hedging_connection = HedgingPortalConnection(
+            connection,
+            metrics_registry,
+            max_hedge_ratio=1,
+            )
+
+        eq_('fast response', hedging_connection.send_get_request(_URL_PATH))
+        eq_(
+            'other response',
+            hedging_connection.send_get_request('/contacts/v1/lists'),
+            )
+        eq_(3, len(connection.requests))
+
+    def test_observed_latency_before_hedge_delay(self):
+        metrics_registry = MetricsRegistry()
+        metrics_registry.record_request('GET', _URL_PATH, _LONG_LATENCY * 2)
+        connection = _DelayingConnection([(_SHORT_LATENCY, 'response')])
+        hedging_connection = _make_hedging_connection(
+            connection,
+            metrics_registry=metrics_registry,
+            )
+
+        hedging_connection.send_get_request(_URL_PATH)
+
+        eq_(1, len(connection.requests))
+
+    def test_hedge_budget(self):
+        connection = _DelayingConnection(
+            [(_SHORT_LATENCY, 'response')] * 5,
+            )
+        hedging_connection = _make_hedging_connection(
+            connection,
+            max_hedge_ratio=0.5,
+            )
+
+        for _ in range(3):
+            hedging_connection.send_get_request(_URL_PATH)
+
+        eq_(4, len(connection.requests))
+        eq_(HedgingStatistics(3, 1, 0), hedging_connection.get_statistics())
+
+    def test_priority(self):
+        priority = RequestPriority(PRIORITY_CLASS_BULK)
+        connection = _DelayingConnection(
+            [(_LONG_LATENCY, 'slow response'), (0, 'fast response')],
+            )
+        hedging_connection = _make_hedging_connection(connection)
+
+        hedging_connection.send_get_request(_URL_PATH, priority=priority)
+
+        eq_([(_URL_PATH, None, priority)] * 2, connection.requests)
+
+    def test_other_requests(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _URL_PATH,
+                'POST',
+                request_body_deserialization={'properties': []},
+                response_body_deserialization=None,
+                ),
+            SuccessfulAPICall(
+                _URL_PATH,
+                'PUT',
+                request_body_deserialization={'properties': []},
+                response_body_deserialization=None,
+                ),
+            SuccessfulAPICall(
+                _URL_PATH,
+                'DELETE',
+                response_body_deserialization=None,
+                ),
+            ]
+        connection = MockPortalConnection(lambda: api_calls)
+
+        with _make_hedging_connection(connection) as hedging_connection:
+            hedging_connection.send_post_request(
+                _URL_PATH,
+                {'properties': []},
+                )
+            hedging_connection.send_put_request(
+                _URL_PATH,
+                {'properties': []},
+                )
+            hedging_connection.send_delete_request(_URL_PATH)
+
+
+class _DelayingConnection(object):
+
+    def __init__(self, outcomes):
+        super(_DelayingConnection, self).__init__()
+
+        self._outcomes = list(outcomes)
+
+        self._lock = Lock()
+        self.requests = []
+        self.threads = []
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        with self._lock:
+            self.requests.append((url_path, query_string_args, priority))
+            self.threads.append(current_thread())
+            latency, outcome = self._outcomes.pop(0)
+
+        sleep(latency)
+
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def _make_hedging_connection(connection, **kwargs):
+    kwargs.setdefault('hedge_delay', _HEDGE_DELAY)
+    kwargs.setdefault('max_hedge_ratio', 1)
+    hedging_connection = HedgingPortalConnection(connection, **kwargs)
+    return hedging_connection
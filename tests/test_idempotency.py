@@ -0,0 +1,326 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from nose.tools import assert_false
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectTimeout
+
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.idempotency import IdempotentPortalConnection
+from hubspot.connection.idempotency import OutcomeStore
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import get_uuid4_str
+
+
+_STUB_URL_PATH = '/contacts/v1/contact'
+
+_STUB_BODY_DESERIALIZATION = {'properties': [{'property': 'email'}]}
+
+_STUB_RESPONSE_BODY_DESERIALIZATION = {'vid': 1}
+
+
+class TestIdempotentPortalConnection(object):
+
+    def test_successful_write(self):
+        connection = _FlakyPortalConnection()
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(1, connection.request_count)
+
+    def test_repeated_write(self):
+        connection = _FlakyPortalConnection()
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        for _ in range(2):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                )
+
+        eq_(2, connection.request_count)
+
+    def test_repeated_idempotency_key(self):
+        connection = _FlakyPortalConnection()
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+        idempotency_key = get_uuid4_str()
+
+        for body_deserialization in ({'a': 1}, {'a': 2}):
+            response_body_deserialization = \
+                idempotent_connection.send_post_request(
+                    _STUB_URL_PATH,
+                    body_deserialization,
+                    idempotency_key=idempotency_key,
+                    )
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(1, connection.request_count)
+
+    def test_failed_write_with_idempotency_key(self):
+        connection = _FlakyPortalConnection(
+            [HubspotClientError('Invalid email', get_uuid4_str())],
+            )
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+        idempotency_key = get_uuid4_str()
+
+        with assert_raises(HubspotClientError):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                idempotency_key=idempotency_key,
+                )
+        idempotent_connection.send_post_request(
+            _STUB_URL_PATH,
+            _STUB_BODY_DESERIALIZATION,
+            idempotency_key=idempotency_key,
+            )
+
+        eq_(2, connection.request_count)
+
+    def test_explicit_idempotency_keys(self):
+        connection = _FlakyPortalConnection()
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        for _ in range(2):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                idempotency_key=get_uuid4_str(),
+                )
+
+        eq_(2, connection.request_count)
+
+    def test_unsent_request_retried(self):
+        connection = _FlakyPortalConnection([ConnectTimeout()])
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(2, connection.request_count)
+
+    def test_pre_serialized_body(self):
+        connection = _FlakyPortalConnection([ConnectTimeout()])
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, b'{"properties": []}')
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(2, connection.request_count)
+
+    def test_streamed_body_not_retried(self):
+        connection = _FlakyPortalConnection([ConnectTimeout()])
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        with assert_raises(ConnectTimeout):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                iter([b'{"properties": ', b'[]}']),
+                )
+
+        eq_(1, connection.request_count)
+
+    def test_ambiguous_failure_without_resolver(self):
+        connection = _FlakyPortalConnection([ConnectionError()])
+        idempotent_connection = \
+            IdempotentPortalConnection(connection, retry_delay=0)
+
+        with assert_raises(ConnectionError):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                )
+
+        eq_(1, connection.request_count)
+
+    def test_ambiguous_failure_resolved_as_applied(self):
+        connection = \
+            _FlakyPortalConnection([HubspotServerError('Bad Gateway', 502)])
+        duplicate_resolver = \
+            _DuplicateResolver(_STUB_RESPONSE_BODY_DESERIALIZATION)
+        idempotent_connection = IdempotentPortalConnection(
+            connection,
+            duplicate_resolver=duplicate_resolver,
+            retry_delay=0,
+            )
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(1, connection.request_count)
+        eq_(
+            [(connection, _STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)],
+            duplicate_resolver.calls,
+            )
+
+    def test_ambiguous_failure_resolved_as_unapplied(self):
+        connection = _FlakyPortalConnection([ConnectionError()])
+        duplicate_resolver = _DuplicateResolver(None)
+        idempotent_connection = IdempotentPortalConnection(
+            connection,
+            duplicate_resolver=duplicate_resolver,
+            retry_delay=0,
+            )
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(2, connection.request_count)
+        eq_(1, len(duplicate_resolver.calls))
+
+    def test_duplicate_rejected_after_ambiguous_failure(self):
+        connection = _FlakyPortalConnection([
+            ConnectionError(),
+            HubspotClientError('Contact already exists', get_uuid4_str()),
+            ])
+        duplicate_resolver = _DuplicateResolver(
+            None,
+            _STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+        idempotent_connection = IdempotentPortalConnection(
+            connection,
+            duplicate_resolver=duplicate_resolver,
+            retry_delay=0,
+            )
+
+        response_body_deserialization = idempotent_connection \
+            .send_post_request(_STUB_URL_PATH, _STUB_BODY_DESERIALIZATION)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+        eq_(2, connection.request_count)
+
+    def test_client_error(self):
+        connection = _FlakyPortalConnection(
+            [HubspotClientError('Invalid email', get_uuid4_str())],
+            )
+        duplicate_resolver = _DuplicateResolver(None)
+        idempotent_connection = IdempotentPortalConnection(
+            connection,
+            duplicate_resolver=duplicate_resolver,
+            retry_delay=0,
+            )
+
+        with assert_raises(HubspotClientError):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                )
+
+        eq_(1, connection.request_count)
+        eq_([], duplicate_resolver.calls)
+
+    def test_max_attempts(self):
+        connection = _FlakyPortalConnection([ConnectionError()] * 3)
+        idempotent_connection = IdempotentPortalConnection(
+            connection,
+            max_attempts=2,
+            duplicate_resolver=_DuplicateResolver(None, None),
+            retry_delay=0,
+            )
+
+        with assert_raises(ConnectionError):
+            idempotent_connection.send_post_request(
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                )
+
+        eq_(2, connection.request_count)
+
+    def test_other_requests(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization=_STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+        connection = MockPortalConnection(lambda: [api_call])
+
+        with IdempotentPortalConnection(connection) as idempotent_connection:
+            response_body_deserialization = \
+                idempotent_connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+
+
+class TestOutcomeStore(object):
+
+    def test_least_recently_used_outcome_discarded(self):
+        outcome_store = OutcomeStore(2)
+        outcome_store.set('a', 1)
+        outcome_store.set('b', 2)
+        outcome_store.get('a')
+
+        outcome_store.set('c', 3)
+
+        eq_(2, len(outcome_store))
+        ok_('a' in outcome_store)
+        assert_false('b' in outcome_store)
+        eq_(3, outcome_store.get('c'))
+
+    def test_missing_outcome(self):
+        outcome_store = OutcomeStore()
+
+        with assert_raises(KeyError):
+            outcome_store.get('a')
+
+
+class _FlakyPortalConnection(object):
+
+    def __init__(self, exceptions=()):
+        super(_FlakyPortalConnection, self).__init__()
+
+        self._exceptions = list(exceptions)
+        self.request_count = 0
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        self.request_count += 1
+        if self._exceptions:
+            raise self._exceptions.pop(0)
+        return _STUB_RESPONSE_BODY_DESERIALIZATION
+
+
+class _DuplicateResolver(object):
+
+    def __init__(self, *response_body_deserializations):
+        super(_DuplicateResolver, self).__init__()
+
+        self._response_body_deserializations = \
+            list(response_body_deserializations)
+        self.calls = []
+
+    def __call__(self, connection, url_path, body_deserialization):
+        self.calls.append((connection, url_path, body_deserialization))
+        return self._response_body_deserializations.pop(0)
@@ -0,0 +1,282 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.metrics import LatencyHistogram
+from hubspot.connection.metrics import MetricsRegistry
+from hubspot.connection.metrics import template_url_path
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+
+from tests.utils import assert_approximately_equal
+from tests.utils import get_uuid4_str
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/contact/vid/123/profile'
+
+_STUB_URL_PATH_TEMPLATE = '/contacts/v1/contact/vid/{id}/profile'
+
+
+class TestURLPathTemplating(object):
+
+    def test_numeric_identifier(self):
+        eq_(_STUB_URL_PATH_TEMPLATE, template_url_path(_STUB_URL_PATH))
+
+    def test_uuid(self):
+        url_path_template = template_url_path(
+            '/forms/v2/forms/a5b6c7d8-1234-4a5b-9c8d-0123456789ab',
+            )
+        eq_('/forms/v2/forms/{id}', url_path_template)
+
+    def test_email_address(self):
+        url_path_template = template_url_path(
+            '/contacts/v1/contact/email/jane@example.com/profile',
+            )
+        eq_('/contacts/v1/contact/email/{email}/profile', url_path_template)
+
+    def test_no_identifiers(self):
+        url_path = '/contacts/v1/lists/all/contacts/all'
+        eq_(url_path, template_url_path(url_path))
+
+
+class TestLatencyHistogram(object):
+
+    def test_no_latencies(self):
+        histogram = LatencyHistogram()
+
+        eq_(0, histogram.count)
+        eq_(None, histogram.get_percentile(50))
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for latency_in_milliseconds in range(1, 101):
+            histogram.record(latency_in_milliseconds / 1000.0)
+
+        eq_(100, histogram.count)
+        assert_approximately_equal(0.05, histogram.get_percentile(50))
+        assert_approximately_equal(0.095, histogram.get_percentile(95))
+        assert_approximately_equal(0.1, histogram.get_percentile(100))
+        assert_approximately_equal(5.05, histogram.total)
+
+    def test_small_latencies(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.000042)
+
+        eq_(0.000042, histogram.get_percentile(50))
+
+    def test_latency_beyond_maximum(self):
+        histogram = LatencyHistogram(max_latency=1)
+        histogram.record(5)
+
+        eq_(1, histogram.get_percentile(100))
+
+    def test_copy(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.1)
+
+        histogram_copy = histogram.copy()
+        histogram.record(0.2)
+
+        eq_(1, histogram_copy.count)
+        assert_approximately_equal(0.1, histogram_copy.get_percentile(100))
+
+
+class TestMetricsRegistry(object):
+
+    def test_successful_request(self):
+        registry = MetricsRegistry()
+        registry.record_request('GET', _STUB_URL_PATH, 0.1, 200, None, 0, 10)
+        registry.record_request('GET', '/contacts/v1/contact/vid/456/profile')
+
+        endpoint_metrics, = registry.get_snapshot()
+        eq_('GET', endpoint_metrics.http_method)
+        eq_(_STUB_URL_PATH_TEMPLATE, endpoint_metrics.url_path_template)
+        eq_(2, endpoint_metrics.request_count)
+        eq_({'2xx': 1}, endpoint_metrics.counts_by_status_class)
+        eq_({}, endpoint_metrics.counts_by_exception_name)
+        eq_(0, endpoint_metrics.request_byte_count)
+        eq_(10, endpoint_metrics.response_byte_count)
+        eq_(1, endpoint_metrics.latency_histogram.count)
+
+    def test_failed_request(self):
+        registry = MetricsRegistry()
+        exception = HubspotClientError('Error', get_uuid4_str())
+        registry.record_request(
+            'POST',
+            '/contacts/v1/contact',
+            0.1,
+            400,
+            exception,
+            5,
+            )
+
+        endpoint_metrics, = registry.get_snapshot()
+        eq_({'4xx': 1}, endpoint_metrics.counts_by_status_class)
+        eq_(
+            {'HubspotClientError': 1},
+            endpoint_metrics.counts_by_exception_name,
+            )
+        eq_(5, endpoint_metrics.request_byte_count)
+
+    def test_methods_counted_separately(self):
+        registry = MetricsRegistry()
+        registry.record_request('GET', _STUB_URL_PATH)
+        registry.record_request('DELETE', _STUB_URL_PATH)
+
+        snapshot = registry.get_snapshot()
+
+        eq_(
+            ['DELETE', 'GET'],
+            [endpoint_metrics.http_method for endpoint_metrics in snapshot],
+            )
+
+    def test_snapshot_isolation(self):
+        registry = MetricsRegistry()
+        registry.record_request('GET', _STUB_URL_PATH, 0.1, 200)
+
+        endpoint_metrics, = registry.get_snapshot()
+        registry.record_request('GET', _STUB_URL_PATH, 0.1, 200)
+
+        eq_(1, endpoint_metrics.request_count)
+        eq_({'2xx': 1}, endpoint_metrics.counts_by_status_class)
+        eq_(1, endpoint_metrics.latency_histogram.count)
+
+    def test_endpoints_beyond_maximum(self):
+        registry = MetricsRegistry(max_endpoint_count=1)
+        registry.record_request('GET', '/a')
+        registry.record_request('GET', '/b')
+        registry.record_request('GET', '/c')
+
+        snapshot = registry.get_snapshot()
+
+        eq_(
+            [('/a', 1), ('{other}', 2)],
+            [(m.url_path_template, m.request_count) for m in snapshot],
+            )
+
+    def test_latency_percentile(self):
+        registry = MetricsRegistry()
+        registry.record_request('GET', _STUB_URL_PATH, 0.1, 200)
+
+        latency = registry.get_latency_percentile(
+            'GET',
+            '/contacts/v1/contact/vid/456/profile',
+            95,
+            )
+
+        assert_approximately_equal(0.1, latency)
+        eq_(None, registry.get_latency_percentile('GET', '/other', 95))
+
+    def test_prometheus_text(self):
+        registry = MetricsRegistry()
+        exception = HubspotClientError('Error', get_uuid4_str())
+        registry.record_request(
+            'GET',
+            _STUB_URL_PATH,
+            0.1,
+            400,
+            exception,
+            0,
+            7,
+            )
+
+        prometheus_text = registry.export_prometheus_text()
+
+        labels = 'method="GET",endpoint="{}"'.format(_STUB_URL_PATH_TEMPLATE)
+        expected_lines = [
+            '# TYPE hubspot_requests_total counter',
+            'hubspot_requests_total{%s,status_class="4xx"} 1' % labels,
+            'hubspot_request_exceptions_total'
+                '{%s,exception="HubspotClientError"} 1' % labels,
+            'hubspot_request_bytes_total{%s} 0' % labels,
+            'hubspot_response_bytes_total{%s} 7' % labels,
+            '# TYPE hubspot_request_latency_seconds summary',
+            'hubspot_request_latency_seconds_sum{%s} 0.1' % labels,
+            'hubspot_request_latency_seconds_count{%s} 1' % labels,
+            ]
+        prometheus_text_lines = prometheus_text.splitlines()
+        for expected_line in expected_lines:
+            ok_(expected_line in prometheus_text_lines, expected_line)
+        ok_(prometheus_text.endswith('\n'))
+
+    def test_prometheus_label_escaping(self):
+        registry = MetricsRegistry(url_path_templater=lambda url_path: url_path)
+        registry.record_request('GET', '/a"b\\c')
+
+        prometheus_text = registry.export_prometheus_text()
+
+        ok_('endpoint="/a\\"b\\\\c"' in prometheus_text)
+
+
+class TestPortalConnectionMetrics(object):
+
+    def test_successful_request(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'vid': 123},
+            )
+        registry = MetricsRegistry()
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                metrics_registry=registry,
+                )
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        endpoint_metrics, = registry.get_snapshot()
+        eq_(_STUB_URL_PATH_TEMPLATE, endpoint_metrics.url_path_template)
+        eq_({'2xx': 1}, endpoint_metrics.counts_by_status_class)
+        eq_(1, endpoint_metrics.latency_histogram.count)
+        ok_(0 < endpoint_metrics.response_byte_count)
+
+    def test_failed_request(self):
+        request_body_deserialization = {'properties': []}
+        api_call = UnsuccessfulAPICall(
+            '/contacts/v1/contact',
+            'POST',
+            request_body_deserialization=request_body_deserialization,
+            exception=HubspotClientError('Error', get_uuid4_str()),
+            )
+        registry = MetricsRegistry()
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                metrics_registry=registry,
+                )
+            with connection:
+                with assert_raises(HubspotClientError):
+                    connection.send_post_request(
+                        '/contacts/v1/contact',
+                        request_body_deserialization,
+                        )
+
+        endpoint_metrics, = registry.get_snapshot()
+        eq_({'4xx': 1}, endpoint_metrics.counts_by_status_class)
+        eq_(
+            {'HubspotClientError': 1},
+            endpoint_metrics.counts_by_exception_name,
+            )
+        ok_(0 < endpoint_metrics.request_byte_count)
@@ -0,0 +1,210 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from socket import socket
+
+from nose.tools import eq_
+
+from hubspot.connection.pooling import DNSCache
+from hubspot.connection.pooling import PoolStatistics
+from hubspot.connection.pooling import _ConnectionStatistics
+from hubspot.connection.pooling import _HTTPConnectionPool
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+_STUB_API_CALL = SuccessfulAPICall(
+    _STUB_URL_PATH,
+    'GET',
+    response_body_deserialization={'contacts': []},
+    )
+
+
+class TestDNSCache(object):
+
+    def test_address(self):
+        dns_cache = DNSCache()
+
+        eq_('127.0.0.1', dns_cache.resolve('127.0.0.1'))
+
+    def test_cached_address(self):
+        dns_cache = _CountingDNSCache()
+
+        eq_('127.0.0.1', dns_cache.resolve('example.com'))
+        eq_('127.0.0.1', dns_cache.resolve('example.com'))
+
+        eq_(['example.com'], dns_cache.looked_up_hosts)
+
+    def test_expired_address(self):
+        dns_cache = _CountingDNSCache(ttl=0)
+
+        dns_cache.resolve('example.com')
+        dns_cache.resolve('example.com')
+
+        eq_(['example.com', 'example.com'], dns_cache.looked_up_hosts)
+
+    def test_clearing(self):
+        dns_cache = _CountingDNSCache()
+
+        dns_cache.resolve('example.com')
+        dns_cache.clear()
+        dns_cache.resolve('example.com')
+
+        eq_(2, len(dns_cache.looked_up_hosts))
+
+
+class TestWarmUp(object):
+
+    def test_connections_opened(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'contacts': []},
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            connection = make_portal_connection(server.api_url)
+            with connection:
+                eq_(3, connection.warm_up(3))
+                eq_(3, connection.warm_up(3))
+
+                connection.send_get_request(_STUB_URL_PATH)
+
+    def test_connections_beyond_pool_size(self):
+        with MockHubspotServer() as server:
+            connection = make_portal_connection(server.api_url)
+            with connection:
+                eq_(10, connection.warm_up(20))
+
+    def test_unreachable_server(self):
+        with MockHubspotServer() as server:
+            api_url = server.api_url
+
+        connection = make_portal_connection(api_url)
+        with connection:
+            eq_(0, connection.warm_up(2))
+
+    def test_dns_cache(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'contacts': []},
+            )
+        dns_cache = _CountingDNSCache()
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            api_url = server.api_url.replace('127.0.0.1', 'hubspot.invalid')
+            connection = make_portal_connection(api_url, dns_cache=dns_cache)
+            with connection:
+                eq_(3, connection.warm_up(3))
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(['hubspot.invalid'], dns_cache.looked_up_hosts)
+
+
+class TestIdleConnections(object):
+
+    def test_reused_connection(self):
+        with MockHubspotServer(lambda: [_STUB_API_CALL] * 2) as server:
+            connection = make_portal_connection(server.api_url)
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+                connection.send_get_request(_STUB_URL_PATH)
+
+                pool_statistics = connection.get_pool_statistics()
+
+        eq_(PoolStatistics(1, 1, 0, 0), pool_statistics)
+
+    def test_connection_idle_for_too_long(self):
+        with MockHubspotServer(lambda: [_STUB_API_CALL] * 2) as server:
+            connection = \
+                make_portal_connection(server.api_url, max_idle_age=0)
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+                connection.send_get_request(_STUB_URL_PATH)
+
+                pool_statistics = connection.get_pool_statistics()
+
+        eq_(PoolStatistics(0, 1, 1, 0), pool_statistics)
+
+    def test_connection_closed_by_server(self):
+        server_socket = socket()
+        server_socket.bind(('127.0.0.1', 0))
+        server_socket.listen(1)
+        connection_statistics = _ConnectionStatistics()
+        connection_pool = _HTTPConnectionPool(
+            *server_socket.getsockname(),
+            maxsize=1
+            )
+        connection_pool.connection_statistics = connection_statistics
+
+        try:
+            connection = connection_pool._get_conn()
+            connection.connect()
+            connection_pool._put_conn(connection)
+
+            server_connection_socket, _ = server_socket.accept()
+            server_connection_socket.close()
+
+            connection = connection_pool._get_conn()
+        finally:
+            connection_pool.close()
+            server_socket.close()
+
+        eq_(None, connection.sock)
+        eq_(PoolStatistics(0, 1, 1, 0), connection_statistics.get_snapshot())
+
+    def test_reaping(self):
+        with MockHubspotServer(lambda: [_STUB_API_CALL] * 2) as server:
+            connection = \
+                make_portal_connection(server.api_url, max_idle_age=0)
+            with connection:
+                eq_(2, connection.warm_up(2))
+                connection.close_idle_connections()
+                connection.send_get_request(_STUB_URL_PATH)
+                connection.send_get_request(_STUB_URL_PATH)
+
+                pool_statistics = connection.get_pool_statistics()
+
+        eq_(PoolStatistics(0, 3, 1, 2), pool_statistics)
+
+    def test_reaping_without_maximum_idle_age(self):
+        with MockHubspotServer(lambda: [_STUB_API_CALL]) as server:
+            connection = make_portal_connection(server.api_url)
+            with connection:
+                connection.warm_up(1)
+                connection.close_idle_connections()
+                connection.send_get_request(_STUB_URL_PATH)
+
+                pool_statistics = connection.get_pool_statistics()
+
+        eq_(PoolStatistics(1, 1, 0, 0), pool_statistics)
+
+
+class _CountingDNSCache(DNSCache):
+
+    def __init__(self, *args, **kwargs):
+        super(_CountingDNSCache, self).__init__(*args, **kwargs)
+
+        self.looked_up_hosts = []
+
+    def _look_up_address(self, host, port):
+        self.looked_up_hosts.append(host)
+        return '127.0.0.1'
@@ -0,0 +1,293 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from logging import getLogger
+from logging import Handler
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.projection import CONTACT_PROPERTY_PROJECTION
+from hubspot.connection.projection import PropertyProjection
+from hubspot.connection.projection import ProjectingPortalConnection
+
+
+_CONTACT_URL_PATH = '/contacts/v1/contact/vid/1/profile'
+
+_CONTACTS_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+
+class TestDeclaredProperties(object):
+
+    def test_matching_request(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(property_names=['lastname'])
+
+        with ProjectingPortalConnection(connection, [projection]) as \
+                projecting_connection:
+            projecting_connection.send_get_request(
+                _CONTACT_URL_PATH,
+                {'showListMemberships': 'false'},
+                )
+
+        eq_(
+            [(
+                _CONTACT_URL_PATH,
+                {'showListMemberships': 'false', 'property': ['lastname']},
+                )],
+            connection.requests,
+            )
+
+    def test_explicit_properties(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(property_names=['lastname'])
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        projecting_connection.send_get_request(
+            _CONTACT_URL_PATH,
+            {'property': ['email']},
+            )
+
+        eq_([(_CONTACT_URL_PATH, {'property': ['email']})], connection.requests)
+
+    def test_non_matching_request(self):
+        connection = _RecordingConnection({})
+        projection = _make_contact_projection(property_names=['lastname'])
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        projecting_connection.send_get_request('/properties/v1/contacts/')
+
+        eq_([('/properties/v1/contacts/', None)], connection.requests)
+
+    def test_no_properties(self):
+        connection = _RecordingConnection(_make_contact())
+        projecting_connection = ProjectingPortalConnection(connection)
+
+        projecting_connection.send_get_request(_CONTACT_URL_PATH)
+
+        eq_([(_CONTACT_URL_PATH, None)], connection.requests)
+
+    def test_untracked_reads(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(property_names=['lastname'])
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        contact['properties']['email']
+
+        eq_(
+            frozenset(['lastname']),
+            projecting_connection.get_property_names(projection),
+            )
+
+
+class TestLearntProperties(object):
+
+    def test_learning(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        eq_('a@example.com', contact['properties']['email']['value'])
+        ok_('lastname' in contact['properties'])
+        contact['properties'].get('company')
+
+        projecting_connection.send_get_request(_CONTACT_URL_PATH)
+
+        eq_(
+            [
+                (_CONTACT_URL_PATH, None),
+                (
+                    _CONTACT_URL_PATH,
+                    {'property': ['company', 'email', 'lastname']},
+                    ),
+                ],
+            connection.requests,
+            )
+
+    def test_declared_and_learnt_properties(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(
+            property_names=['lastname'],
+            learning_request_count=1,
+            )
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        contact['properties']['email']
+
+        eq_(
+            frozenset(['email', 'lastname']),
+            projecting_connection.get_property_names(projection),
+            )
+
+    def test_reads_after_learning(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        contact['properties']['email']
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        contact['properties'].get('lastname')
+
+        projecting_connection.send_get_request(_CONTACT_URL_PATH)
+
+        eq_(
+            {'property': ['email', 'lastname']},
+            connection.requests[-1][1],
+            )
+
+    def test_unrequested_property_warning(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        contact['properties']['email']
+
+        with _LogRecorder() as log_recorder:
+            contact = \
+                projecting_connection.send_get_request(_CONTACT_URL_PATH)
+            contact['properties']['email']
+            ok_('lastname' in contact['properties'])
+            contact['properties'].get('lastname')
+
+        warning_message, = log_recorder.messages
+        ok_("'lastname'" in warning_message)
+        ok_(_CONTACT_URL_PATH in warning_message)
+        eq_(
+            frozenset(['email', 'lastname']),
+            projecting_connection.get_property_names(projection),
+            )
+
+    def test_no_warning_while_learning(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        with _LogRecorder() as log_recorder:
+            contact = \
+                projecting_connection.send_get_request(_CONTACT_URL_PATH)
+            contact['properties']['email']
+
+        eq_([], log_recorder.messages)
+
+    def test_iteration(self):
+        connection = _RecordingConnection(_make_contact())
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contact = projecting_connection.send_get_request(_CONTACT_URL_PATH)
+        eq_(
+            ['email', 'lastname'],
+            sorted(contact['properties'].keys()),
+            )
+
+        eq_(
+            frozenset(),
+            projecting_connection.get_property_names(projection),
+            )
+
+    def test_collection(self):
+        response_body_deserialization = {
+            'contacts': [_make_contact(), _make_contact()],
+            'has-more': False,
+            }
+        connection = _RecordingConnection(response_body_deserialization)
+        projection = _make_contact_projection(learning_request_count=1)
+        projecting_connection = \
+            ProjectingPortalConnection(connection, [projection])
+
+        contacts = projecting_connection.send_get_request(_CONTACTS_URL_PATH)
+        contacts['contacts'][0]['properties']['email']
+        contacts['contacts'][1]['properties']['lastname']
+
+        eq_(
+            frozenset(['email', 'lastname']),
+            projecting_connection.get_property_names(projection),
+            )
+
+
+def test_unknown_projection():
+    projecting_connection = ProjectingPortalConnection(_RecordingConnection({}))
+
+    with assert_raises(ValueError):
+        projecting_connection.get_property_names(_make_contact_projection())
+
+
+class _RecordingConnection(object):
+
+    def __init__(self, response_body_deserialization):
+        super(_RecordingConnection, self).__init__()
+
+        self._response_body_deserialization = response_body_deserialization
+        self.requests = []
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        self.requests.append((url_path, query_string_args))
+        return self._response_body_deserialization
+
+
+class _LogRecorder(Handler):
+
+    def __init__(self):
+        super(_LogRecorder, self).__init__()
+
+        self.messages = []
+
+    def __enter__(self):
+        getLogger('hubspot.connection.projection').addHandler(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        getLogger('hubspot.connection.projection').removeHandler(self)
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def _make_contact_projection(**kwargs):
+    projection = PropertyProjection(
+        CONTACT_PROPERTY_PROJECTION.url_path_pattern,
+        CONTACT_PROPERTY_PROJECTION.query_string_arg_name,
+        **kwargs
+        )
+    return projection
+
+
+def _make_contact():
+    contact = {
+        'vid': 1,
+        'properties': {
+            'email': {'value': 'a@example.com'},
+            'lastname': {'value': 'Smith'},
+            },
+        }
+    return contact
@@ -0,0 +1,353 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from threading import Lock
+from threading import Thread
+from time import sleep
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotRequestRejectedError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.proxy import ProxyServer
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import get_uuid4_str
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+_STUB_RESPONSE_BODY_DESERIALIZATION = {'contacts': [], 'has-more': False}
+
+
+class TestProxyServer(object):
+
+    def test_get_request(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            {'count': ['100']},
+            response_body_deserialization=_STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+
+        with MockHubspotServer(lambda: [api_call]) as server:
+            upstream_connection = make_portal_connection(server.api_url)
+            with ProxyServer(upstream_connection) as proxy_server:
+                connection = make_portal_connection(proxy_server.api_url)
+                with connection:
+                    response_body_deserialization = \
+                        connection.send_get_request(
+                            _STUB_URL_PATH,
+                            {'count': 100},
+                            )
+
+        eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
+
+    def test_credentials_not_forwarded(self):
+        upstream_connection = _StubConnection()
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_([('GET', _STUB_URL_PATH, {})], upstream_connection.requests)
+
+    def test_post_request(self):
+        upstream_connection = _StubConnection()
+        request_body_deserialization = {'properties': []}
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                connection.send_post_request(
+                    '/contacts/v1/contact',
+                    request_body_deserialization,
+                    )
+
+        eq_(
+            [('POST', '/contacts/v1/contact', request_body_deserialization)],
+            upstream_connection.requests,
+            )
+
+    def test_put_request(self):
+        upstream_connection = _StubConnection()
+        request_body_deserialization = {'properties': []}
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                connection.send_put_request(
+                    '/contacts/v1/contact/vid/1/profile',
+                    request_body_deserialization,
+                    )
+
+        eq_(
+            [(
+                'PUT',
+                '/contacts/v1/contact/vid/1/profile',
+                request_body_deserialization,
+                )],
+            upstream_connection.requests,
+            )
+
+    def test_delete_request(self):
+        upstream_connection = _StubConnection()
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                response_body_deserialization = \
+                    connection.send_delete_request('/contacts/v1/contact/1')
+
+        eq_(None, response_body_deserialization)
+        eq_(
+            [('DELETE', '/contacts/v1/contact/1', None)],
+            upstream_connection.requests,
+            )
+
+    def test_client_error(self):
+        request_id = get_uuid4_str()
+        upstream_connection = _StubConnection(
+            exception=HubspotClientError('Invalid property', request_id),
+            )
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotClientError, exception.__class__)
+        eq_('Invalid property', str(exception))
+        eq_(request_id, exception.request_id)
+
+    def test_client_error_status(self):
+        upstream_exception = HubspotClientError('Not found', get_uuid4_str())
+        upstream_exception.http_status_code = 404
+        upstream_connection = _StubConnection(exception=upstream_exception)
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotClientError, exception.__class__)
+        eq_(404, exception.http_status_code)
+
+    def test_rate_limit_error(self):
+        upstream_connection = _StubConnection(
+            exception=HubspotRateLimitError('Slow down', get_uuid4_str(), 2),
+            )
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotRateLimitError, exception.__class__)
+        eq_(2, exception.retry_after)
+
+    def test_error_response_headers(self):
+        upstream_exception = \
+            HubspotRateLimitError('Slow down', get_uuid4_str(), 2)
+        upstream_exception.response_headers = {
+            'retry-after': '2',
+            'x-hubspot-ratelimit-secondly-remaining': '0',
+            }
+        upstream_connection = _StubConnection(exception=upstream_exception)
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(2, exception.retry_after)
+        eq_('2', exception.response_headers['retry-after'])
+        eq_(
+            '0',
+            exception.response_headers[
+                'x-hubspot-ratelimit-secondly-remaining'
+                ],
+            )
+
+    def test_rate_limit_headers(self):
+        rate_limit_headers = {'x-hubspot-ratelimit-daily-remaining': '9000'}
+        upstream_connection = \
+            _StubConnection(rate_limit_headers=rate_limit_headers)
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(rate_limit_headers, connection.get_rate_limit_headers())
+
+    def test_rejected_request(self):
+        upstream_connection = _StubConnection(
+            exception=HubspotRequestRejectedError('Daily quota exhausted'),
+            )
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotRateLimitError, exception.__class__)
+        eq_('Daily quota exhausted', str(exception))
+
+    def test_server_error(self):
+        upstream_connection = _StubConnection(
+            exception=HubspotServerError('Service Unavailable', 503),
+            )
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotServerError, exception.__class__)
+        eq_(503, exception.http_status_code)
+
+    def test_unreachable_hubspot(self):
+        upstream_connection = _StubConnection(exception=IOError())
+
+        exception = _get_exception_from_proxy(upstream_connection)
+
+        eq_(HubspotServerError, exception.__class__)
+        eq_(502, exception.http_status_code)
+
+
+class TestRequestCoalescing(object):
+
+    def test_concurrent_identical_requests(self):
+        upstream_connection = _StubConnection(latency=0.2)
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            response_body_deserializations = _send_get_requests_concurrently(
+                proxy_server.api_url,
+                [{'count': 1}, {'count': 1}],
+                )
+
+        eq_(1, len(upstream_connection.requests))
+        eq_(
+            [_STUB_RESPONSE_BODY_DESERIALIZATION] * 2,
+            response_body_deserializations,
+            )
+
+    def test_concurrent_different_requests(self):
+        upstream_connection = _StubConnection(latency=0.2)
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            _send_get_requests_concurrently(
+                proxy_server.api_url,
+                [{'count': 1}, {'count': 2}],
+                )
+
+        eq_(2, len(upstream_connection.requests))
+
+    def test_consecutive_requests(self):
+        upstream_connection = _StubConnection()
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            connection = make_portal_connection(proxy_server.api_url)
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(2, len(upstream_connection.requests))
+
+    def test_failed_request(self):
+        upstream_connection = _StubConnection(
+            latency=0.2,
+            exception=HubspotServerError('Service Unavailable', 503),
+            )
+
+        with ProxyServer(upstream_connection) as proxy_server:
+            response_body_deserializations = _send_get_requests_concurrently(
+                proxy_server.api_url,
+                [{'count': 1}, {'count': 1}],
+                )
+
+        eq_(1, len(upstream_connection.requests))
+        eq_(
+            [HubspotServerError, HubspotServerError],
+            [type(result) for result in response_body_deserializations],
+            )
+
+
+class _StubConnection(object):
+
+    def __init__(self, latency=0, exception=None, rate_limit_headers=None):
+        super(_StubConnection, self).__init__()
+
+        self._latency = latency
+        self._exception = exception
+        self._rate_limit_headers = rate_limit_headers or {}
+
+        self._lock = Lock()
+        self.requests = []
+
+    def send_get_request(self, url_path, query_string_args=None, priority=None):
+        return self._send_request('GET', url_path, query_string_args)
+
+    def send_post_request(self, url_path, body_deserialization, priority=None):
+        return self._send_request('POST', url_path, body_deserialization)
+
+    def send_put_request(self, url_path, body_deserialization, priority=None):
+        return self._send_request('PUT', url_path, body_deserialization)
+
+    def send_delete_request(self, url_path, priority=None):
+        return self._send_request('DELETE', url_path, None)
+
+    def get_rate_limit_headers(self):
+        return self._rate_limit_headers
+
+    def _send_request(self, http_method, url_path, request_data):
+        with self._lock:
+            self.requests.append((http_method, url_path, request_data))
+
+        sleep(self._latency)
+        if self._exception:
+            raise self._exception
+
+        if http_method == 'DELETE':
+            response_body_deserialization = None
+        else:
+            response_body_deserialization = \
+                _STUB_RESPONSE_BODY_DESERIALIZATION
+        return response_body_deserialization
+
+
+def _get_exception_from_proxy(upstream_connection):
+    with ProxyServer(upstream_connection) as proxy_server:
+        connection = make_portal_connection(proxy_server.api_url)
+        with connection:
+            with assert_raises(Exception) as context_manager:
+                connection.send_get_request(_STUB_URL_PATH)
+    return context_manager.exception
+
+
+def _send_get_requests_concurrently(api_url, query_string_args_list):
+    results = [None] * len(query_string_args_list)
+
+    def send_get_request(request_index, query_string_args):
+        with make_portal_connection(api_url) as connection:
+            try:
+                results[request_index] = connection.send_get_request(
+                    _STUB_URL_PATH,
+                    query_string_args,
+                    )
+            except Exception as exception:
+                results[request_index] = exception
+
+    threads = [
+        Thread(target=send_get_request, args=(request_index, query_string_args))
+        for request_index, query_string_args
+        in enumerate(query_string_args_list)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
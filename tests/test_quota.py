@@ -0,0 +1,300 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import PRIORITY_CLASS_INTERACTIVE
+from hubspot.connection.concurrency import PRIORITY_CLASS_NORMAL
+from hubspot.connection.concurrency import PriorityClass
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.concurrency import RequestScheduler
+from hubspot.connection.exc import HubspotRequestRejectedError
+from hubspot.connection.quota import DailyQuota
+from hubspot.connection.testing import MockHubspotServer
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import assert_approximately_equal
+from tests.utils import make_portal_connection
+
+
+_STUB_URL_PATH = '/contacts/v1/lists/all/contacts/all'
+
+_STUB_MIDNIGHT_TIME = 1400000000 - 1400000000 % 86400
+
+_BULK_PRIORITY = RequestPriority(PRIORITY_CLASS_BULK)
+
+_INTERACTIVE_PRIORITY = RequestPriority(PRIORITY_CLASS_INTERACTIVE)
+
+
+class TestDailyQuota(object):
+
+    def test_unknown_remaining_calls(self):
+        quota = _ClockedDailyQuota()
+        quota.acquire(_BULK_PRIORITY)
+
+        eq_(None, quota.remaining_count)
+        eq_(None, quota.get_available_count())
+        eq_(1, quota.get_consumed_count())
+
+    def test_response_headers(self):
+        quota = _ClockedDailyQuota()
+        quota.update(_make_response_headers(1000, 900))
+
+        eq_(1000, quota.daily_limit)
+        eq_(900, quota.remaining_count)
+
+    def test_response_without_headers(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.update({})
+
+        eq_(1000, quota.remaining_count)
+
+    def test_malformed_response_headers(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        response_headers = {
+            'X-HubSpot-RateLimit-Daily': 'unlimited',
+            'X-HubSpot-RateLimit-Daily-Remaining': '42',
+            }
+
+        quota.update(response_headers)
+
+        eq_(1000, quota.daily_limit)
+        eq_(42, quota.remaining_count)
+
+    def test_consumption(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.acquire(RequestPriority(PRIORITY_CLASS_BULK, 'export'))
+        quota.acquire()
+
+        eq_(998, quota.remaining_count)
+        eq_(1, quota.get_consumed_count('export'))
+        eq_(1, quota.get_consumed_count())
+
+    def test_refund(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        priority = RequestPriority(PRIORITY_CLASS_BULK, 'export')
+        quota.acquire(priority)
+
+        quota.refund(priority)
+
+        eq_(1000, quota.remaining_count)
+        eq_(0, quota.get_consumed_count('export'))
+
+    def test_refund_after_reset(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.acquire()
+        quota.current_time += 86400
+
+        quota.refund()
+
+        eq_(1000, quota.remaining_count)
+        eq_(0, quota.get_consumed_count())
+
+    def test_exhaustion(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.update(_make_response_headers(1000, 0))
+
+        with assert_raises(HubspotRequestRejectedError):
+            quota.acquire(_INTERACTIVE_PRIORITY)
+
+    def test_reservation(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.reserve_calls('sync', 100)
+        quota.update(_make_response_headers(1000, 101))
+
+        eq_(1, quota.get_available_count('export'))
+        eq_(101, quota.get_available_count('sync'))
+
+        quota.acquire(RequestPriority(PRIORITY_CLASS_INTERACTIVE, 'export'))
+        with assert_raises(HubspotRequestRejectedError):
+            quota.acquire(RequestPriority(PRIORITY_CLASS_INTERACTIVE, 'export'))
+        quota.acquire(RequestPriority(PRIORITY_CLASS_INTERACTIVE, 'sync'))
+
+    def test_reservation_consumption(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.reserve_calls('sync', 10)
+        for _ in range(4):
+            quota.acquire(RequestPriority(PRIORITY_CLASS_INTERACTIVE, 'sync'))
+
+        eq_(996, quota.get_available_count('sync'))
+        eq_(990, quota.get_available_count('export'))
+
+    def test_share_reservation(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.reserve_share('sync', 0.25)
+
+        eq_(750, quota.get_available_count('export'))
+
+    def test_reservation_cancellation(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.reserve_share('sync', 0.25)
+        quota.cancel_reservation('sync')
+
+        eq_(1000, quota.get_available_count('export'))
+
+    def test_bulk_request_rejection(self):
+        quota = _ClockedDailyQuota(daily_limit=1000, rejection_ratio=0.05)
+        quota.update(_make_response_headers(1000, 50))
+
+        with assert_raises(HubspotRequestRejectedError):
+            quota.acquire(_BULK_PRIORITY)
+        quota.acquire(_INTERACTIVE_PRIORITY)
+
+    def test_bulk_request_pacing(self):
+        quota = _ClockedDailyQuota(daily_limit=1000, slowdown_ratio=0.2)
+        quota.current_time = _STUB_MIDNIGHT_TIME + 86400 - 0.2
+        quota.update(_make_response_headers(1000, 200))
+
+        quota.acquire(_BULK_PRIORITY)
+        eq_([], quota.sleeps)
+
+        quota.acquire(_BULK_PRIORITY)
+        eq_(1, len(quota.sleeps))
+        assert_approximately_equal(
+            0.2 / 200,
+            quota.sleeps[0],
+            relative_tolerance=0.01,
+            )
+
+    def test_unthrottled_request_near_exhaustion(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.update(_make_response_headers(1000, 100))
+
+        quota.acquire(_INTERACTIVE_PRIORITY)
+        quota.acquire(_INTERACTIVE_PRIORITY)
+
+        eq_([], quota.sleeps)
+
+    def test_reset(self):
+        quota = _ClockedDailyQuota(daily_limit=1000)
+        quota.update(_make_response_headers(1000, 10))
+        quota.acquire()
+
+        quota.current_time = _STUB_MIDNIGHT_TIME + 86400
+
+        eq_(1000, quota.get_available_count())
+        eq_(0, quota.get_consumed_count())
+        eq_(_STUB_MIDNIGHT_TIME + 2 * 86400, quota.reset_time)
+
+    def test_reset_time_in_other_time_zone(self):
+        quota = _ClockedDailyQuota(utc_offset=-5 * 3600)
+
+        eq_(_STUB_MIDNIGHT_TIME + 5 * 3600, quota.reset_time)
+
+    def test_exhaustion_forecast(self):
+        quota = _ClockedDailyQuota()
+        quota.update(_make_response_headers(1000, 1000))
+        quota.current_time += 100
+        quota.update(_make_response_headers(1000, 900))
+
+        eq_(quota.current_time + 900, quota.forecast_exhaustion_time())
+
+    def test_exhaustion_forecast_after_reset(self):
+        quota = _ClockedDailyQuota()
+        quota.update(_make_response_headers(1000, 1000))
+        quota.current_time += 100
+        quota.update(_make_response_headers(1000, 999))
+
+        eq_(None, quota.forecast_exhaustion_time())
+
+    def test_exhaustion_forecast_without_consumption(self):
+        quota = _ClockedDailyQuota()
+        quota.update(_make_response_headers(1000, 1000))
+
+        eq_(None, quota.forecast_exhaustion_time())
+
+
+class TestPortalConnectionQuota(object):
+
+    def test_remaining_calls_from_responses(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'contacts': []},
+            )
+        quota = DailyQuota()
+
+        with MockHubspotServer(
+            lambda: [api_call],
+            response_headers=lambda: _make_response_headers(1000, 42).items(),
+            ) as server:
+            connection = make_portal_connection(
+                server.api_url,
+                daily_quota=quota,
+                )
+            with connection:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(1000, quota.daily_limit)
+        eq_(42, quota.remaining_count)
+
+    def test_request_rejected_by_scheduler(self):
+        quota = DailyQuota(daily_limit=1000)
+        scheduler = RequestScheduler(
+            1,
+            [PriorityClass(PRIORITY_CLASS_NORMAL, max_queue_depth=0)],
+            )
+
+        with MockHubspotServer() as server:
+            connection = make_portal_connection(
+                server.api_url,
+                daily_quota=quota,
+                request_scheduler=scheduler,
+                )
+            with connection:
+                with assert_raises(HubspotRequestRejectedError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(1000, quota.remaining_count)
+        eq_(0, quota.get_consumed_count())
+
+    def test_rejected_request(self):
+        quota = DailyQuota(daily_limit=1000)
+        quota.update(_make_response_headers(1000, 0))
+
+        with MockHubspotServer() as server:
+            connection = make_portal_connection(
+                server.api_url,
+                daily_quota=quota,
+                )
+            with connection:
+                with assert_raises(HubspotRequestRejectedError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+
+class _ClockedDailyQuota(DailyQuota):
+
+    def __init__(self, *args, **kwargs):
+        self.current_time = _STUB_MIDNIGHT_TIME + 3600
+        self.sleeps = []
+
+        super(_ClockedDailyQuota, self).__init__(*args, **kwargs)
+
+    def _get_current_time(self):
+        return self.current_time
+
+    def _sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+def _make_response_headers(daily_limit, remaining_count):
+    response_headers = {
+        'X-HubSpot-RateLimit-Daily': str(daily_limit),
+        'X-HubSpot-RateLimit-Daily-Remaining': str(remaining_count),
+        }
+    return response_headers
@@ -0,0 +1,320 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from os.path import join as join_path
+
+from nose.tools import assert_raises
+from nose.tools import eq_
+
+from hubspot.connection.exc import HubspotUnsupportedResponseError
+from hubspot.connection.sync import FileCheckpointStore
+from hubspot.connection.sync import iter_changed_records
+from hubspot.connection.sync import SQLiteCheckpointStore
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+
+from tests.utils import MemoryCheckpointStore
+from tests.utils import make_temporary_directory
+
+
+_STUB_URL_PATH = '/contacts/v1/lists/recently_updated/contacts/recent'
+
+_STUB_CHECKPOINT_NAME = 'recent-contacts'
+
+
+class TestChangedRecords(object):
+
+    def test_single_page(self):
+        api_calls = [_make_page_api_call({}, [1, 2], None)]
+        checkpoint_store = MemoryCheckpointStore()
+
+        records = self._get_records(api_calls, checkpoint_store)
+
+        eq_([{'vid': 1}, {'vid': 2}], records)
+        eq_(
+            {_STUB_CHECKPOINT_NAME: {'offsets': {}}},
+            checkpoint_store.cursors_by_checkpoint_name,
+            )
+
+    def test_multiple_pages(self):
+        api_calls = [
+            _make_page_api_call({}, [1, 2], (2, 200)),
+            _make_page_api_call(_make_offsets(2, 200), [3], None),
+            ]
+        checkpoint_store = MemoryCheckpointStore()
+
+        records = self._get_records(api_calls, checkpoint_store)
+
+        eq_([{'vid': 1}, {'vid': 2}, {'vid': 3}], records)
+        eq_(
+            [
+                (_STUB_CHECKPOINT_NAME, {'offsets': _make_offsets(2, 200)}),
+                (_STUB_CHECKPOINT_NAME, {'offsets': _make_offsets(2, 200)}),
+                ],
+            checkpoint_store.updates,
+            )
+
+    def test_extra_query_string_args(self):
+        query_string_args = {'count': 2}
+        api_calls = [
+            _make_page_api_call(query_string_args, [1, 2], (2, 200)),
+            _make_page_api_call(
+                dict(query_string_args, **_make_offsets(2, 200)),
+                [3],
+                None,
+                ),
+            ]
+
+        records = self._get_records(
+            api_calls,
+            MemoryCheckpointStore(),
+            query_string_args=query_string_args,
+            )
+
+        eq_(3, len(records))
+
+    def test_checkpoint_only_after_page_consumed(self):
+        api_calls = [_make_page_api_call({}, [1, 2], (2, 200))]
+        checkpoint_store = MemoryCheckpointStore()
+        connection = MockPortalConnection(lambda: api_calls)
+
+        records = iter_changed_records(
+            connection,
+            _STUB_URL_PATH,
+            'contacts',
+            checkpoint_store,
+            _STUB_CHECKPOINT_NAME,
+            )
+        next(records)
+        next(records)
+
+        eq_([], checkpoint_store.updates)
+
+    def test_resumption(self):
+        api_calls = [_make_page_api_call(_make_offsets(2, 200), [3], None)]
+        checkpoint_store = MemoryCheckpointStore()
+        checkpoint_store.set(
+            _STUB_CHECKPOINT_NAME,
+            {'offsets': _make_offsets(2, 200)},
+            )
+
+        records = self._get_records(api_calls, checkpoint_store)
+
+        eq_([{'vid': 3}], records)
+
+    def test_next_call_after_last_page(self):
+        checkpoint_store = MemoryCheckpointStore()
+        self._get_records(
+            [
+                _make_page_api_call({}, [1], (1, 100)),
+                _make_page_api_call(_make_offsets(1, 100), [2], (2, 200)),
+                _make_page_api_call(_make_offsets(2, 200), [], None),
+                ],
+            checkpoint_store,
+            )
+
+        records = self._get_records(
+            [_make_page_api_call(_make_offsets(2, 200), [3], None)],
+            checkpoint_store,
+            )
+
+        eq_([{'vid': 3}], records)
+        eq_(
+            {'offsets': _make_offsets(2, 200)},
+            checkpoint_store.get(_STUB_CHECKPOINT_NAME),
+            )
+
+    def test_high_water_mark(self):
+        checkpoint_store = MemoryCheckpointStore()
+        self._get_records(
+            [
+                _make_page_api_call({}, [5, 4], (4, 400)),
+                _make_page_api_call(_make_offsets(4, 400), [3], None),
+                ],
+            checkpoint_store,
+            change_time_getter=_get_contact_change_time,
+            )
+        eq_(
+            {'high_water_mark': 500},
+            checkpoint_store.get(_STUB_CHECKPOINT_NAME),
+            )
+
+        records = self._get_records(
+            [_make_page_api_call({}, [7, 6, 5, 4], (4, 400))],
+            checkpoint_store,
+            change_time_getter=_get_contact_change_time,
+            )
+
+        eq_([7, 6, 5], [record['vid'] for record in records])
+        eq_(
+            {'high_water_mark': 700},
+            checkpoint_store.get(_STUB_CHECKPOINT_NAME),
+            )
+
+    def test_high_water_mark_after_interruption(self):
+        checkpoint_store = MemoryCheckpointStore()
+        checkpoint_store.set(
+            _STUB_CHECKPOINT_NAME,
+            {
+                'offsets': _make_offsets(7, 700),
+                'high_water_mark': 500,
+                'run_high_water_mark': 800,
+                },
+            )
+
+        records = self._get_records(
+            [_make_page_api_call(_make_offsets(7, 700), [6, 5, 4], (4, 400))],
+            checkpoint_store,
+            change_time_getter=_get_contact_change_time,
+            )
+
+        eq_([6, 5], [record['vid'] for record in records])
+        eq_(
+            {'high_water_mark': 800},
+            checkpoint_store.get(_STUB_CHECKPOINT_NAME),
+            )
+
+    def test_records_changed_at_high_water_mark(self):
+        checkpoint_store = MemoryCheckpointStore()
+        checkpoint_store.set(_STUB_CHECKPOINT_NAME, {'high_water_mark': 500})
+
+        records = self._get_records(
+            [_make_page_api_call({}, [60, 52, 51, 40], (40, 400))],
+            checkpoint_store,
+            change_time_getter=lambda contact: contact['vid'] // 10 * 100,
+            )
+
+        eq_([60, 52, 51], [record['vid'] for record in records])
+        eq_(
+            {'high_water_mark': 600},
+            checkpoint_store.get(_STUB_CHECKPOINT_NAME),
+            )
+
+    def test_missing_offsets(self):
+        api_call = _make_page_api_call({}, [1], (1, 100))
+        del api_call.response_body_deserialization['vid-offset']
+        del api_call.response_body_deserialization['time-offset']
+
+        with assert_raises(HubspotUnsupportedResponseError):
+            self._get_records([api_call], MemoryCheckpointStore())
+
+    def test_checkpoint_interval(self):
+        api_calls = [
+            _make_page_api_call({}, [1], (1, 100)),
+            _make_page_api_call(_make_offsets(1, 100), [2], (2, 200)),
+            _make_page_api_call(_make_offsets(2, 200), [3], (3, 300)),
+            _make_page_api_call(_make_offsets(3, 300), [4], None),
+            ]
+        checkpoint_store = MemoryCheckpointStore()
+
+        self._get_records(api_calls, checkpoint_store, checkpoint_interval=2)
+
+        eq_(
+            [
+                (_STUB_CHECKPOINT_NAME, {'offsets': _make_offsets(2, 200)}),
+                (_STUB_CHECKPOINT_NAME, {'offsets': _make_offsets(3, 300)}),
+                ],
+            checkpoint_store.updates,
+            )
+
+    @staticmethod
+    def _get_records(api_calls, checkpoint_store, **kwargs):
+        with MockPortalConnection(lambda: api_calls) as connection:
+            records = list(iter_changed_records(
+                connection,
+                _STUB_URL_PATH,
+                'contacts',
+                checkpoint_store,
+                _STUB_CHECKPOINT_NAME,
+                **kwargs
+                ))
+        return records
+
+
+class _CheckpointStoreTestCase(object):
+
+    def test_missing_checkpoint(self):
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = self._make_checkpoint_store(directory_path)
+
+            eq_(None, checkpoint_store.get(_STUB_CHECKPOINT_NAME))
+
+    def test_checkpoint_update(self):
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = self._make_checkpoint_store(directory_path)
+            checkpoint_store.set(_STUB_CHECKPOINT_NAME, {'vidOffset': 1})
+            checkpoint_store.set(_STUB_CHECKPOINT_NAME, {'vidOffset': 2})
+            checkpoint_store.set('other', {'vidOffset': 3})
+
+            checkpoint_store = self._make_checkpoint_store(directory_path)
+            eq_({'vidOffset': 2}, checkpoint_store.get(_STUB_CHECKPOINT_NAME))
+            eq_({'vidOffset': 3}, checkpoint_store.get('other'))
+
+    def test_checkpoint_deletion(self):
+        with make_temporary_directory() as directory_path:
+            checkpoint_store = self._make_checkpoint_store(directory_path)
+            checkpoint_store.set(_STUB_CHECKPOINT_NAME, {'vidOffset': 1})
+
+            checkpoint_store.delete(_STUB_CHECKPOINT_NAME)
+            checkpoint_store.delete(_STUB_CHECKPOINT_NAME)
+
+            eq_(None, checkpoint_store.get(_STUB_CHECKPOINT_NAME))
+
+    @staticmethod
+    def _make_checkpoint_store(directory_path):
+        raise NotImplementedError()
+
+
+class TestFileCheckpointStore(_CheckpointStoreTestCase):
+
+    @staticmethod
+    def _make_checkpoint_store(directory_path):
+        return FileCheckpointStore(join_path(directory_path, 'checkpoints'))
+
+
+class TestSQLiteCheckpointStore(_CheckpointStoreTestCase):
+
+    @staticmethod
+    def _make_checkpoint_store(directory_path):
+        return SQLiteCheckpointStore(join_path(directory_path, 'checkpoints'))
+
+
+
+def _make_page_api_call(query_string_args, vids, offsets):
+    response_body_deserialization = {
+        'contacts': [{'vid': vid} for vid in vids],
+        'has-more': offsets is not None,
+        }
+    if offsets:
+        vid_offset, time_offset = offsets
+        response_body_deserialization['vid-offset'] = vid_offset
+        response_body_deserialization['time-offset'] = time_offset
+
+    api_call = SuccessfulAPICall(
+        _STUB_URL_PATH,
+        'GET',
+        query_string_args,
+        response_body_deserialization=response_body_deserialization,
+        )
+    return api_call
+
+
+def _get_contact_change_time(contact):
+    return contact['vid'] * 100
+
+
+def _make_offsets(vid_offset, time_offset):
+    return {'vidOffset': vid_offset, 'timeOffset': time_offset}
@@ -13,21 +13,39 @@
 # INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
 #
 ##############################################################################
+from os.path import join as join_path
+from threading import Thread
+from time import time
 
 from nose.tools import assert_false
 from nose.tools import assert_is_instance
+from nose.tools import assert_not_in
 from nose.tools import assert_raises
 from nose.tools import eq_
+from nose.tools import ok_
 
+from requests.exceptions import ConnectionError
 from six import text_type
 
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import RequestPriority
 from hubspot.connection.exc import HubspotAuthenticationError
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotException
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockHubspotServer
 from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import RecordingPortalConnection
+from hubspot.connection.testing import ReplayingPortalConnection
 from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnorderedMockPortalConnection
 from hubspot.connection.testing import UnsuccessfulAPICall
 
 from tests.utils import assert_raises_substring
 from tests.utils import get_uuid4_str
+from tests.utils import make_portal_connection
+from tests.utils import make_temporary_directory
 
 
 _STUB_URL_PATH = '/foo'
@@ -93,6 +111,24 @@ class TestMockPortalConnection(object):
         self._assert_sole_api_call_equals(expected_api_call, connection)
         eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
 
+    def test_serialized_request_body(self):
+        request_body_deserialization = {'foo': 'bar'}
+        expected_api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'POST',
+            request_body_deserialization=request_body_deserialization,
+            response_body_deserialization=_STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+        connection = \
+            self._make_connection_for_expected_api_call(expected_api_call)
+
+        connection.send_post_request(
+            _STUB_URL_PATH,
+            iter([b'{"foo": ', b'"bar"}']),
+            )
+
+        self._assert_sole_api_call_equals(expected_api_call, connection)
+
     def test_put_request(self):
         request_body_deserialization = {'foo': 'bar'}
         expected_api_call = SuccessfulAPICall(
@@ -127,6 +163,17 @@ class TestMockPortalConnection(object):
         self._assert_sole_api_call_equals(expected_api_call, connection)
         eq_(_STUB_RESPONSE_BODY_DESERIALIZATION, response_body_deserialization)
 
+    def test_request_priority(self):
+        connection = \
+            self._make_connection_for_expected_api_call(_STUB_API_CALL_1)
+
+        connection.send_get_request(
+            _STUB_URL_PATH,
+            priority=RequestPriority(PRIORITY_CLASS_BULK),
+            )
+
+        self._assert_sole_api_call_equals(_STUB_API_CALL_1, connection)
+
     def test_response_data_strings(self):
         """Strings in the response data are converted to unicode"""
         connection = \
@@ -188,6 +235,29 @@ class TestMockPortalConnection(object):
         eq_(exception, context_manager.exception)
         self._assert_sole_api_call_equals(expected_api_call, connection)
 
+    def test_api_calls_simulators_consumed_lazily(self):
+        api_calls_simulator = _CountingAPICallsSimulator(_STUB_API_CALL_1)
+        connection = MockPortalConnection(api_calls_simulator)
+
+        eq_(0, api_calls_simulator.api_call_count)
+
+        connection.send_get_request(_STUB_URL_PATH)
+        connection.send_get_request(_STUB_URL_PATH)
+
+        eq_(2, api_calls_simulator.api_call_count)
+        eq_([_STUB_API_CALL_1, _STUB_API_CALL_1], connection.api_calls)
+
+    def test_unexpected_request_keeps_api_call_pending(self):
+        connection = \
+            self._make_connection_for_expected_api_call(_STUB_API_CALL_1)
+
+        with assert_raises(AssertionError):
+            connection.send_post_request(_STUB_URL_PATH, None)
+
+        with assert_raises_substring(AssertionError, '1 more requests'):
+            with connection:
+                pass
+
     def test_too_few_requests(self):
         connection = \
             self._make_connection_for_expected_api_call(_STUB_API_CALL_1)
@@ -280,6 +350,478 @@ class TestMockPortalConnection(object):
         eq_([expected_api_call], connection.api_calls)
 
 
+class TestUnorderedMockPortalConnection(object):
+
+    def test_api_calls_in_any_order(self):
+        connection = UnorderedMockPortalConnection(
+            _ConstantCallable([_STUB_API_CALL_1, _STUB_API_CALL_2]),
+            )
+
+        with connection:
+            connection.send_post_request(_STUB_URL_PATH, None)
+            connection.send_get_request(_STUB_URL_PATH)
+
+        eq_([_STUB_API_CALL_2, _STUB_API_CALL_1], connection.api_calls)
+
+    def test_query_string_args_distinguish_api_calls(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'GET',
+                {'offset': offset},
+                response_body_deserialization=offset,
+                )
+            for offset in (1, 2)
+            ]
+        connection = UnorderedMockPortalConnection(_ConstantCallable(api_calls))
+
+        eq_(2, connection.send_get_request(_STUB_URL_PATH, {'offset': 2}))
+        eq_(1, connection.send_get_request(_STUB_URL_PATH, {'offset': 1}))
+
+    def test_request_bodies_distinguish_api_calls(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'POST',
+                request_body_deserialization={'foo': value},
+                response_body_deserialization=value,
+                )
+            for value in (1, 2)
+            ]
+        connection = UnorderedMockPortalConnection(_ConstantCallable(api_calls))
+
+        eq_(2, connection.send_post_request(_STUB_URL_PATH, {'foo': 2}))
+        eq_(1, connection.send_post_request(_STUB_URL_PATH, {'foo': 1}))
+
+    def test_api_call_multiplicity(self):
+        connection = UnorderedMockPortalConnection(
+            _ConstantCallable([_STUB_API_CALL_1, _STUB_API_CALL_1]),
+            )
+
+        connection.send_get_request(_STUB_URL_PATH)
+
+        with assert_raises_substring(AssertionError, '1 more requests'):
+            with connection:
+                pass
+
+        connection.send_get_request(_STUB_URL_PATH)
+        error_message = 'Unexpected API call GET {!r}'.format(_STUB_URL_PATH)
+        with assert_raises_substring(AssertionError, error_message):
+            connection.send_get_request(_STUB_URL_PATH)
+
+    def test_concurrent_requests(self):
+        thread_count = 8
+        request_count_per_thread = 50
+        api_calls = [
+            SuccessfulAPICall(
+                '/foo/{}'.format(index),
+                'GET',
+                response_body_deserialization={'index': index},
+                )
+            for index in range(thread_count * request_count_per_thread)
+            ]
+        connection = \
+            UnorderedMockPortalConnection(_ConstantCallable(api_calls))
+
+        responses_by_url_path = {}
+
+        def make_requests(thread_index):
+            for index in range(thread_index, len(api_calls), thread_count):
+                url_path = '/foo/{}'.format(index)
+                responses_by_url_path[url_path] = \
+                    connection.send_get_request(url_path)
+
+        threads = [
+            Thread(target=make_requests, args=(thread_index,))
+            for thread_index in range(thread_count)
+            ]
+        with connection:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        eq_(len(api_calls), len(connection.api_calls))
+        for api_call in api_calls:
+            eq_(
+                api_call.response_body_deserialization,
+                responses_by_url_path[api_call.url_path],
+                )
+
+
+class TestMockHubspotServer(object):
+
+    def test_successful_api_calls(self):
+        query_string_args = {'count': 2, 'property': ['email', 'firstname']}
+        request_body_deserialization = {'foo': 'bar'}
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'GET',
+                query_string_args,
+                response_body_deserialization=
+                    _STUB_RESPONSE_BODY_DESERIALIZATION,
+                ),
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'PUT',
+                request_body_deserialization=request_body_deserialization,
+                response_body_deserialization=None,
+                ),
+            ]
+
+        with MockHubspotServer(_ConstantCallable(api_calls)) as server:
+            with make_portal_connection(server.api_url) as connection:
+                response_body_deserialization = \
+                    connection.send_get_request(
+                        _STUB_URL_PATH,
+                        query_string_args,
+                        )
+                eq_(
+                    _STUB_RESPONSE_BODY_DESERIALIZATION,
+                    response_body_deserialization,
+                    )
+
+                response_body_deserialization = connection.send_put_request(
+                    _STUB_URL_PATH,
+                    request_body_deserialization,
+                    )
+                eq_(None, response_body_deserialization)
+
+        eq_(2, len(server.api_calls))
+
+    def test_streamed_request_body(self):
+        request_body_deserialization = {'foo': 'bar'}
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'POST',
+            request_body_deserialization=request_body_deserialization,
+            response_body_deserialization=None,
+            )
+
+        with MockHubspotServer(_ConstantCallable([api_call])) as server:
+            with make_portal_connection(server.api_url) as connection:
+                connection.send_post_request(
+                    _STUB_URL_PATH,
+                    iter([b'{"foo": ', b'"bar"}']),
+                    )
+
+        api_call, = server.api_calls
+        eq_(request_body_deserialization, api_call.request_body_deserialization)
+
+    def test_client_error(self):
+        self._assert_exception_served(
+            HubspotClientError('Invalid property', get_uuid4_str()),
+            )
+
+    def test_authentication_error(self):
+        self._assert_exception_served(
+            HubspotAuthenticationError('Must authenticate', get_uuid4_str()),
+            )
+
+    def test_server_error(self):
+        exception = HubspotServerError('Service Unavailable', 503)
+
+        served_exception = self._assert_exception_served(exception)
+
+        eq_(exception.http_status_code, served_exception.http_status_code)
+
+    def test_rate_limit_error(self):
+        exception = HubspotRateLimitError(
+            'You have reached your secondly limit',
+            get_uuid4_str(),
+            2,
+            )
+
+        served_exception = self._assert_exception_served(exception)
+
+        eq_(429, served_exception.http_status_code)
+        eq_(exception.request_id, served_exception.request_id)
+        eq_(2, served_exception.retry_after)
+        eq_({'retry-after': '2'}, served_exception.response_headers)
+
+    def test_unexpected_api_call(self):
+        server = MockHubspotServer()
+        with assert_raises_substring(AssertionError, 'Not enough API calls'):
+            with server:
+                with make_portal_connection(server.api_url) as connection:
+                    with assert_raises(HubspotServerError):
+                        connection.send_get_request(_STUB_URL_PATH)
+
+    def test_pending_api_calls(self):
+        server = MockHubspotServer(_ConstantCallable([_STUB_API_CALL_1]))
+        with assert_raises_substring(AssertionError, '1 more requests'):
+            with server:
+                pass
+
+    def test_unordered_api_calls(self):
+        server = MockHubspotServer(
+            _ConstantCallable([_STUB_API_CALL_1, _STUB_API_CALL_2]),
+            is_order_significant=False,
+            )
+        with server:
+            with make_portal_connection(server.api_url) as connection:
+                connection.send_post_request(_STUB_URL_PATH, None)
+                connection.send_get_request(_STUB_URL_PATH)
+
+    def test_latency(self):
+        latency = 0.05
+        server = MockHubspotServer(
+            _ConstantCallable([_STUB_API_CALL_1]),
+            latency=_ConstantCallable(latency),
+            )
+        with server:
+            with make_portal_connection(server.api_url) as connection:
+                start_time = time()
+                connection.send_get_request(_STUB_URL_PATH)
+                ok_(latency <= time() - start_time)
+
+    def test_connection_drops(self):
+        server = MockHubspotServer(connection_drop_rate=1)
+        with server:
+            with make_portal_connection(server.api_url) as connection:
+                with assert_raises(ConnectionError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+    def test_max_throughput(self):
+        response_body_deserialization = {'foo': 'x' * 20000}
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization=response_body_deserialization,
+            )
+        server = MockHubspotServer(
+            _ConstantCallable([api_call]),
+            max_throughput=100000,
+            )
+        with server:
+            with make_portal_connection(server.api_url) as connection:
+                start_time = time()
+                connection.send_get_request(_STUB_URL_PATH)
+                ok_(0.15 <= time() - start_time)
+
+    def test_unexpected_option(self):
+        with assert_raises_substring(AssertionError, "['foo']"):
+            MockHubspotServer(foo='bar')
+
+    @staticmethod
+    def _assert_exception_served(exception):
+        api_call = \
+            UnsuccessfulAPICall(_STUB_URL_PATH, 'GET', exception=exception)
+
+        with MockHubspotServer(_ConstantCallable([api_call])) as server:
+            with make_portal_connection(server.api_url) as connection:
+                with assert_raises(type(exception)) as context_manager:
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        served_exception = context_manager.exception
+        eq_(str(exception), str(served_exception))
+        return served_exception
+
+
+class TestCassettes(object):
+
+    def test_successful_api_calls(self):
+        query_string_args = {'count': 2}
+        request_body_deserialization = {'foo': 'bar'}
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'GET',
+                query_string_args,
+                response_body_deserialization=
+                    _STUB_RESPONSE_BODY_DESERIALIZATION,
+                ),
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'POST',
+                request_body_deserialization=request_body_deserialization,
+                response_body_deserialization=None,
+                ),
+            ]
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            self._record_cassette(cassette_path, api_calls)
+
+            with ReplayingPortalConnection(cassette_path) as connection:
+                response_body_deserialization = connection.send_post_request(
+                    _STUB_URL_PATH,
+                    request_body_deserialization,
+                    )
+                eq_(None, response_body_deserialization)
+
+                response_body_deserialization = connection.send_get_request(
+                    _STUB_URL_PATH,
+                    query_string_args,
+                    )
+                eq_(
+                    _STUB_RESPONSE_BODY_DESERIALIZATION,
+                    response_body_deserialization,
+                    )
+
+                eq_(list(reversed(api_calls)), connection.api_calls)
+
+    def test_streamed_request_body(self):
+        request_body_deserialization = {'foo': 'bar'}
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'POST',
+            request_body_deserialization=request_body_deserialization,
+            response_body_deserialization=None,
+            )
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            mock_connection = \
+                MockPortalConnection(_ConstantCallable([api_call]))
+            recording_connection = \
+                RecordingPortalConnection(mock_connection, cassette_path)
+            with recording_connection:
+                recording_connection.send_post_request(
+                    _STUB_URL_PATH,
+                    iter([b'{"foo": ', b'"bar"}']),
+                    )
+
+            with ReplayingPortalConnection(cassette_path) as connection:
+                connection.send_post_request(
+                    _STUB_URL_PATH,
+                    memoryview(b'{"foo": "bar"}'),
+                    )
+
+                eq_([api_call], connection.api_calls)
+
+    def test_unsuccessful_api_call(self):
+        exception = HubspotServerError('Bad Gateway', 502)
+        api_call = \
+            UnsuccessfulAPICall(_STUB_URL_PATH, 'GET', exception=exception)
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            self._record_cassette(cassette_path, [api_call])
+
+            connection = ReplayingPortalConnection(cassette_path)
+            with assert_raises(HubspotServerError) as context_manager:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        replayed_exception = context_manager.exception
+        eq_(exception.msg, replayed_exception.msg)
+        eq_(exception.http_status_code, replayed_exception.http_status_code)
+        eq_(str(exception), str(replayed_exception))
+
+    def test_exception_metadata(self):
+        exception = HubspotRateLimitError('Slow down', get_uuid4_str(), 1)
+        exception.elapsed_time = 0.25
+        exception.response_headers = {'retry-after': '1'}
+        api_call = \
+            UnsuccessfulAPICall(_STUB_URL_PATH, 'GET', exception=exception)
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            self._record_cassette(cassette_path, [api_call])
+
+            connection = ReplayingPortalConnection(cassette_path)
+            with assert_raises(HubspotRateLimitError) as context_manager:
+                connection.send_get_request(_STUB_URL_PATH)
+
+        replayed_exception = context_manager.exception
+        eq_(exception.request_id, replayed_exception.request_id)
+        eq_(1, replayed_exception.retry_after)
+        eq_(0.25, replayed_exception.elapsed_time)
+        eq_({'retry-after': '1'}, replayed_exception.response_headers)
+
+    def test_repeated_api_calls(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'GET',
+                response_body_deserialization={'page': 1},
+                ),
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'GET',
+                response_body_deserialization={'page': 2},
+                ),
+            ]
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            self._record_cassette(cassette_path, api_calls)
+
+            connection = ReplayingPortalConnection(cassette_path)
+            eq_({'page': 1}, connection.send_get_request(_STUB_URL_PATH))
+            eq_({'page': 2}, connection.send_get_request(_STUB_URL_PATH))
+
+            error_message = "No recorded API call for GET {!r}".format(
+                _STUB_URL_PATH,
+                )
+            with assert_raises_substring(AssertionError, error_message):
+                connection.send_get_request(_STUB_URL_PATH)
+
+    def test_credentials_not_recorded(self):
+        api_key = get_uuid4_str()
+        query_string_args = {'hapikey': api_key}
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            query_string_args,
+            response_body_deserialization=_STUB_RESPONSE_BODY_DESERIALIZATION,
+            )
+        mock_connection = MockPortalConnection(_ConstantCallable([api_call]))
+
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            with RecordingPortalConnection(mock_connection, cassette_path) \
+                    as connection:
+                connection.send_get_request(_STUB_URL_PATH, query_string_args)
+
+            with open(cassette_path, 'rb') as cassette_file:
+                cassette_contents = cassette_file.read().decode('UTF-8')
+            assert_not_in(api_key, cassette_contents)
+
+            connection = ReplayingPortalConnection(cassette_path)
+            response_body_deserialization = \
+                connection.send_get_request(_STUB_URL_PATH, query_string_args)
+            eq_(
+                _STUB_RESPONSE_BODY_DESERIALIZATION,
+                response_body_deserialization,
+                )
+
+    def test_empty_cassette(self):
+        with make_temporary_directory() as directory_path:
+            cassette_path = join_path(directory_path, 'cassette')
+            self._record_cassette(cassette_path, [])
+
+            with ReplayingPortalConnection(cassette_path) as connection:
+                with assert_raises(AssertionError):
+                    connection.send_get_request(_STUB_URL_PATH)
+
+    @staticmethod
+    def _record_cassette(cassette_path, api_calls):
+        mock_connection = MockPortalConnection(_ConstantCallable(api_calls))
+        recording_connection = \
+            RecordingPortalConnection(mock_connection, cassette_path)
+        with recording_connection:
+            for api_call in api_calls:
+                request_sender = getattr(
+                    recording_connection,
+                    'send_{}_request'.format(api_call.http_method.lower()),
+                    )
+                request_sender_args = [api_call.url_path]
+                if api_call.http_method == 'GET':
+                    request_sender_args.append(api_call.query_string_args)
+                elif api_call.http_method in ('POST', 'PUT'):
+                    request_sender_args.append(
+                        api_call.request_body_deserialization,
+                        )
+
+                try:
+                    request_sender(*request_sender_args)
+                except HubspotException:
+                    pass
+
+
+
 def _assert_dict_keys_and_values_are_unicode(dict_):
     values = list(dict_.keys()) + list(dict_.values())
     for value in values:
@@ -295,3 +837,18 @@ class _ConstantCallable(object):
 
     def __call__(self):
         return self._return_value
+
+
+class _CountingAPICallsSimulator(object):
+    """Infinite simulator which counts the API calls it has generated."""
+
+    def __init__(self, api_call):
+        super(_CountingAPICallsSimulator, self).__init__()
+
+        self._api_call = api_call
+        self.api_call_count = 0
+
+    def __call__(self):
+        while True:
+            self.api_call_count += 1
+            yield self._api_call
@@ -0,0 +1,494 @@
+##############################################################################
+#
+# Copyright (c) 2014, 2degrees Limited.
+# All Rights Reserved.
+#
+# This file is part of hubspot-connection
+# <https://github.com/2degrees/hubspot-connection>, which is subject to the
+# provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+from os.path import join as join_path
+from time import sleep
+from time import time
+
+from nose.tools import eq_
+from nose.tools import ok_
+
+from hubspot.connection.concurrency import PRIORITY_CLASS_BULK
+from hubspot.connection.concurrency import RequestPriority
+from hubspot.connection.exc import HubspotClientError
+from hubspot.connection.exc import HubspotRateLimitError
+from hubspot.connection.exc import HubspotServerError
+from hubspot.connection.testing import MockPortalConnection
+from hubspot.connection.testing import SuccessfulAPICall
+from hubspot.connection.testing import UnsuccessfulAPICall
+from hubspot.connection.write_queue import SQLiteWriteQueue
+from hubspot.connection.write_queue import WriteQueueingPortalConnection
+from hubspot.connection.write_queue import WriteQueueStatus
+from hubspot.connection.write_queue import WriteQueueWorkerPool
+
+from tests.utils import get_uuid4_str
+from tests.utils import make_temporary_directory
+
+
+_STUB_URL_PATH = '/contacts/v1/contact'
+
+_STUB_BODY_DESERIALIZATION = {'properties': [{'property': 'email'}]}
+
+_STUB_PRIORITY = RequestPriority(PRIORITY_CLASS_BULK, 'tenant')
+
+
+class TestSQLiteWriteQueue(object):
+
+    def test_empty_queue(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+
+            eq_(None, write_queue.claim())
+            eq_(WriteQueueStatus(0, 0, 0), write_queue.get_status())
+
+    def test_claim(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_id = write_queue.enqueue(
+                'POST',
+                _STUB_URL_PATH,
+                _STUB_BODY_DESERIALIZATION,
+                _STUB_PRIORITY,
+                )
+
+            queued_write = write_queue.claim()
+
+        eq_(write_id, queued_write.write_id)
+        eq_('POST', queued_write.http_method)
+        eq_(_STUB_URL_PATH, queued_write.url_path)
+        eq_(_STUB_BODY_DESERIALIZATION, queued_write.body_deserialization)
+        eq_(_STUB_PRIORITY, queued_write.priority)
+        eq_(1, queued_write.attempt_count)
+
+    def test_claim_order(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue('DELETE', '/a')
+            write_queue.enqueue('DELETE', '/b')
+
+            eq_('/a', write_queue.claim().url_path)
+            eq_('/b', write_queue.claim().url_path)
+            eq_(None, write_queue.claim())
+
+    def test_expired_lease(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path, lease_duration=0)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            write_queue.claim()
+            queued_write = write_queue.claim()
+
+        eq_(2, queued_write.attempt_count)
+
+    def test_completion(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path, lease_duration=0)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            write_queue.complete(write_queue.claim().write_id)
+
+            eq_(None, write_queue.claim())
+            eq_(WriteQueueStatus(0, 0, 0), write_queue.get_status())
+
+    def test_retry(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path, retry_delay=0.05)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotServerError('Service Unavailable', 503),
+                )
+
+            eq_(None, write_queue.claim())
+            sleep(0.05)
+            queued_write = write_queue.claim()
+
+        eq_(2, queued_write.attempt_count)
+        eq_(
+            'HubspotServerError: Service Unavailable',
+            queued_write.error_message,
+            )
+
+    def test_retry_delay_doubling(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _FrozenTimeWriteQueue(
+                join_path(directory_path, 'writes'),
+                retry_delay=1,
+                max_retry_delay=3,
+                )
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            retry_delays = []
+            for _ in range(3):
+                write_queue.fail(write_queue.claim(), IOError())
+                retry_delays.append(write_queue.get_retry_delay())
+
+        eq_([1, 2, 3], retry_delays)
+
+    def test_rate_limit_error(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _FrozenTimeWriteQueue(
+                join_path(directory_path, 'writes'),
+                max_client_error_count=1,
+                )
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotRateLimitError('Slow down', get_uuid4_str(), 10),
+                )
+
+            eq_(10, write_queue.get_retry_delay())
+            eq_(0, write_queue.get_status().dead_letter_count)
+
+    def test_dead_letter(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(
+                directory_path,
+                retry_delay=0,
+                max_client_error_count=2,
+                )
+            write_id = write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            for _ in range(2):
+                write_queue.fail(
+                    write_queue.claim(),
+                    HubspotClientError('Invalid', get_uuid4_str()),
+                    )
+
+            eq_(None, write_queue.claim())
+            eq_(1, write_queue.get_status().dead_letter_count)
+            eq_(0, write_queue.get_status().pending_write_count)
+
+            dead_letter, = write_queue.get_dead_letters()
+            eq_(write_id, dead_letter.write_id)
+            eq_(2, dead_letter.attempt_count)
+            eq_('HubspotClientError: Invalid', dead_letter.error_message)
+
+    def test_client_error_after_server_errors(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(
+                directory_path,
+                retry_delay=0,
+                max_client_error_count=2,
+                )
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            for _ in range(2):
+                write_queue.fail(
+                    write_queue.claim(),
+                    HubspotServerError('Service Unavailable', 503),
+                    )
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotClientError('Invalid', get_uuid4_str()),
+                )
+
+            eq_(0, write_queue.get_status().dead_letter_count)
+
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotClientError('Invalid', get_uuid4_str()),
+                )
+
+            eq_(1, write_queue.get_status().dead_letter_count)
+
+    def test_requeued_dead_letters(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(
+                directory_path,
+                max_client_error_count=1,
+                )
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotClientError('Invalid', get_uuid4_str()),
+                )
+
+            write_queue.requeue_dead_letters()
+
+            eq_([], write_queue.get_dead_letters())
+            eq_(1, write_queue.claim().attempt_count)
+
+    def test_discarded_dead_letters(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(
+                directory_path,
+                max_client_error_count=1,
+                )
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+            write_queue.fail(
+                write_queue.claim(),
+                HubspotClientError('Invalid', get_uuid4_str()),
+                )
+
+            write_queue.discard_dead_letters()
+
+            eq_(WriteQueueStatus(0, 0, 0), write_queue.get_status())
+
+    def test_pre_serialized_body(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue('POST', _STUB_URL_PATH, b'{"a": 1}')
+            write_queue.enqueue(
+                'POST',
+                _STUB_URL_PATH,
+                memoryview(bytearray(b'{"a": 2}')),
+                )
+
+            queued_writes = [write_queue.claim() for _ in range(2)]
+
+        eq_(
+            [b'{"a": 1}', b'{"a": 2}'],
+            [
+                queued_write.body_deserialization
+                for queued_write in queued_writes
+                ],
+            )
+
+    def test_streamed_body(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue(
+                'POST',
+                _STUB_URL_PATH,
+                iter([b'{"a": ', b'1}']),
+                )
+
+            queued_write = write_queue.claim()
+
+        eq_(b'{"a": 1}', queued_write.body_deserialization)
+
+    def test_tenant_type(self):
+        priority = RequestPriority(PRIORITY_CLASS_BULK, 42)
+
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH, priority=priority)
+
+            queued_write = write_queue.claim()
+
+        eq_(priority, queued_write.priority)
+        eq_(42, queued_write.priority.tenant)
+
+    def test_lag(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+            sleep(0.05)
+            write_queue.enqueue('DELETE', _STUB_URL_PATH)
+
+            status = write_queue.get_status()
+
+        eq_(2, status.pending_write_count)
+        ok_(0.05 <= status.lag < 1)
+
+    def test_persistence(self):
+        with make_temporary_directory() as directory_path:
+            _make_write_queue(directory_path).enqueue('DELETE', _STUB_URL_PATH)
+
+            queued_write = _make_write_queue(directory_path).claim()
+
+        eq_(_STUB_URL_PATH, queued_write.url_path)
+
+
+class TestWriteQueueWorkerPool(object):
+
+    def test_writes_sent(self):
+        api_calls = [
+            SuccessfulAPICall(
+                _STUB_URL_PATH,
+                'POST',
+                request_body_deserialization=_STUB_BODY_DESERIALIZATION,
+                response_body_deserialization={'vid': 1},
+                ),
+            SuccessfulAPICall(
+                '/contacts/v1/contact/vid/1/profile',
+                'POST',
+                request_body_deserialization=_STUB_BODY_DESERIALIZATION,
+                response_body_deserialization=None,
+                ),
+            SuccessfulAPICall(
+                '/contacts/v1/contact/vid/1',
+                'DELETE',
+                response_body_deserialization=None,
+                ),
+            ]
+        connection = MockPortalConnection(lambda: api_calls)
+
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            for api_call in api_calls:
+                write_queue.enqueue(
+                    api_call.http_method,
+                    api_call.url_path,
+                    api_call.request_body_deserialization,
+                    )
+
+            with WriteQueueWorkerPool(connection, write_queue, worker_count=1):
+                _wait_for_empty_queue(write_queue)
+
+        eq_(api_calls, connection.api_calls)
+
+    def test_failed_write(self):
+        api_calls = [
+            UnsuccessfulAPICall(
+                '/contacts/v1/contact/vid/1',
+                'DELETE',
+                exception=HubspotServerError('Service Unavailable', 503),
+                ),
+            SuccessfulAPICall(
+                '/contacts/v1/contact/vid/1',
+                'DELETE',
+                response_body_deserialization=None,
+                ),
+            ]
+        connection = MockPortalConnection(lambda: api_calls)
+
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path, retry_delay=0)
+            write_queue.enqueue('DELETE', '/contacts/v1/contact/vid/1')
+
+            worker_pool = WriteQueueWorkerPool(
+                connection,
+                write_queue,
+                worker_count=2,
+                poll_interval=0.01,
+                )
+            with worker_pool:
+                _wait_for_empty_queue(write_queue)
+
+        eq_(api_calls, connection.api_calls)
+
+    def test_priority(self):
+        connection = _PriorityRecordingConnection()
+
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            write_queue.enqueue(
+                'DELETE',
+                _STUB_URL_PATH,
+                priority=_STUB_PRIORITY,
+                )
+
+            with WriteQueueWorkerPool(connection, write_queue):
+                _wait_for_empty_queue(write_queue)
+
+        eq_([_STUB_PRIORITY], connection.priorities)
+
+
+class TestWriteQueueingPortalConnection(object):
+
+    def test_writes_enqueued(self):
+        with make_temporary_directory() as directory_path:
+            write_queue = _make_write_queue(directory_path)
+            connection = WriteQueueingPortalConnection(
+                MockPortalConnection(),
+                write_queue,
+                )
+
+            with connection:
+                response_body_deserialization = connection.send_post_request(
+                    _STUB_URL_PATH,
+                    _STUB_BODY_DESERIALIZATION,
+                    )
+                connection.send_put_request(
+                    _STUB_URL_PATH,
+                    _STUB_BODY_DESERIALIZATION,
+                    priority=_STUB_PRIORITY,
+                    )
+                connection.send_delete_request(_STUB_URL_PATH)
+
+            queued_writes = [write_queue.claim() for _ in range(3)]
+
+        eq_(None, response_body_deserialization)
+        eq_(
+            ['POST', 'PUT', 'DELETE'],
+            [queued_write.http_method for queued_write in queued_writes],
+            )
+        eq_(
+            [_STUB_BODY_DESERIALIZATION, _STUB_BODY_DESERIALIZATION, None],
+            [
+                queued_write.body_deserialization
+                for queued_write in queued_writes
+                ],
+            )
+        eq_(_STUB_PRIORITY, queued_writes[1].priority)
+
+    def test_get_request(self):
+        api_call = SuccessfulAPICall(
+            _STUB_URL_PATH,
+            'GET',
+            response_body_deserialization={'vid': 1},
+            )
+
+        with make_temporary_directory() as directory_path:
+            connection = WriteQueueingPortalConnection(
+                MockPortalConnection(lambda: [api_call]),
+                _make_write_queue(directory_path),
+                )
+            with connection:
+                response_body_deserialization = \
+                    connection.send_get_request(_STUB_URL_PATH)
+
+        eq_({'vid': 1}, response_body_deserialization)
+
+
+class _FrozenTimeWriteQueue(SQLiteWriteQueue):
+
+    _CURRENT_TIME = 1400000000.0
+
+    def claim(self):
+        # Make the write available again, whatever its retry delay
+        with self._connect() as database_connection:
+            database_connection.execute('UPDATE writes SET available_time = 0')
+        return super(_FrozenTimeWriteQueue, self).claim()
+
+    def get_retry_delay(self):
+        with self._connect() as database_connection:
+            available_time, = database_connection.execute(
+                'SELECT available_time FROM writes',
+                ).fetchone()
+        return available_time - self._CURRENT_TIME
+
+    @classmethod
+    def _get_current_time(cls):
+        return cls._CURRENT_TIME
+
+
+class _PriorityRecordingConnection(object):
+
+    def __init__(self):
+        super(_PriorityRecordingConnection, self).__init__()
+
+        self.priorities = []
+
+    def send_delete_request(self, url_path, priority=None):
+        self.priorities.append(priority)
+
+
+def _make_write_queue(directory_path, **kwargs):
+    database_path = join_path(directory_path, 'writes')
+    write_queue = SQLiteWriteQueue(database_path, **kwargs)
+    return write_queue
+
+
+def _wait_for_empty_queue(write_queue, timeout=5):
+    deadline = time() + timeout
+    while write_queue.get_status().pending_write_count:
+        assert time() < deadline, 'The queue was not drained'
+        sleep(0.01)
@@ -14,10 +14,17 @@
 #
 ##############################################################################
 
+from contextlib import contextmanager
 from re import escape as escape_regexp
+from shutil import rmtree
+from tempfile import mkdtemp
 from uuid import uuid4 as get_uuid4
 
 from nose.tools import assert_raises_regexp
+from nose.tools import ok_
+
+from hubspot.connection import APIKey
+from hubspot.connection import PortalConnection
 
 
 def get_uuid4_str():
@@ -25,6 +32,18 @@ def get_uuid4_str():
     return str(uuid4)
 
 
+def assert_approximately_equal(
+    expected_value,
+    actual_value,
+    relative_tolerance=0.02,
+    ):
+    ok_(
+        abs(expected_value - actual_value) <=
+        expected_value * relative_tolerance,
+        '{!r} != {!r}'.format(expected_value, actual_value),
+        )
+
+
 def assert_raises_substring(
     exception_class,
     exception_message_substring,
@@ -39,3 +58,41 @@ def assert_raises_substring(
         *args,
         **kwargs
         )
+
+
+@contextmanager
+def make_temporary_directory():
+    directory_path = mkdtemp()
+    try:
+        yield directory_path
+    finally:
+        rmtree(directory_path)
+
+
+def make_portal_connection(api_url, **kwargs):
+    connection = PortalConnection(
+        APIKey(get_uuid4_str()),
+        'Testing',
+        api_url=api_url,
+        **kwargs
+        )
+    return connection
+
+
+class MemoryCheckpointStore(object):
+
+    def __init__(self):
+        super(MemoryCheckpointStore, self).__init__()
+
+        self.cursors_by_checkpoint_name = {}
+        self.updates = []
+
+    def get(self, checkpoint_name):
+        return self.cursors_by_checkpoint_name.get(checkpoint_name)
+
+    def set(self, checkpoint_name, cursor):
+        self.cursors_by_checkpoint_name[checkpoint_name] = cursor
+        self.updates.append((checkpoint_name, cursor))
+
+    def delete(self, checkpoint_name):
+        self.cursors_by_checkpoint_name.pop(checkpoint_name, None)